@@ -0,0 +1,230 @@
+import io
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+import server
+
+# --- Asyncio Server Mode ---
+# An ASGI app with the same routes as server.py, for event loop servers such
+# as uvicorn:
+#
+#   uvicorn asgi_server:app --port 5001
+#
+# Long-polls (/events) wait on the event loop, so an idle client costs a
+# coroutine instead of a worker thread. Every other route runs its Flask
+# view in a bounded thread pool, which also keeps blocking work off the
+# loop: save file and database I/O in save_user_data, and the SQLite state
+# backend. It reads the same server.json and saves as server.py. With the
+# SQLite state backend both can serve the same players side by side.
+
+ASGI_THREADS = server.config.get("asgi_threads", 32)
+EXECUTOR = ThreadPoolExecutor(
+    max_workers=ASGI_THREADS,
+    thread_name_prefix="asgi-worker"
+)
+
+class AsyncEvents:
+    """Wakes coroutines parked in /events when server.EVENTS publishes.
+
+    `publish` runs on worker threads, so it hands the wakeup to the loop.
+    Waiters take the current asyncio.Event before checking for news, so a
+    publish that lands between the check and the wait isn't missed.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, event, timeout):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+ASYNC_EVENTS = None
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, func, *args)
+
+# --- Long-Poll on the Event Loop ---
+async def handle_events(scope, send):
+    start = time.perf_counter()
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1")))
+    username, since_id, timeout, limit = server.parse_events_args(args)
+    ip = scope["client"][0] if scope.get("client") else ""
+
+    # What the Flask before_request hooks do for every other route
+    if await run_blocking(server.STATE.is_restricted, "banned_ip", ip):
+        await send_json(send, 403, {"status": "error", "message": "You are banned."}, "/events", start)
+        return
+    wait = server.rate_limit_wait("/events", username, ip)
+    if wait:
+        headers = [(b"retry-after", str(max(1, math.ceil(wait))).encode("latin-1"))]
+        await send_json(send, 429, {"status": "error", "message": "Too many requests, slow down."}, "/events", start, headers)
+        return
+    if username:
+        await run_blocking(server.STATE.touch, username)
+    if not server.LONG_POLL_ADMISSION.try_enter():
+        # Too many parked already, answer now like server.get_events does
+        events = await run_blocking(server.collect_events, username, since_id, limit)
+        events = await run_blocking(server.finish_events, username, events, True)
+        await send_json(send, 200, events, "/events", start)
+        return
+    try:
+        await park_events(username, since_id, timeout, limit, send, start)
+    finally:
+        server.LONG_POLL_ADMISSION.leave()
+
+async def park_events(username, since_id, timeout, limit, send, start):
+    # With a shared state backend other processes can change things without
+    # a local publish, so re-check every poll_interval like EventHub.wait does
+    poll_interval = server.EVENTS.poll_interval
+    deadline = time.monotonic() + timeout
+    while True:
+        event = ASYNC_EVENTS.event
+        events = await run_blocking(server.collect_events, username, since_id, limit)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            break
+        await ASYNC_EVENTS.wait(event, remaining if poll_interval is None else min(poll_interval, remaining))
+
+    events = await run_blocking(server.finish_events, username, events)
+    await send_json(send, 200, events, "/events", start)
+
+async def send_json(send, status, data, path, start, headers=()):
+    headers = [(b"content-type", b"application/json"), *headers]
+    await send_response(send, status, headers, json.dumps(data).encode("utf-8"))
+    server.HTTP_LATENCY.observe(time.perf_counter() - start, path)
+    server.HTTP_REQUESTS.inc(path, "GET", status)
+
+# --- Everything Else Through the Flask App ---
+def wsgi_environ(scope, body):
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+def call_flask(environ):
+    """Runs the request through server.app on a worker thread. Returns (status, headers, body)."""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+    chunks = server.app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return response["status"], response["headers"], body
+
+async def handle_flask(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    status, headers, body = await run_blocking(call_flask, wsgi_environ(scope, body))
+    await send_response(send, status, headers, body)
+
+async def send_response(send, status, headers, body):
+    headers = list(headers)
+    if not any(name.lower() == b"content-length" for name, _ in headers):
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+# --- Startup ---
+def startup():
+    print("Server: Starting up (asyncio mode)...")
+    # Here the Flask routes run on the executor's threads, and a parked
+    # long-poll only costs a coroutine, so the caps server.py derives from
+    # its own thread count don't apply
+    server.ADMISSION.limit = min(server.config.get("max_concurrent_requests", ASGI_THREADS - 1), ASGI_THREADS - 1)
+    server.LONG_POLL_ADMISSION.limit = server.config.get("max_long_polls", 512)
+    if not os.path.exists("cloud_saves"):
+        os.makedirs("cloud_saves")
+    server.start_background_loading()
+    server.start_presence_expiry()
+    server.start_moderation_expiry()
+
+async def lifespan(receive, send):
+    global ASYNC_EVENTS
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            ASYNC_EVENTS = AsyncEvents(asyncio.get_running_loop())
+            server.EVENTS.add_listener(ASYNC_EVENTS.notify)
+            await run_blocking(startup)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await run_blocking(server.PLAYER_STORE.flush)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        if scope["path"] == "/events" and scope["method"] == "GET":
+            await handle_events(scope, send)
+        else:
+            await handle_flask(scope, receive, send)
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        print("The asyncio server mode needs uvicorn: pip install uvicorn")
+        sys.exit(1)
+    uvicorn.run(
+        app,
+        host=server.config.get("host", "127.0.0.1"),
+        port=server.config.get("asgi_port", server.config.get("port", 5000)),
+        log_level="warning"
+    )
+
+if __name__ == "__main__":
+    main()
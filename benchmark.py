@@ -0,0 +1,281 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import requests
+
+# --- Load Test for the FusionBytes Server ---
+# Starts server.app under waitress in a scratch directory and simulates N
+# main.py-style clients against it: the chat/kick poll loop, a mix of
+# commands, chat bursts and saves. Reports throughput, latency percentiles
+# per endpoint and the server's memory over time, and writes the results as
+# JSON so runs can be compared across commits:
+#
+#   python benchmark.py --clients 50 --duration 30
+#   python benchmark.py --clients 500 --poll-mode events --server asgi
+#   python benchmark.py --compare bench_results/old.json bench_results/new.json
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMAND_MIX = [
+    ("ls", []),
+    ("cd", ["documents"]),
+    ("cat", ["mission1.txt"]),
+    ("cd", [".."]),
+    ("echo", ["ping"]),
+    ("missions", []),
+]
+
+class Recorder:
+    """Collects request latencies per endpoint from every client thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def call(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = func(*args, **kwargs)
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            response = None
+            ok = False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+        return response
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(round(fraction * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+# --- Server Process ---
+def prepare_workdir():
+    """A scratch copy of what the server reads at startup, so runs don't touch real saves."""
+    workdir = tempfile.mkdtemp(prefix="fusionbytes-bench-")
+    for name in ("server.json", "mission_bits.json"):
+        if os.path.exists(os.path.join(REPO_DIR, name)):
+            shutil.copy(os.path.join(REPO_DIR, name), workdir)
+    for name in ("missions", "templates"):
+        shutil.copytree(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    # Every simulated client connects from localhost, keep the per-IP budgets out of the way
+    config_path = os.path.join(workdir, "server.json")
+    with open(config_path, "r") as f:
+        config = json.load(f)
+    config["rate_limit_trusted_ips"] = ["127.0.0.1"]
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+    os.makedirs(os.path.join(workdir, "cloud_saves"))
+    return workdir
+
+def start_server(workdir, port, threads, kind="waitress"):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    # The server sizes its long-poll cap from the thread count, so it has to know it
+    with open(os.path.join(workdir, "server.json"), "r") as f:
+        config = json.load(f)
+    config["threads"] = threads
+    config["asgi_threads"] = threads
+    with open(os.path.join(workdir, "server.json"), "w") as f:
+        json.dump(config, f)
+    if kind == "asgi":
+        command = [sys.executable, "-m", "uvicorn", f"--port={port}", "--log-level=warning", "asgi_server:app"]
+    else:
+        command = [sys.executable, "-m", "waitress", f"--port={port}", f"--threads={threads}", "server:app"]
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/get_commands", timeout=1)
+            return process, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start")
+
+def rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+# --- Simulated Clients ---
+def run_client(index, url, args, recorder, stop):
+    session = requests.Session()
+    username = f"bench_{index}"
+    recorder.call("/register_user", session.post, f"{url}/register_user", json={"username": username})
+    recorder.call("/reconnect", session.post, f"{url}/reconnect", json={"username": username})
+
+    poller = threading.Thread(target=run_poller, args=(url, username, args, recorder, stop), daemon=True)
+    poller.start()
+
+    rng = random.Random(index)
+    last_save = time.time()
+    while not stop.is_set():
+        if rng.random() < args.chat_ratio:
+            # Chat comes in bursts, like people replying to each other
+            for _ in range(rng.randint(1, args.chat_burst)):
+                payload = {"command": "chat", "args": ["hello", "from", username], "username": username}
+                recorder.call("/check_command chat", session.post, f"{url}/check_command", json=payload)
+        else:
+            command, command_args = rng.choice(COMMAND_MIX)
+            payload = {"command": command, "args": command_args, "username": username}
+            recorder.call(f"/check_command {command}", session.post, f"{url}/check_command", json=payload)
+
+        if time.time() - last_save > args.save_interval:
+            payload = {"username": username, "data": {"progress": "some_data", "location": ["root", "home", "user"]}}
+            recorder.call("/save", session.post, f"{url}/save", json=payload)
+            last_save = time.time()
+        stop.wait(rng.uniform(0, 2 * args.think_time))
+    poller.join()
+
+def run_poller(url, username, args, recorder, stop):
+    session = requests.Session()
+    last_id = 0
+    while not stop.is_set():
+        if args.poll_mode == "events":
+            params = {"username": username, "since_id": last_id, "timeout": args.poll_interval}
+            response = recorder.call("/events", session.get, f"{url}/events", params=params, timeout=args.poll_interval + 5)
+        else:
+            recorder.call("/check_kick", session.post, f"{url}/check_kick", json={"username": username})
+            params = {"username": username, "since_id": last_id}
+            response = recorder.call("/get_new_chat_messages", session.get, f"{url}/get_new_chat_messages", params=params)
+        if response is not None and response.status_code == 200:
+            messages = response.json().get("messages", [])
+            if messages:
+                last_id = messages[-1]["id"]
+        if args.poll_mode == "poll":
+            stop.wait(args.poll_interval)
+
+# --- Reporting ---
+def summarize(recorder, duration):
+    endpoints = {}
+    total = 0
+    for name, values in sorted(recorder.latencies.items()):
+        values = sorted(values)
+        total += len(values)
+        endpoints[name] = {
+            "count": len(values),
+            "errors": recorder.errors.get(name, 0),
+            "throughput": len(values) / duration,
+            "mean_ms": 1000 * sum(values) / len(values),
+            "p50_ms": 1000 * percentile(values, 0.50),
+            "p95_ms": 1000 * percentile(values, 0.95),
+            "p99_ms": 1000 * percentile(values, 0.99),
+        }
+    return endpoints, total / duration
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(result):
+    print(f"Commit {result['commit']}: {result['total_throughput']:.1f} req/s over {result['duration']:.0f}s "
+          f"with {result['config']['clients']} clients")
+    print(f"{'endpoint':<32}{'count':>8}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["endpoints"].items():
+        print(f"{name:<32}{stats['count']:>8}{stats['errors']:>6}"
+              f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    memory = [sample["rss_kb"] for sample in result["memory"] if sample["rss_kb"] is not None]
+    if memory:
+        print(f"Server RSS: {memory[0] / 1024:.1f} MB -> {memory[-1] / 1024:.1f} MB (peak {max(memory) / 1024:.1f} MB)")
+
+def compare(old_path, new_path):
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+    print(f"{old['commit']} -> {new['commit']}")
+    print(f"throughput: {old['total_throughput']:.1f} -> {new['total_throughput']:.1f} req/s")
+    for name, stats in new["endpoints"].items():
+        before = old["endpoints"].get(name)
+        if before is None:
+            continue
+        change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+        print(f"{name:<32} p95 {before['p95_ms']:>8.2f} -> {stats['p95_ms']:>8.2f} ms ({change:+.0f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the FusionBytes server.")
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--server", choices=["waitress", "asgi"], default="waitress",
+                        help="server.py under waitress, or asgi_server.py under uvicorn")
+    parser.add_argument("--threads", type=int, default=32, help="worker threads")
+    parser.add_argument("--poll-mode", choices=["poll", "events"], default="poll")
+    parser.add_argument("--poll-interval", type=float, default=3)
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between commands")
+    parser.add_argument("--chat-ratio", type=float, default=0.1)
+    parser.add_argument("--chat-burst", type=int, default=5)
+    parser.add_argument("--save-interval", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_results", help="directory for the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    random.seed(args.seed)
+    workdir = prepare_workdir()
+    process, url = start_server(workdir, args.port, args.threads, args.server)
+    recorder = Recorder()
+    stop = threading.Event()
+    memory = []
+    try:
+        clients = [
+            threading.Thread(target=run_client, args=(i, url, args, recorder, stop), daemon=True)
+            for i in range(args.clients)
+        ]
+        start = time.time()
+        for client in clients:
+            client.start()
+        while time.time() - start < args.duration:
+            memory.append({"t": round(time.time() - start, 1), "rss_kb": rss_kb(process.pid)})
+            time.sleep(1)
+        stop.set()
+        for client in clients:
+            client.join(args.poll_interval + 10)
+        duration = time.time() - start
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    endpoints, total_throughput = summarize(recorder, duration)
+    result = {
+        "commit": git_commit(),
+        "timestamp": time.time(),
+        "duration": duration,
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "out")},
+        "total_throughput": total_throughput,
+        "endpoints": endpoints,
+        "memory": memory,
+    }
+    print_report(result)
+
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit']}.json")
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results saved to {out_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import os
+import re
+import json
+import time
+import bisect
+import calendar
+import threading
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: only one server process may write the archive
+
+# --- Chat Archive ---
+# Every chat message, kept for moderation long after it has left the chat
+# log. Messages are appended to one file per time window (a segment, a day
+# by default) as JSON lines:
+#
+#   chat_archive/chat-20261017-00.log
+#   chat_archive/chat-20261017-00.idx
+#
+# Once a segment is complete its index is written next to it: where each
+# message starts, its timestamp, and posting lists by sender and by word.
+# A search only opens the segments inside its time range and only reads the
+# messages its posting lists point at, so it doesn't slow down as older
+# segments pile up.
+
+WORD = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return set(WORD.findall(text.lower()))
+
+def _delta(values):
+    return [value - previous for previous, value in zip([0] + values, values)]
+
+def _undelta(deltas):
+    values = []
+    total = 0
+    for delta in deltas:
+        total += delta
+        values.append(total)
+    return values
+
+class SegmentIndex:
+    """Messages of one segment by position: byte offset, timestamp, and positions by sender and word."""
+
+    def __init__(self):
+        self.offsets = []
+        self.times = []
+        self.senders = {}
+        self.words = {}
+        self.size = 0  # bytes of the segment file indexed so far
+        self.last = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, entry, offset, length):
+        position = len(self.offsets)
+        self.offsets.append(offset)
+        self.times.append(entry["timestamp"])
+        self.senders.setdefault(entry["sender"], []).append(position)
+        for word in tokenize(entry["message"]):
+            self.words.setdefault(word, []).append(position)
+        self.size = offset + length
+        self.last = entry
+
+    def scan(self, path):
+        """Indexes whatever was appended to the segment file since the last scan."""
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return
+        with f:
+            f.seek(self.size)
+            offset = self.size
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a write still in progress (or torn by a crash)
+                self.add(json.loads(line), offset, len(line))
+                offset += len(line)
+
+    def match(self, sender, words):
+        """Sorted positions matching the sender and all words, or None for every position."""
+        postings = []
+        if sender:
+            postings.append(self.senders.get(sender, []))
+        for word in words:
+            postings.append(self.words.get(word, []))
+        if not postings:
+            return None
+        postings.sort(key=len)
+        matches = set(postings[0])
+        for other in postings[1:]:
+            matches.intersection_update(other)
+            if not matches:
+                break
+        return sorted(matches)
+
+    # Positions and offsets are stored as deltas, which keeps the index small
+    def to_json(self):
+        return {
+            "offsets": _delta(self.offsets),
+            "times": self.times,
+            "senders": {sender: _delta(positions) for sender, positions in self.senders.items()},
+            "words": {word: _delta(positions) for word, positions in self.words.items()},
+            "size": self.size,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls()
+        index.offsets = _undelta(data["offsets"])
+        index.times = data["times"]
+        index.senders = {sender: _undelta(positions) for sender, positions in data["senders"].items()}
+        index.words = {word: _undelta(positions) for word, positions in data["words"].items()}
+        index.size = data["size"]
+        return index
+
+class ChatArchive:
+    """Append-only, time-partitioned chat archive with sender and word search.
+
+    `pump(fetch)` archives chat log messages newer than the last one archived.
+    `start(fetch)` runs it every `pump_interval` seconds in the background, so
+    posting a message never waits for the archive. Appends take a file lock,
+    and each process first indexes whatever other processes appended, so
+    workers sharing a SQLite state backend can share one archive.
+    """
+
+    def __init__(self, directory, segment_hours=24, cache_size=32, pump_interval=1):
+        self.directory = directory
+        self.segment_seconds = int(segment_hours * 3600)
+        self.cache_size = cache_size
+        self.pump_interval = pump_interval
+        self.archived = 0  # messages archived by this process, for /admin/metrics
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # segment start -> SegmentIndex of a complete segment
+        self._segments = []  # starts of the segments on disk, see _segment_list
+        self._listed_for = None  # the segment period the directory was last listed in
+        self._active_start = None  # segment this process appends to
+        self._active = None
+        self._file = None
+        self._log_id = 0  # newest chat log id archived
+        self._fetch = None
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    # --- Writing ---
+    def resume(self, fetch_after_time, log_last_id):
+        """Picks up after the newest archived message.
+
+        The chat log's ids jump ahead when an in-memory log restarts, so the
+        place to resume is found by timestamp: the first logged message newer
+        than the last archived one.
+        """
+        with self._lock:
+            segments = self._segment_list()
+            if segments:
+                self._activate(segments[-1])
+            last = self._active.last if self._active is not None else None
+            if last is None:
+                self._log_id = 0
+                return
+            newer = fetch_after_time(last["timestamp"], 1)
+            self._log_id = newer[0]["id"] - 1 if newer else log_last_id
+
+    def pump(self, fetch, batch_size=500):
+        """Archives new messages. `fetch(last_id, limit)` reads them from the chat log, oldest first."""
+        with self._lock, self._writer_lock():
+            self._follow()
+            while True:
+                messages = fetch(self._log_id, batch_size)
+                if not messages:
+                    break
+                for message in messages:
+                    self._append(message)
+                self._log_id = messages[-1]["id"]
+                self.archived += len(messages)
+                if len(messages) < batch_size:
+                    break
+            if self._file is not None:
+                self._file.flush()
+
+    def start(self, fetch):
+        """Archives new messages every `pump_interval` seconds in the background."""
+        if self._thread is None:
+            self._fetch = fetch
+            self._thread = threading.Thread(target=self._pump_loop, daemon=True)
+            self._thread.start()
+
+    def _pump_loop(self):
+        while not self._stop.wait(self.pump_interval):
+            try:
+                self.pump(self._fetch)
+            except Exception as e:
+                # Chat keeps working, the messages are archived with the next pump
+                print(f"Error archiving chat: {e}")
+
+    def _writer_lock(self):
+        return _FileLock(os.path.join(self.directory, "archive.lock"))
+
+    def _follow(self):
+        # Index what other processes appended, they may have moved on to a newer segment
+        segments = self._segment_list()
+        if segments and (self._active is None or segments[-1] > self._active_start):
+            self._activate(segments[-1])
+            before = 0
+        elif self._active is not None:
+            before = len(self._active)
+            self._active.scan(self._path(self._active_start, ".log"))
+        else:
+            return
+        if len(self._active) > before:
+            self._log_id = max(self._log_id, self._active.last["id"])
+
+    def _append(self, message):
+        entry = {
+            "id": message["id"],
+            "sender": message["sender"],
+            "message": message["message"],
+            "timestamp": message["timestamp"],
+            "channel": message.get("channel", "global"),
+        }
+        start = self._segment_start(entry["timestamp"])
+        if self._active is None or start > self._active_start:
+            self._activate(start)
+        f = self._open_active()
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        f.write(line)
+        self._active.add(entry, offset, len(line))
+
+    def _activate(self, start):
+        # Called with the lock held. The previous segment is complete, write its index.
+        if self._active is not None and start != self._active_start:
+            self._seal(self._active_start, self._active)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._active_start = start
+        if start not in self._segments:
+            bisect.insort(self._segments, start)
+        self._active = SegmentIndex()
+        self._active.scan(self._path(start, ".log"))
+
+    def _open_active(self):
+        if self._file is None:
+            self._file = open(self._path(self._active_start, ".log"), "ab")
+        return self._file
+
+    def _seal(self, start, index):
+        if self._file is not None:
+            self._file.flush()
+        index.scan(self._path(start, ".log"))
+        idx_path = self._path(start, ".idx")
+        if not os.path.exists(idx_path):
+            tmp_path = f"{idx_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(index.to_json(), f, separators=(",", ":"))
+            os.replace(tmp_path, idx_path)
+        self._remember(start, index)
+
+    # --- Searching ---
+    def search(self, sender=None, query="", start=None, end=None, cursor=None, limit=50):
+        """Messages matching the sender and every word of `query` between `start` and
+        `end` (timestamps), newest first. Returns (messages, next_cursor)."""
+        words = tokenize(query or "")
+        before = _parse_cursor(cursor)
+        if self._fetch is not None:
+            # Don't make moderators wait for the background pump
+            self.pump(self._fetch)
+        with self._lock:
+            with self._writer_lock():
+                self._follow()
+            segments = list(self._segment_list())
+            active_start = self._active_start
+            active = self._active
+            active_count = len(active) if active is not None else 0
+
+        results = []
+        for segment_start in reversed(segments):
+            if before is not None and segment_start > before[0]:
+                continue
+            if start is not None and segment_start + self.segment_seconds <= start:
+                break
+            if end is not None and segment_start > end:
+                continue
+            # The segment being written only counts up to what was indexed
+            # when the search started, its lists keep growing meanwhile
+            if segment_start == active_start:
+                index, count = active, active_count
+            else:
+                index = self._load_index(segment_start, complete=segment_start != segments[-1])
+                count = len(index)
+            lo = bisect.bisect_left(index.times, start, 0, count) if start is not None else 0
+            hi = bisect.bisect_right(index.times, end, 0, count) if end is not None else count
+            if before is not None and segment_start == before[0]:
+                hi = min(hi, before[1])
+            positions = index.match(sender, words)
+            if positions is None:
+                candidates = range(hi - 1, lo - 1, -1)
+            else:
+                candidates = reversed(positions[bisect.bisect_left(positions, lo):bisect.bisect_left(positions, hi)])
+            self._read(segment_start, index, candidates, results, limit + 1)
+            if len(results) > limit:
+                break
+
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = results[-1]["cursor"]
+        for message in results:
+            del message["cursor"]
+        return results, next_cursor
+
+    def _read(self, segment_start, index, positions, results, wanted):
+        with open(self._path(segment_start, ".log"), "rb") as f:
+            for position in positions:
+                if len(results) >= wanted:
+                    return
+                f.seek(index.offsets[position])
+                message = json.loads(f.readline())
+                message["cursor"] = f"{segment_start}:{position}"
+                results.append(message)
+
+    def _load_index(self, start, complete):
+        with self._lock:
+            index = self._cache.get(start)
+            if index is not None:
+                self._cache.move_to_end(start)
+                return index
+        idx_path = self._path(start, ".idx")
+        if os.path.exists(idx_path):
+            with open(idx_path, "r") as f:
+                index = SegmentIndex.from_json(json.load(f))
+        else:
+            # Never sealed (the server stopped mid-segment), or another
+            # process is still writing it
+            index = SegmentIndex()
+            index.scan(self._path(start, ".log"))
+            if not complete:
+                return index
+            with self._lock:
+                self._seal(start, index)
+        with self._lock:
+            self._remember(start, index)
+        return index
+
+    def _remember(self, start, index):
+        self._cache[start] = index
+        self._cache.move_to_end(start)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    # --- Files ---
+    def _segment_start(self, timestamp):
+        return int(timestamp // self.segment_seconds) * self.segment_seconds
+
+    def _path(self, start, extension):
+        name = time.strftime("chat-%Y%m%d-%H", time.gmtime(start))
+        if self.segment_seconds % 3600:
+            name += time.strftime("%M", time.gmtime(start))
+        return os.path.join(self.directory, name + extension)
+
+    def _segment_list(self):
+        # Called with the lock held. Segments are only created for the current
+        # period, so the directory is listed once per period and in between
+        # only the current segment's file is looked for, until it shows up.
+        current = self._segment_start(time.time())
+        if self._listed_for != current:
+            self._segments = self._list_segments()
+            self._listed_for = current
+        elif (not self._segments or self._segments[-1] < current) and os.path.exists(self._path(current, ".log")):
+            self._segments.append(current)
+        return self._segments
+
+    def _list_segments(self):
+        starts = []
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith("chat-") and filename.endswith(".log")):
+                continue
+            stamp = filename[5:-4]
+            try:
+                parsed = time.strptime(stamp, "%Y%m%d-%H%M" if len(stamp) > 11 else "%Y%m%d-%H")
+            except ValueError:
+                continue
+            starts.append(calendar.timegm(parsed))
+        return sorted(starts)
+
+    def close(self):
+        """Stops the background pump and archives what it hadn't got to yet."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.pump(self._fetch)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def _parse_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        segment, position = cursor.split(":")
+        return int(segment), int(position)
+    except ValueError:
+        return None
+
+class _FileLock:
+    """Exclusive lock on a file shared by all processes using the archive."""
+
+    def __init__(self, path):
+        self.path = path
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._f = open(self.path, "a")
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
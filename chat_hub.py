@@ -0,0 +1,232 @@
+import time
+import threading
+from collections import deque
+
+# --- Chat Fan-Out ---
+# Every chat message is stored once in the chat log (see state_backend) with
+# the channel it was sent to: "global", a "#room", or "@username" for a
+# direct message. ChatHub copies each new message into the queue of every
+# player who should see it, so a poll only reads that player's own queue and
+# costs what the player follows, not what the whole server says.
+
+GLOBAL_CHANNEL = "global"
+
+def dm_channel(username):
+    return f"@{username}"
+
+def message_channel(message):
+    # Messages logged before channels existed are all global
+    return message.get("channel") or GLOBAL_CHANNEL
+
+class Subscriber:
+    def __init__(self, username, queue_size):
+        self.username = username
+        self.rooms = set()
+        self.blocked = set()
+        self.queue = deque(maxlen=queue_size)
+        self.dropped = 0  # messages pushed out of the full queue since the last read
+        self.last_poll = time.monotonic()
+        self.loaded_at = 0
+
+    def follows(self, channel):
+        return channel == GLOBAL_CHANNEL or channel in self.rooms or channel == dm_channel(self.username)
+
+    def wants(self, message):
+        sender = message["sender"]
+        return sender != self.username and sender not in self.blocked and self.follows(message_channel(message))
+
+class ChatHub:
+    """Bounded per-player chat queues, fed from the chat log.
+
+    `pump(fetch)` fans out everything newer than the last message it saw, so
+    it works the same whether a message was appended in this process or (with
+    a shared state backend) by another worker. A player gets a queue on their
+    first poll, filled with what they missed since the id they poll from.
+
+    `load_settings(username)` returns the rooms the player joined and the
+    senders they blocked. With `refresh_interval` set those are re-read that
+    often, to pick up changes made through other workers.
+    """
+
+    def __init__(self, load_settings, queue_size=200, idle_timeout=300, refresh_interval=None):
+        self.load_settings = load_settings
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self.refresh_interval = refresh_interval
+        self.last_id = 0  # newest message fanned out
+        self.dropped = 0  # messages lost to full queues, for /admin/metrics
+        self._lock = threading.Lock()
+        self._pump_lock = threading.Lock()  # one pump or backfill at a time, in id order
+        self._subscribers = {}  # username -> Subscriber
+        self._members = {}  # room or DM channel -> usernames subscribed to it
+        self._last_expiry = time.monotonic()
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def __contains__(self, username):
+        return username in self._subscribers
+
+    def start(self, last_id):
+        """Starts fanning out after `last_id`, the newest message when the server started."""
+        self.last_id = last_id
+
+    def pump(self, fetch, batch_size=500):
+        """Fans out new messages. `fetch(last_id, limit)` reads them from the chat log, oldest first."""
+        with self._pump_lock:
+            while True:
+                messages = fetch(self.last_id, batch_size)
+                if not messages:
+                    break
+                with self._lock:
+                    for message in messages:
+                        self._fan_out(message)
+                    self.last_id = messages[-1]["id"]
+                if len(messages) < batch_size:
+                    break
+            self._expire_idle()
+
+    def poll(self, username, since_id, limit, fetch, hidden=None):
+        """Messages for `username` newer than `since_id`, at most `limit` of them.
+
+        Returns (messages, last_id, dropped): `last_id` is what the player
+        should poll from next time, `dropped` how many messages they lost to
+        a full queue. Messages at or before `since_id` are removed from the
+        queue, so polling from the returned last_id acknowledges them.
+        Senders for which `hidden(sender)` is true (muted or banned since they
+        sent it) are dropped from the queue as well.
+        """
+        subscriber = self._subscribers.get(username)
+        if subscriber is None:
+            subscriber = self._subscribe(username, since_id, fetch)
+        elif self.refresh_interval is not None and time.monotonic() - subscriber.loaded_at > self.refresh_interval:
+            self._apply_settings(subscriber, *self.load_settings(username))
+
+        hidden_senders = {}
+        with self._lock:
+            subscriber.last_poll = time.monotonic()
+            kept = deque(maxlen=self.queue_size)
+            messages = []
+            for message in subscriber.queue:
+                if message["id"] <= since_id:
+                    continue
+                sender = message["sender"]
+                if hidden is not None:
+                    if sender not in hidden_senders:
+                        hidden_senders[sender] = hidden(sender)
+                    if hidden_senders[sender]:
+                        continue
+                kept.append(message)
+                if len(messages) < limit:
+                    messages.append(message)
+            subscriber.queue = kept
+            # Everything up to last_id was fanned out, so unless the reply is
+            # cut short by `limit` the player has seen all of it
+            last_id = messages[-1]["id"] if len(messages) < len(kept) else max(since_id, self.last_id)
+            dropped = 0
+            if messages:
+                dropped, subscriber.dropped = subscriber.dropped, 0
+            return messages, last_id, dropped
+
+    def unsubscribe(self, username):
+        with self._lock:
+            subscriber = self._subscribers.pop(username, None)
+            if subscriber is not None:
+                self._index(subscriber, add=False)
+
+    # --- Settings ---
+    def join(self, username, room):
+        with self._lock:
+            subscriber = self._subscribers.get(username)
+            if subscriber is not None:
+                subscriber.rooms.add(room)
+                self._members.setdefault(room, set()).add(username)
+
+    def leave(self, username, room):
+        with self._lock:
+            subscriber = self._subscribers.get(username)
+            if subscriber is not None:
+                subscriber.rooms.discard(room)
+                self._discard_member(room, username)
+
+    def set_blocked(self, username, sender, blocked):
+        with self._lock:
+            subscriber = self._subscribers.get(username)
+            if subscriber is None:
+                return
+            if blocked:
+                subscriber.blocked.add(sender)
+                subscriber.queue = deque((m for m in subscriber.queue if m["sender"] != sender), maxlen=self.queue_size)
+            else:
+                subscriber.blocked.discard(sender)
+
+    # --- Internals ---
+    def _subscribe(self, username, since_id, fetch):
+        rooms, blocked = self.load_settings(username)
+        # Under the pump lock, so the backfill and the next pump neither
+        # overlap nor leave a gap
+        with self._pump_lock:
+            backlog = [message for message in fetch(since_id, None) if message["id"] <= self.last_id]
+            subscriber = Subscriber(username, self.queue_size)
+            with self._lock:
+                existing = self._subscribers.get(username)
+                if existing is not None:
+                    return existing  # another request for this player got here first
+                self._set_settings(subscriber, rooms, blocked)
+                subscriber.queue.extend(message for message in backlog if subscriber.wants(message))
+                self._subscribers[username] = subscriber
+                self._index(subscriber, add=True)
+        return subscriber
+
+    def _apply_settings(self, subscriber, rooms, blocked):
+        with self._lock:
+            self._index(subscriber, add=False)
+            self._set_settings(subscriber, rooms, blocked)
+            if self._subscribers.get(subscriber.username) is subscriber:
+                self._index(subscriber, add=True)
+
+    def _set_settings(self, subscriber, rooms, blocked):
+        subscriber.rooms = set(rooms)
+        subscriber.blocked = set(blocked)
+        subscriber.loaded_at = time.monotonic()
+
+    def _index(self, subscriber, add):
+        # Called with the lock held
+        for channel in subscriber.rooms | {dm_channel(subscriber.username)}:
+            if add:
+                self._members.setdefault(channel, set()).add(subscriber.username)
+            else:
+                self._discard_member(channel, subscriber.username)
+
+    def _discard_member(self, channel, username):
+        members = self._members.get(channel)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self._members[channel]
+
+    def _fan_out(self, message):
+        # Called with the lock held
+        channel = message_channel(message)
+        if channel == GLOBAL_CHANNEL:
+            targets = self._subscribers.values()
+        else:
+            targets = [self._subscribers[name] for name in self._members.get(channel, ())]
+        for subscriber in targets:
+            if subscriber.wants(message):
+                if len(subscriber.queue) == self.queue_size:
+                    subscriber.dropped += 1
+                    self.dropped += 1
+                subscriber.queue.append(message)
+
+    def _expire_idle(self):
+        # Players that stopped polling lose their queue, they get a fresh one
+        # (filled from the chat log) when they come back
+        now = time.monotonic()
+        if now - self._last_expiry < 30:
+            return
+        self._last_expiry = now
+        with self._lock:
+            idle = [name for name, sub in self._subscribers.items() if now - sub.last_poll > self.idle_timeout]
+            for username in idle:
+                self._index(self._subscribers.pop(username), add=False)
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import bisect
+import threading
+from array import array
+
+# --- Bounded Chat Log ---
+class ChatStore:
+    """Chat log with monotonically increasing message ids.
+
+    The most recent `capacity` messages live in a fixed-size ring buffer, so
+    message `id` sits at slot `id % capacity` and "messages since id N" is a
+    direct index instead of a scan. Messages pushed out of the ring are appended
+    to `spill_path` (if set) together with their byte offset, so older history
+    can still be paged through without loading the whole file.
+
+    Without a spill file nothing survives a restart, so ids start from the
+    start time in microseconds instead of 1. They stay ahead of the previous
+    run's (unless it averaged a million messages a second), so a client
+    that kept its cursor across the restart still gets the new messages.
+    """
+
+    def __init__(self, capacity=1000, spill_path=None):
+        self.capacity = capacity
+        self.spill_path = spill_path
+        self._lock = threading.Lock()
+        self._ring = [None] * capacity
+        self._first_id = int(time.time() * 1_000_000)  # oldest id still in the ring
+        self._next_id = self._first_id
+        self._last_timestamp = 0
+        self._spill_first_id = None
+        self._spill_offsets = array("Q")  # byte offset of each spilled message, by id
+        if spill_path:
+            self._load_spill_index()
+
+    def append(self, sender, message, channel="global"):
+        with self._lock:
+            # Keep timestamps non-decreasing so they can be binary searched
+            timestamp = max(time.time(), self._last_timestamp)
+            entry = {"id": self._next_id, "sender": sender, "message": message, "timestamp": timestamp, "channel": channel}
+            if self._next_id - self._first_id >= self.capacity:
+                self._evict_oldest()
+            self._ring[self._next_id % self.capacity] = entry
+            self._next_id += 1
+            self._last_timestamp = timestamp
+            return entry
+
+    def since(self, last_id, limit=None):
+        """Returns messages with an id greater than `last_id`, oldest first."""
+        with self._lock:
+            start = max(last_id + 1, self._first_id)
+            end = self._next_id if limit is None else min(self._next_id, start + limit)
+            return [self._ring[i % self.capacity] for i in range(start, end)]
+
+    def since_timestamp(self, last_timestamp, limit=None):
+        """Legacy lookup for clients that still track the last timestamp they saw."""
+        with self._lock:
+            ids = range(self._first_id, self._next_id)
+            index = bisect.bisect_right(ids, last_timestamp, key=lambda i: self._ring[i % self.capacity]["timestamp"])
+            last_id = self._first_id + index - 1
+        return self.since(last_id, limit)
+
+    def page(self, before_id=None, limit=50):
+        """Returns up to `limit` messages older than `before_id` (newest page if None), oldest first.
+
+        Also returns the cursor for the next older page, or None once history runs out.
+        """
+        with self._lock:
+            oldest = self._first_id if self._spill_first_id is None else self._spill_first_id
+            end = self._next_id if before_id is None else min(before_id, self._next_id)
+            start = max(end - limit, oldest)
+            messages = []
+            if start < self._first_id:
+                messages = self._read_spilled(start, min(end, self._first_id))
+            ring_start = max(start, self._first_id)
+            messages.extend(self._ring[i % self.capacity] for i in range(ring_start, end))
+            next_cursor = start if start > oldest else None
+            return messages, next_cursor
+
+    def last_id(self):
+        with self._lock:
+            return self._next_id - 1
+
+    def __len__(self):
+        with self._lock:
+            return self._next_id - self._first_id
+
+    # --- Spill to Disk ---
+    def _evict_oldest(self):
+        slot = self._first_id % self.capacity
+        entry = self._ring[slot]
+        self._ring[slot] = None
+        self._first_id += 1
+        if self.spill_path and entry is not None:
+            self._spill(entry)
+
+    def _spill(self, entry):
+        try:
+            with open(self.spill_path, "ab") as f:
+                offset = f.tell()
+                f.write((json.dumps(entry) + "\n").encode("utf-8"))
+            if self._spill_first_id is None:
+                self._spill_first_id = entry["id"]
+            self._spill_offsets.append(offset)
+        except Exception as e:
+            print(f"Error spilling chat history: {e}")
+
+    def _read_spilled(self, start, end):
+        if self._spill_first_id is None:
+            return []
+        start = max(start, self._spill_first_id)
+        if start >= end:
+            return []
+        messages = []
+        with open(self.spill_path, "rb") as f:
+            f.seek(self._spill_offsets[start - self._spill_first_id])
+            for _ in range(start, end):
+                line = f.readline()
+                if not line:
+                    break
+                messages.append(json.loads(line))
+        return messages
+
+    def _load_spill_index(self):
+        # Rebuild the offset index so ids keep increasing across restarts
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, "rb") as f:
+            offset = 0
+            for line in f:
+                entry = json.loads(line)
+                if self._spill_first_id is None:
+                    self._spill_first_id = entry["id"]
+                self._spill_offsets.append(offset)
+                offset += len(line)
+                self._next_id = entry["id"] + 1
+                self._last_timestamp = entry["timestamp"]
+        self._first_id = self._next_id
+
+    def close(self):
+        # Spill whatever is still in memory so history survives a restart
+        with self._lock:
+            if not self.spill_path:
+                return
+            while self._first_id < self._next_id:
+                self._evict_oldest()
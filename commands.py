@@ -0,0 +1,53 @@
+# --- Command Registry ---
+# Shared by the server (server.py) and the client (main.py). Each command is
+# registered once with its handler and metadata, and dispatch is a single
+# dict lookup instead of a chain of `if command == ...` checks.
+
+class Command:
+    def __init__(self, name, handler, description="", args="", needs_state=True, mutates_state=False):
+        self.name = name
+        self.handler = handler
+        self.description = description
+        self.args = args  # usage string for the arguments, e.g. "<mission_id> <password>"
+        self.needs_state = needs_state  # whether the handler reads the player's saved record
+        self.mutates_state = mutates_state  # whether the record must be saved after success
+
+    def usage(self):
+        return f"{self.name} {self.args}".strip()
+
+    def spec(self):
+        return {
+            "description": self.description,
+            "args": self.args,
+            "needs_state": self.needs_state,
+            "mutates_state": self.mutates_state
+        }
+
+class CommandRegistry:
+    def __init__(self):
+        self._commands = {}
+
+    def register(self, name, description="", args="", needs_state=True, mutates_state=False):
+        """Decorator that registers the function as the handler for `name`."""
+        def decorator(handler):
+            self._commands[name] = Command(name, handler, description, args, needs_state, mutates_state)
+            return handler
+        return decorator
+
+    def get(self, name):
+        return self._commands.get(name)
+
+    def __contains__(self, name):
+        return name in self._commands
+
+    def __iter__(self):
+        return iter(self._commands)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def descriptions(self):
+        return {name: command.description for name, command in self._commands.items()}
+
+    def specs(self):
+        return {name: command.spec() for name, command in self._commands.items()}
@@ -0,0 +1,44 @@
+import time
+import threading
+
+# --- Push Notifications for Long-Polling Clients ---
+class EventHub:
+    """Parks long-poll requests until there is something new to send them.
+
+    Anything that changes what a client should see (a chat message, a kick,
+    a mute or ban) calls `publish`, which wakes every waiting request so it
+    can re-check its own condition. When other processes can change state
+    too, waiters also re-check every `poll_interval` seconds.
+
+    Waiters that don't block a thread (the asyncio server) register a
+    listener instead, which `publish` calls from the publishing thread.
+    """
+
+    def __init__(self, poll_interval=None):
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._listeners = []
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def publish(self):
+        with self._cond:
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback()
+
+    def wait(self, check, timeout):
+        """Blocks until `check()` returns something truthy or `timeout` seconds pass."""
+        if self.poll_interval is None:
+            with self._cond:
+                return self._cond.wait_for(check, timeout)
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                result = check()
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                self._cond.wait(min(self.poll_interval, remaining))
@@ -0,0 +1,90 @@
+import os
+import json
+import uuid
+
+# --- Offline Journal ---
+# What the client changed while it wasn't connected, one JSON object per line.
+# On reconnect only the entries the server hasn't acknowledged are sent to
+# /sync, so the cost of catching up depends on what changed, not on the size
+# of the save. The first line is a header with this client's id and the
+# server record version the entries were made against.
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.client_id = uuid.uuid4().hex
+        self.server_version = None  # version of the server record we last saw
+        self.last_seq = 0
+        self.entries = []
+        self._header_dirty = True
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            return
+        self.client_id = header.get("client_id", self.client_id)
+        self.server_version = header.get("server_version")
+        self.last_seq = header.get("last_seq", 0)
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # a torn write at the end, everything before it is intact
+            self.entries.append(entry)
+            self.last_seq = max(self.last_seq, entry["seq"])
+        self._header_dirty = False
+
+    def append(self, op, **fields):
+        self.last_seq += 1
+        entry = {"seq": self.last_seq, "op": op, **fields}
+        self.entries.append(entry)
+        if self._header_dirty:
+            self.save()
+        else:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+    def set_server_version(self, version):
+        if version != self.server_version:
+            self.server_version = version
+            self._header_dirty = True
+
+    def pending(self):
+        """Unacknowledged entries, with runs of location changes collapsed to the last one."""
+        ops = []
+        for entry in self.entries:
+            if entry["op"] == "location" and ops and ops[-1]["op"] == "location":
+                ops[-1] = entry
+            else:
+                ops.append(entry)
+        return ops
+
+    def acknowledge(self, seq, server_version):
+        """Drops every entry up to `seq`, which the server has applied."""
+        self.entries = [entry for entry in self.entries if entry["seq"] > seq]
+        self.server_version = server_version
+        self.save()
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        header = {"client_id": self.client_id, "server_version": self.server_version, "last_seq": self.last_seq}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
+        self._header_dirty = False
+
+    def __len__(self):
+        return len(self.entries)
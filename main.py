@@ -4,6 +4,12 @@ import time
 import requests
 import threading
 import sys
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from vfs import VirtualFS
+from commands import CommandRegistry
+from journal import Journal
+import save_codec
 
 # --- Game State ---
 class Server:
@@ -12,15 +18,45 @@ class Server:
         self.port = port
         self.is_connected = False
         self.timeout = 5  # Timeout in seconds
+        self.session = self.create_session()
+
+    def create_session(self):
+        """One keep-alive session shared by the input thread and the polling thread.
+
+        The connection pool is thread-safe and we never change session state
+        (headers, cookies) after this, so both threads can use it at once.
+        """
+        # Connection errors are retried for every method since the request never
+        # reached the server. Only GETs are retried on a timeout or a 5xx, so
+        # a chat message or save is never sent twice.
+        retry = Retry(
+            total=3,
+            connect=3,
+            read=0,
+            status=2,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(f"http://{self.host}:{self.port}{path}", **kwargs)
+
+    def post(self, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(f"http://{self.host}:{self.port}{path}", **kwargs)
 
     def connect(self, username):
         print("Connecting to server...")
         try:
-            response = requests.post(
-                f"http://{self.host}:{self.port}/reconnect",
-                json={"username": username},
-                timeout=self.timeout
-            )
+            response = self.post("/reconnect", json={"username": username})
             if response.status_code == 200:
                 self.is_connected = True
                 print("Connected!")
@@ -37,8 +73,7 @@ class Server:
         if self.is_connected:
             print("Disconnecting from server...")
             try:
-                url = f"http://{self.host}:{self.port}/disconnect"
-                requests.post(url, json={"username": player.username}, timeout=self.timeout)
+                self.post("/disconnect", json={"username": player.username})
             except requests.exceptions.RequestException:
                 pass
 
@@ -63,45 +98,182 @@ LOCAL_FS = {
     }
 }
 
-# New: The local missions dictionary for offline play
-LOCAL_MISSIONS = {
-    "mission_01": {
+LOCAL_WORLD = VirtualFS.from_dict(LOCAL_FS)
+
+# --- Cached Catalog ---
+# Read-only commands answered from the cached catalog while connected
+READ_ONLY_COMMANDS = ("ls", "cat")
+
+class Catalog:
+    """The server's commands, world and public mission data, cached on disk.
+
+    Refreshed with If-None-Match on connect and whenever a server response
+    carries a different X-Catalog-Version, so an unchanged catalog costs a 304.
+    The world comes without file contents, those are fetched from the server
+    the first time a file is read.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.commands = {}
+        self.missions = []
+        self.world = None
+        self.server = None  # where file contents are fetched from
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                self._apply(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def _apply(self, data):
+        self.version = data.get("version")
+        self.commands = data.get("commands", {})
+        self.missions = data.get("missions", [])
+        self.world = VirtualFS.from_dict(data.get("world", {}), loader=self.fetch_file)
+
+    def fetch_file(self, path):
+        """The content of a world file from the server, or None while offline."""
+        if self.server is None or not self.server.is_connected:
+            return None
+        try:
+            response = self.server.get("/world_file", params={"path": "/".join(path)})
+            if response.status_code != 200:
+                return None
+            return response.json().get("content")
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def refresh(self, server):
+        self.server = server
+        headers = {"If-None-Match": f'"{self.version}"'} if self.version else {}
+        try:
+            response = server.get("/catalog", headers=headers)
+        except requests.exceptions.RequestException:
+            return
+        if response.status_code != 200:
+            return  # 304 (still current), or an older server without /catalog
+        data = response.json()
+        self._apply(data)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, self.path)
+
+    def check_version(self, server, response):
+        version = response.headers.get("X-Catalog-Version")
+        if version and version != self.version:
+            self.refresh(server)
+
+    def serves(self, command):
+        """Whether `command` can be answered locally without asking the server."""
+        return command in READ_ONLY_COMMANDS and command in self.commands and self.world is not None
+
+CATALOG = Catalog(os.path.join("cache", "catalog.json"))
+
+def current_world():
+    """The server's world from the cached catalog if we have one, else the built-in one."""
+    return CATALOG.world if CATALOG.world is not None else LOCAL_WORLD
+
+# Missions for offline play before the first connect, when there is no cached
+# catalog yet. Catalog missions come without their solution, so those are
+# only checked by the server once the journal is synced.
+LOCAL_MISSIONS = [
+    {
+        "id": "mission_01",
         "title": "The First Byte",
         "description": "Welcome, agent. Your first mission is to gain access to the 'Alpha' server. The server is locked with a simple password. We believe the password is 'hunter2'.",
         "solution": "hunter2",
         "reward": "Access granted to the 'Alpha' server.",
-        "completed": False
+        "requirements": []
     }
-}
+]
+
+def current_missions():
+    """The server's missions from the cached catalog if we have them, else the built-in ones."""
+    return CATALOG.missions if CATALOG.missions else LOCAL_MISSIONS
+
+def find_mission(mission_id):
+    for mission in current_missions():
+        if mission.get("id") == mission_id:
+            return mission
+    return None
+
+# Local saves use the server's binary save format. Saves from older versions
+# are JSON and are replaced by a binary one the next time the player saves.
+SAVE_EXTENSION = ".sav"
+LEGACY_SAVE_EXTENSION = ".json"
+
+def local_save_path(username):
+    """Path of the player's existing local save, or None."""
+    for extension in (SAVE_EXTENSION, LEGACY_SAVE_EXTENSION):
+        path = os.path.join("saves", f"{username}{extension}")
+        if os.path.exists(path):
+            return path
+    return None
+
+def local_save_names():
+    names = []
+    for filename in sorted(os.listdir("saves")):
+        name, extension = os.path.splitext(filename)
+        if extension in (SAVE_EXTENSION, LEGACY_SAVE_EXTENSION) and name not in names:
+            names.append(name)
+    return names
+
+def load_local_save(username):
+    with open(local_save_path(username), "rb") as f:
+        return save_codec.decode(f.read())
 
 class Player:
     def __init__(self, username):
         self.username = username
-        self.last_chat_timestamp = 0
+        self.last_chat_id = 0
         self.is_kicked = False
         self.location = ["root", "home", "user"] # New: Player's local location
+        # Changes made while offline, sent to the server on the next connect
+        self.journal = Journal(os.path.join("saves", f"{username}.journal"))
 
     def save_progress_local(self):
         if not os.path.exists("saves"):
             os.makedirs("saves")
-        save_path = os.path.join("saves", f"{self.username}.json")
+        save_path = os.path.join("saves", f"{self.username}{SAVE_EXTENSION}")
         print(f"Saving progress for {self.username} locally...")
-        with open(save_path, "w") as f:
-            json.dump({"username": self.username, "progress": "some_data", "location": self.location}, f)
+        record = {"username": self.username, "progress": "some_data", "location": self.location}
+        # Written next to the old save and renamed over it, so a crash can't leave half a save
+        temp_path = save_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(save_codec.encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, save_path)
+        legacy_path = os.path.join("saves", f"{self.username}{LEGACY_SAVE_EXTENSION}")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        self.journal.save()
         print("Done.")
 
 # --- Command Handling ---
-LOCAL_COMMANDS = ["save", "connect", "disconnect", "help", "exit", "chat_history"]
+# Commands the client always handles itself
+LOCAL_COMMANDS = CommandRegistry()
+# Stand-ins for server commands while not connected
+OFFLINE_COMMANDS = CommandRegistry()
 
 def show_help(server):
     print("Available commands:")
     print("\n--- Local Commands ---")
-    for command in LOCAL_COMMANDS:
-        print(f" - {command}")
+    for command, description in LOCAL_COMMANDS.descriptions().items():
+        print(f" - {command}: {description}")
         
-    if server.is_connected:
+    if server.is_connected and CATALOG.commands:
+        print("\n--- Server Commands ---")
+        for command, spec in CATALOG.commands.items():
+            print(f" - {command}: {spec['description']}")
+    elif server.is_connected:
         try:
-            response = requests.get(f"http://{server.host}:{server.port}/get_commands", timeout=server.timeout)
+            response = server.get("/get_commands")
             server_commands = response.json().get("commands", {})
             print("\n--- Server Commands ---")
             for command, description in server_commands.items():
@@ -109,188 +281,431 @@ def show_help(server):
         except requests.exceptions.RequestException:
             print("\n--- Server Commands ---")
             print("Failed to retrieve server commands.")
-
-def get_current_directory_object_local(location):
-    """Navigates the local file system tree to the player's current location."""
-    current_dir = LOCAL_FS
-    for part in location:
-        if isinstance(current_dir, dict) and part in current_dir:
-            current_dir = current_dir[part]
+    else:
+        print("\n--- Offline Commands ---")
+        for command, description in OFFLINE_COMMANDS.descriptions().items():
+            print(f" - {command}: {description}")
+
+@OFFLINE_COMMANDS.register("ls", "Lists files in the current directory")
+def offline_ls(args, player):
+    current_dir = current_world().get_directory(player.location)
+    if current_dir is None:
+        return "Error accessing directory."
+    return current_dir.listing()
+
+@OFFLINE_COMMANDS.register("cd", "Changes the current directory", "<directory>")
+def offline_cd(args, player):
+    if not args:
+        return "Usage: cd <directory>"
+    
+    target = args[0]
+    new_location = player.location[:]
+    
+    if target == "..":
+        if len(new_location) > 1:
+            new_location.pop()
         else:
-            return None
-    return current_dir
-
-def handle_local_commands(command, args, player):
-    """Handles commands when the server is not connected."""
-    if command == "ls":
-        current_dir = get_current_directory_object_local(player.location)
-        if not current_dir or not isinstance(current_dir, dict):
-            return "Error accessing directory."
-        
-        output = "Files and folders in this directory:\n"
-        output += "\n".join([f" - {item}" for item in current_dir.keys()])
-        return output
-
-    if command == "cd":
-        if not args:
-            return "Usage: cd <directory>"
-        
-        target = args[0]
-        new_location = player.location[:]
-        
-        if target == "..":
-            if len(new_location) > 1:
-                new_location.pop()
-            else:
-                return "You can't go back any further."
+            return "You can't go back any further."
+    else:
+        if current_world().is_directory(player.location + [target]):
+            new_location.append(target)
         else:
-            current_dir = get_current_directory_object_local(player.location)
-            if target in current_dir and isinstance(current_dir[target], dict):
-                new_location.append(target)
-            else:
-                return f"cd: no such file or directory: {target}"
+            return f"cd: no such file or directory: {target}"
 
-        player.location = new_location
-        return "Directory changed."
+    player.location = new_location
+    player.journal.append("location", location=new_location)
+    return "Directory changed."
 
-    if command == "cat":
-        if not args:
-            return "Usage: cat <file>"
-        
-        file_name = args[0]
-        current_dir = get_current_directory_object_local(player.location)
-        
-        if file_name in current_dir and isinstance(current_dir[file_name], str):
-            return current_dir[file_name]
-        else:
-            return f"cat: {file_name}: No such file or directory"
+@OFFLINE_COMMANDS.register("cat", "Displays the content of a file", "<file>")
+def offline_cat(args, player):
+    if not args:
+        return "Usage: cat <file>"
     
-    if command == "chat":
-        return "Chat is only available when connected to the server."
-
-    if command == "hack":
-        if not args:
-            return "Usage: hack <password>"
-        
-        password = args[0]
-        mission = LOCAL_MISSIONS.get("mission_01")
-        
-        if not mission:
-            return "Mission not found."
-        
-        if mission.get("completed", False):
-            return "Mission already completed."
+    file_name = args[0]
+    world = current_world()
+    content = world.read_file(player.location, file_name)
+    if content is not None:
+        return content
+    directory = world.get_directory(player.location)
+    if directory is not None and file_name in directory.children and not world.is_directory(player.location + [file_name]):
+        return f"cat: {file_name}: Not downloaded yet, connect to the server to read it"
+    return f"cat: {file_name}: No such file or directory"
+
+@OFFLINE_COMMANDS.register("chat", "Only available when connected")
+def offline_chat(args, player):
+    return "Chat is only available when connected to the server."
+
+# Rooms, private messages and blocking all live on the server
+for chat_command in ("join", "leave", "rooms", "say", "msg", "block", "unblock"):
+    OFFLINE_COMMANDS.register(chat_command, "Only available when connected")(offline_chat)
+
+def submitted_missions(player):
+    """Missions solved offline that the server hasn't checked yet."""
+    return {entry["mission"] for entry in player.journal.entries if entry["op"] == "hack"}
+
+@OFFLINE_COMMANDS.register("missions", "Lists the missions you can play offline")
+def offline_missions(args, player):
+    submitted = submitted_missions(player)
+    output = ["--- Missions ---\n"]
+    for mission in current_missions():
+        status = "SUBMITTED, checked when you reconnect" if mission["id"] in submitted else "IN PROGRESS"
+        output.append(f"ID: {mission['id']}\nTitle: {mission['title']}\nStatus: {status}\nDescription: {mission['description']}\n---\n")
+    return "".join(output).strip()
+
+@OFFLINE_COMMANDS.register("hack", "Attempts to solve a mission, checked by the server when you reconnect", "<mission_id> <password>")
+def offline_hack(args, player):
+    if len(args) < 2:
+        return "Usage: hack <mission_id> <password>"
+
+    mission_id, password = args[0], args[1]
+    mission = find_mission(mission_id)
+    if not mission:
+        return "Mission not found."
+    if mission_id in submitted_missions(player):
+        return "Mission already submitted, the server will check it when you reconnect."
+
+    if "solution" not in mission:
+        player.journal.append("hack", mission=mission_id, password=password)
+        return f"Solution for '{mission['title']}' recorded, the server will check it when you reconnect."
+    if password == mission["solution"]:
+        player.journal.append("hack", mission=mission_id, password=password)
+        return f"SUCCESS! Mission '{mission['title']}' completed. {mission['reward']} (It will be sent to the server when you reconnect.)"
+    else:
+        return "Incorrect password. Access denied."
 
-        if password == mission["solution"]:
-            mission["completed"] = True
-            return f"SUCCESS! Mission '{mission['title']}' completed. {mission['reward']} (Progress will not be saved on the server.)"
-        else:
-            return "Incorrect password. Access denied."
+def handle_local_commands(command, args, player):
+    """Handles commands when the server is not connected."""
+    offline_command = OFFLINE_COMMANDS.get(command)
+    if offline_command is None:
+        return f"Command '{command}' not found. You are not connected to the server."
+    return offline_command.handler(args, player)
 
 def check_command_server(command, args, player, server):
     if not server.is_connected:
         return {"status": "error", "message": "Not connected to server."}
 
     try:
-        url = f"http://{server.host}:{server.port}/check_command"
         payload = {"command": command, "args": args, "username": player.username}
-        response = requests.post(url, json=payload, timeout=server.timeout)
-        return response.json()
+        response = server.post("/check_command", json=payload)
+        result = response.json()
+        CATALOG.check_version(server, response)
+        apply_server_result(player, result)
+        return result
     except requests.exceptions.RequestException:
         server.is_connected = False
         return {"status": "error", "message": "Server connection lost."}
 
-def handle_command(command, args, player, server):
-    if command in LOCAL_COMMANDS:
-        if command == "save":
-            if server.is_connected:
-                url = f"http://{server.host}:{server.port}/save"
-                try:
-                    requests.post(url, json={"username": player.username, "data": {"progress": "some_data", "location": player.location}}, timeout=server.timeout)
-                    print("Saving progress to server...")
-                    print("Done!")
-                except requests.exceptions.RequestException:
-                    print("Server connection lost, saving locally instead.")
-                    player.save_progress_local()
-            else:
-                player.save_progress_local()
-            return
+def check_commands_server(commands, player, server):
+    """Sends a list of (command, args) to the server in one request. Returns one response per command."""
+    if not server.is_connected:
+        return [{"status": "error", "message": "Not connected to server."} for _ in commands]
 
-        if command == "connect":
-            if not server.is_connected:
-                server.connect(player.username)
-            else:
-                print("Already connected to the server.")
+    try:
+        payload = {"username": player.username, "commands": [{"command": command, "args": args} for command, args in commands]}
+        response = server.post("/check_commands", json=payload)
+        if response.status_code == 404:
+            # Older server without batching, send them one by one
+            return [check_command_server(command, args, player, server) for command, args in commands]
+        data = response.json()
+        if data.get("status") != "success":
+            return [data for _ in commands]
+        CATALOG.check_version(server, response)
+        for result in data["results"]:
+            apply_server_result(player, result)
+        return data["results"]
+    except requests.exceptions.RequestException:
+        server.is_connected = False
+        return [{"status": "error", "message": "Server connection lost."} for _ in commands]
+
+def apply_server_result(player, result):
+    """Follows the server's copy of the player's record.
+
+    The location keeps cached commands in the same directory as the server,
+    and the version is what later offline changes are checked against.
+    """
+    if "location" in result:
+        player.location = result["location"]
+    if "version" in result:
+        player.journal.set_server_version(result["version"])
+
+# Most journal entries sent in one /sync request, matches the server's limit
+MAX_SYNC_OPS = 500
+
+def sync_journal(player, server):
+    """Sends the changes made while offline and reports what the server made of each one."""
+    journal = player.journal
+    while journal.entries:
+        payload = {
+            "username": player.username,
+            "client_id": journal.client_id,
+            "base_version": journal.server_version,
+            "ops": journal.pending()[:MAX_SYNC_OPS]
+        }
+        try:
+            response = server.post("/sync", json=payload)
+            if response.status_code == 404:
+                return  # Older server without /sync, keep the journal for later
+            data = response.json()
+        except (requests.exceptions.RequestException, ValueError):
             return
-
-        if command == "disconnect":
-            server.disconnect(player)
+        if data.get("status") != "success":
+            print(f"Sync failed: {data.get('message')}")
             return
+        for result in data["results"]:
+            print(f"Sync: {result['message']}")
+        journal.acknowledge(data["applied_seq"], data["version"])
+        player.location = data["location"]
+
+def connect_player(player, server):
+    """Connects, then sends offline changes and brings the cached catalog and the player's location up to date."""
+    server.connect(player.username)
+    if not server.is_connected:
+        return
+    CATALOG.refresh(server)
+    sync_journal(player, server)
+    try:
+        response = server.post("/get_user_state", json={"username": player.username})
+        state = response.json()
+        if state.get("location_path"):
+            player.location = state["location_path"]
+        if not player.journal.entries and "version" in state:
+            player.journal.set_server_version(state["version"])
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+
+def parse_commands(text):
+    """Splits input like 'cd documents; cat mission1.txt' into a list of (command, args)."""
+    commands = []
+    for part in text.split(";"):
+        words = part.split()
+        if words:
+            commands.append((words[0], words[1:]))
+    return commands
+
+# Most commands sent to the server in one batch, matches the server's limit
+MAX_BATCH_SIZE = 50
+
+def handle_commands(commands, player, server):
+    """Runs a sequence of commands, sending runs of server commands as a single batch."""
+    batch = []
+    for command, args in commands:
+        if server.is_connected and command not in LOCAL_COMMANDS and not CATALOG.serves(command):
+            batch.append((command, args))
+            if len(batch) < MAX_BATCH_SIZE:
+                continue
+        if batch:
+            for response in check_commands_server(batch, player, server):
+                print(response["message"])
+            batch = []
+        if command in LOCAL_COMMANDS or not server.is_connected or CATALOG.serves(command):
+            handle_command(command, args, player, server)
 
-        if command == "help":
-            show_help(server)
-            return
+    if batch:
+        for response in check_commands_server(batch, player, server):
+            print(response["message"])
 
-        if command == "exit":
-            sys.exit()
+def run_script(path, player, server):
+    """Runs the commands in a script file, one or more ';'-separated commands per line."""
+    try:
+        with open(path, "r") as f:
+            lines = f.readlines()
+    except OSError as e:
+        print(f"run: {path}: {e.strerror}")
+        return
+
+    commands = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            commands.extend(parse_commands(line))
+    handle_commands(commands, player, server)
+
+@LOCAL_COMMANDS.register("save", "Saves your progress, to the server if connected")
+def local_save(args, player, server):
+    if server.is_connected:
+        try:
+            server.post("/save", json={"username": player.username, "data": {"progress": "some_data", "location": player.location}})
+            print("Saving progress to server...")
+            print("Done!")
+        except requests.exceptions.RequestException:
+            print("Server connection lost, saving locally instead.")
+            player.save_progress_local()
+    else:
+        player.save_progress_local()
 
-        if command == "chat_history":
-            if server.is_connected:
-                url = f"http://{server.host}:{server.port}/get_chat_messages"
-                try:
-                    response = requests.get(url, timeout=server.timeout)
-                    messages = response.json().get("messages", [])
-                    print("\n--- Chat History ---")
-                    for msg in messages:
-                        print(f"[{msg['sender']}]: {msg['message']}")
-                    print("--- End History ---\n")
-                except requests.exceptions.RequestException:
-                    print("Failed to get chat history.")
-            else:
-                print("Not connected to server.")
-            return
+@LOCAL_COMMANDS.register("connect", "Connects to the server")
+def local_connect(args, player, server):
+    if not server.is_connected:
+        connect_player(player, server)
+    else:
+        print("Already connected to the server.")
+
+@LOCAL_COMMANDS.register("disconnect", "Disconnects from the server")
+def local_disconnect(args, player, server):
+    server.disconnect(player)
+
+@LOCAL_COMMANDS.register("help", "Shows this list")
+def local_help(args, player, server):
+    show_help(server)
+
+@LOCAL_COMMANDS.register("exit", "Quits the game")
+def local_exit(args, player, server):
+    sys.exit()
+
+@LOCAL_COMMANDS.register("chat_history", "Shows recent chat messages")
+def local_chat_history(args, player, server):
+    if server.is_connected:
+        try:
+            response = server.get("/get_chat_messages", params={"limit": 50})
+            messages = response.json().get("messages", [])
+            print("\n--- Chat History ---")
+            for msg in messages:
+                print(f"[{msg['sender']}]: {msg['message']}")
+            print("--- End History ---\n")
+        except requests.exceptions.RequestException:
+            print("Failed to get chat history.")
+    else:
+        print("Not connected to server.")
+
+@LOCAL_COMMANDS.register("run", "Runs the commands in a script file", "<script file>")
+def local_run(args, player, server):
+    if not args:
+        print("Usage: run <script file>")
+    else:
+        run_script(args[0], player, server)
+
+def handle_command(command, args, player, server):
+    local_command = LOCAL_COMMANDS.get(command)
+    if local_command is not None:
+        local_command.handler(args, player, server)
+        return
     
     # New: Logic for handling commands based on server connection status
-    if server.is_connected:
+    if server.is_connected and CATALOG.serves(command):
+        # Answered from the cached catalog, no round trip needed
+        print(OFFLINE_COMMANDS.get(command).handler(args, player))
+    elif server.is_connected:
         response = check_command_server(command, args, player, server)
-        if response["status"] == "success":
-            print(response["message"])
-        else:
-            print(response["message"])
+        print(response["message"])
     else:
         # Handle server-side commands locally if disconnected
-        if command in ["ls", "cd", "cat", "chat", "hack"]:
-            message = handle_local_commands(command, args, player)
-            print(message)
-        else:
-            print(f"Command '{command}' not found. You are not connected to the server.")
+        print(handle_local_commands(command, args, player))
+
+LONG_POLL_TIMEOUT = 25  # How long the server may hold an /events request open
+MAX_RECONNECT_DELAY = 30
+
+def format_chat_message(msg):
+    channel = msg.get("channel", "global")
+    if channel.startswith("#"):
+        return f"[{channel}] {msg['sender']}: {msg['message']}"
+    if channel.startswith("@"):
+        return f"[DM from {msg['sender']}]: {msg['message']}"
+    return f"[{msg['sender']}]: {msg['message']}"
+
+def print_chat_messages(player, messages, last_id=None, missed=0):
+    if messages:
+        print("\n--- New Message ---")
+        if missed:
+            print(f"({missed} older message(s) didn't fit in your queue)")
+        for msg in messages:
+            print(format_chat_message(msg))
+        print("-------------------")
+        player.last_chat_id = messages[-1]["id"]
+    # The server filters our queue, so it can tell us to skip ahead past
+    # messages that weren't for us
+    if last_id is not None:
+        player.last_chat_id = max(player.last_chat_id, last_id)
+
+# What the server tells us through /events, shown to the player
+NOTICE_MESSAGES = {
+    "muted": "You have been muted.",
+    "unmuted": "You have been unmuted.",
+    "banned": "You have been banned.",
+    "unbanned": "You have been unbanned.",
+}
+
+# Rate limited (429) or server busy (503), both say how long to wait
+BUSY_STATUSES = (429, 503)
+
+def retry_after(response, default=3):
+    """How long a 429 or 503 asks us to wait."""
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+def poll_once(server, player):
+    """The old way: ask for kicks and new chat messages, then sleep for a bit."""
+    kick_response = server.post("/check_kick", json={"username": player.username})
+    if kick_response.status_code in BUSY_STATUSES:
+        time.sleep(retry_after(kick_response))
+        return
+    if kick_response.json()["should_kick"]:
+        player.is_kicked = True
+        return
+
+    response = server.get("/get_new_chat_messages", params={"username": player.username, "since_id": player.last_chat_id})
+    if response.status_code in BUSY_STATUSES:
+        time.sleep(retry_after(response))
+        return
+    data = response.json()
+    print_chat_messages(player, data.get("messages", []), data.get("last_id"), data.get("missed", 0))
+    time.sleep(3)
+
+def wait_for_events(server, player):
+    """Long-polls /events. Returns False if the server doesn't support it."""
+    response = server.get(
+        "/events",
+        params={"username": player.username, "since_id": player.last_chat_id, "timeout": LONG_POLL_TIMEOUT},
+        timeout=LONG_POLL_TIMEOUT + server.timeout
+    )
+    if response.status_code == 404:
+        return False
+    if response.status_code in BUSY_STATUSES:
+        time.sleep(retry_after(response))
+        return True
+
+    events = response.json()
+    if events.get("should_kick"):
+        player.is_kicked = True
+        return True
+    print_chat_messages(player, events.get("messages", []), events.get("last_id"), events.get("missed", 0))
+    for notice in events.get("notices", []):
+        message = NOTICE_MESSAGES.get(notice.get("type"))
+        if message:
+            if notice.get("until"):
+                message = message[:-1] + time.strftime(" until %Y-%m-%d %H:%M.", time.localtime(notice["until"]))
+            print(f"\nSystem: {message}")
+    if events.get("busy"):
+        # The server had no room to hold our poll open, so it answered right
+        # away. Wait like poll_once does instead of coming straight back.
+        time.sleep(3)
+    return True
 
 def poll_for_messages(server, player):
+    use_events = True
+    retry_delay = 1
     while True:
         if player.is_kicked:
             print("\n!!! You have been disconnected by the server. !!!")
             sys.exit()
 
-        if server.is_connected:
-            try:
-                kick_response = requests.post(f"http://{server.host}:{server.port}/check_kick", json={"username": player.username})
-                if kick_response.json()["should_kick"]:
-                    player.is_kicked = True
-                    continue
-                
-                url = f"http://{server.host}:{server.port}/get_new_chat_messages"
-                response = requests.get(url, params={"last_timestamp": player.last_chat_timestamp})
-                new_messages = response.json().get("messages", [])
-                
-                if new_messages:
-                    print("\n--- New Message ---")
-                    for msg in new_messages:
-                        print(f"[{msg['sender']}]: {msg['message']}")
-                    print("-------------------")
-                    player.last_chat_timestamp = new_messages[-1]["timestamp"]
-            except requests.exceptions.RequestException:
-                pass
-        time.sleep(3)
+        if not server.is_connected:
+            # Try the push channel again after the next connect
+            use_events = True
+            time.sleep(3)
+            continue
+
+        try:
+            if use_events:
+                use_events = wait_for_events(server, player)
+            else:
+                poll_once(server, player)
+            retry_delay = 1
+        except (requests.exceptions.RequestException, ValueError):
+            # Back off and reconnect instead of hammering a server that is down
+            time.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, MAX_RECONNECT_DELAY)
 
 def main():
     with open("server.json", "r") as f:
@@ -301,7 +716,7 @@ def main():
 
     save_files = []
     if os.path.exists("saves"):
-        save_files = [f.replace(".json", "") for f in os.listdir("saves") if f.endswith(".json")]
+        save_files = local_save_names()
 
     username = ""
     player = None
@@ -317,11 +732,11 @@ def main():
             if choice.lower() == "new":
                 while not username:
                     username_input = input("Set your user name! ")
-                    if os.path.exists(os.path.join("saves", f"{username_input}.json")):
+                    if local_save_path(username_input) is not None:
                         print(f"User '{username_input}' already exists locally. Please try a different one.")
                     else:
                         try:
-                            response = requests.post(f"http://{server.host}:{server.port}/check_username", json={"username": username_input})
+                            response = server.post("/check_username", json={"username": username_input})
                             if response.json()["is_available"]:
                                 username = username_input
                                 player = Player(username)
@@ -339,9 +754,8 @@ def main():
                     if 0 <= index < len(save_files):
                         username = save_files[index]
                         player = Player(username)
-                        with open(os.path.join("saves", f"{username}.json"), "r") as f:
-                            save_data = json.load(f)
-                            player.location = save_data.get("location", ["root", "home", "user"])
+                        save_data = load_local_save(username)
+                        player.location = save_data.get("location", ["root", "home", "user"])
                         print(f"You are now {username}!")
                         break
                     else:
@@ -351,11 +765,11 @@ def main():
     else:
         while not username:
             username_input = input("Set your user name! ")
-            if os.path.exists(os.path.join("saves", f"{username_input}.json")):
+            if local_save_path(username_input) is not None:
                 print(f"User '{username_input}' already exists locally. Please try a different one.")
             else:
                 try:
-                    response = requests.post(f"http://{server.host}:{server.port}/check_username", json={"username": username_input})
+                    response = server.post("/check_username", json={"username": username_input})
                     if response.json()["is_available"]:
                         username = username_input
                         player = Player(username)
@@ -367,7 +781,8 @@ def main():
                 except requests.exceptions.RequestException:
                     print("Server connection failed. Cannot check for remote username. Please try again later.")
 
-    server.connect(username)
+    CATALOG.load()
+    connect_player(player, server)
     
     message_thread = threading.Thread(target=poll_for_messages, args=(server, player), daemon=True)
     message_thread.start()
@@ -382,10 +797,13 @@ def main():
             location_string = "~" if player.location == ["root", "home", "user"] else "/".join(player.location)
             user_input = input(f"{username}@{location_string}> ")
             
-            parts = user_input.split(" ")
-            command = parts[0]
-            args = parts[1:]
-            handle_command(command, args, player, server)
+            if ";" in user_input:
+                handle_commands(parse_commands(user_input), player, server)
+            else:
+                parts = user_input.split(" ")
+                command = parts[0]
+                args = parts[1:]
+                handle_command(command, args, player, server)
         except (EOFError, KeyboardInterrupt):
             print("\nGoodbye!")
             break
@@ -0,0 +1,169 @@
+import io
+import time
+import bisect
+import pstats
+import cProfile
+import threading
+
+# --- Low-Overhead Metrics ---
+# Counters, gauges and histograms kept in plain dicts under one lock per
+# metric, rendered in the Prometheus text format for /admin/metrics.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, format_labels(self.labelnames, labels), value) for labels, value in items]
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts)) for labels, counts in self._values.items()]
+        samples = []
+        for labels, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames + ("le",), labels + (bound,))
+                samples.append((f"{self.name}_bucket", bucket_labels, cumulative))
+            samples.append((f"{self.name}_bucket", format_labels(self.labelnames + ("le",), labels + ("+Inf",)), counts[-2]))
+            samples.append((f"{self.name}_count", format_labels(self.labelnames, labels), counts[-2]))
+            samples.append((f"{self.name}_sum", format_labels(self.labelnames, labels), counts[-1]))
+        return samples
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from `func` when metrics are collected."""
+
+    def __init__(self, name, help, func, type="gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.type = type
+
+    def samples(self):
+        try:
+            return [(self.name, "", self.func())]
+        except Exception:
+            return []
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func):
+        return self.register(CallbackMetric(name, help, func))
+
+    def callback_counter(self, name, help, func):
+        return self.register(CallbackMetric(name, help, func, type="counter"))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+# --- Sampling Profiler ---
+class SamplingProfiler:
+    """Runs every `sample_every`-th call under cProfile while enabled.
+
+    Only one call is profiled at a time. Other sampled calls run normally
+    while one is being profiled, so the profiler never blocks requests.
+    """
+
+    def __init__(self, sample_every=100):
+        self.enabled = False
+        self.sample_every = sample_every
+        self.samples = 0
+        self._calls = 0
+        self._profile = cProfile.Profile()
+        self._busy = threading.Lock()
+        self.started = None
+
+    def configure(self, enabled, sample_every=None):
+        if sample_every:
+            self.sample_every = max(1, int(sample_every))
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def reset(self):
+        with self._busy:
+            self._profile = cProfile.Profile()
+            self.samples = 0
+            self.started = time.time()
+
+    def call(self, func, *args, **kwargs):
+        if not self.enabled:
+            return func(*args, **kwargs)
+        self._calls += 1
+        if self._calls % self.sample_every or not self._busy.acquire(blocking=False):
+            return func(*args, **kwargs)
+        try:
+            self.samples += 1
+            return self._profile.runcall(func, *args, **kwargs)
+        finally:
+            self._busy.release()
+
+    def report(self, limit=30):
+        with self._busy:
+            if not self.samples:
+                return "No samples collected."
+            out = io.StringIO()
+            stats = pstats.Stats(self._profile, stream=out)
+            stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
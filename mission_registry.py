@@ -0,0 +1,437 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: only one server process may assign mission bits
+
+# Fields kept in memory for every mission. Everything else (description,
+# solution, reward...) is read from the mission file when it is needed.
+SUMMARY_FIELDS = ("id", "title", "requirements", "reward_progress")
+
+# --- Mission Catalog ---
+class MissionRegistry:
+    """Missions loaded from a directory of JSON files, reloaded when files change.
+
+    Only a small summary of each mission stays resident; full mission data is
+    loaded on demand and kept in a bounded cache. The `missions` listing is
+    rendered once per mission and reused until that mission's file changes,
+    and missions are indexed by their requirements so unlocks can be found
+    without scanning the whole catalog.
+
+    Mission files are read and parsed on `load_workers` threads. With
+    `cache_path` set, the summaries are also written to a cache file, and a
+    restart takes them from there for every file whose modification time and
+    size (or failing that, content hash) haven't changed.
+    """
+
+    def __init__(self, directory, bit_index_path=None, detail_cache_size=256, poll_interval=2,
+                 cache_path=None, load_workers=8):
+        self.directory = directory
+        self.bit_index_path = bit_index_path
+        self.detail_cache_size = detail_cache_size
+        self.poll_interval = poll_interval
+        self.cache_path = cache_path
+        self.load_workers = load_workers
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._files = {}  # filename -> (mtime, mission id)
+        self._cached = {}  # filename -> cache entry: mtime, size, hash and summary
+        self._summaries = OrderedDict()  # mission id -> summary fields + "path"
+        self._details = OrderedDict()  # mission id -> full mission data, least recently used first
+        self._required_by = {}  # mission id -> ids of missions that list it as a requirement
+        self._no_requirements = set()
+        self._rendered = {}  # mission id -> (text before status, text after status)
+        self._bits = {}  # mission id -> bit number in player completion bitsets
+        self._ids_by_bit = []
+        self._thread = None
+        self.version = 0  # bumped whenever the catalog changes
+        self.cache_hits = 0  # files the last reload took from the cache
+        self._load_started = False
+        self._loaded = threading.Event()  # set once the first reload is done
+        self._load_bit_index()
+
+    # --- Loading ---
+    def reload(self):
+        """Loads new and changed mission files and forgets deleted ones. Returns True if anything changed."""
+        with self._reload_lock:
+            self._load_started = True
+            try:
+                return self._reload()
+            finally:
+                self._loaded.set()
+
+    def expect_load(self):
+        """Makes wait_loaded wait for a first reload that is about to start on another thread."""
+        self._load_started = True
+
+    def wait_loaded(self, timeout=None):
+        """Waits for the first reload if one is under way. Returns False if it didn't finish in time."""
+        if not self._load_started:
+            return True
+        return self._loaded.wait(timeout)
+
+    def _reload(self):
+        if not os.path.exists(self.directory):
+            print(f"Server: '{self.directory}' directory not found.")
+            return False
+
+        first_load = not self._loaded.is_set()
+        if first_load:
+            self._cached = self._read_cache()
+
+        seen = set()
+        pending = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            seen.add(entry.name)
+            stat = entry.stat()
+            known = self._files.get(entry.name)
+            if known and known[0] == stat.st_mtime:
+                continue
+            pending.append((entry.name, entry.path, stat.st_mtime, stat.st_size))
+
+        # Read and parse in parallel, then add in filename order so new
+        # missions get their bit numbers in the same order every time
+        if len(pending) > 1 and self.load_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.load_workers, thread_name_prefix="missions") as pool:
+                entries = list(pool.map(lambda args: self._read_entry(*args), pending))
+        else:
+            entries = [self._read_entry(*args) for args in pending]
+
+        changed = False
+        cache_changed = False
+        self.cache_hits = 0
+        with self._bit_index_lock() if pending else nullcontext():
+            # Other workers may have numbered new missions since we last looked
+            if pending:
+                self._merge_bit_index()
+            bits_before = len(self._ids_by_bit)
+            for (filename, path, mtime, _), (entry, from_cache) in sorted(zip(pending, entries)):
+                if entry is None:
+                    continue
+                if from_cache:
+                    self.cache_hits += 1
+                if self._cached.get(filename) != entry:
+                    self._cached[filename] = entry
+                    cache_changed = True
+                self._add(filename, path, mtime, entry["summary"], verbose=not first_load)
+                changed = True
+
+            # Written once for all the missions that were new, not once each
+            if len(self._ids_by_bit) > bits_before:
+                self._save_bit_index()
+
+        for filename in set(self._files) - seen:
+            with self._lock:
+                _, mission_id = self._files.pop(filename)
+                self._remove(mission_id)
+            print(f"Server: Unloaded mission '{mission_id}' ('{filename}' was removed)")
+            changed = True
+        for filename in set(self._cached) - seen:
+            del self._cached[filename]
+            cache_changed = True
+
+        if first_load:
+            print(f"Server: Loaded {len(self._summaries)} missions ({self.cache_hits} from cache)")
+        if cache_changed:
+            self._write_cache()
+        if changed:
+            self.version += 1
+        return changed
+
+    def _read_entry(self, filename, path, mtime, size):
+        """The cache entry for a mission file, read and parsed unless the cache has it. Returns (entry, from_cache)."""
+        cached = self._cached.get(filename)
+        if cached and cached["mtime"] == mtime and cached["size"] == size:
+            return cached, True
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+            digest = hashlib.sha256(raw).hexdigest()
+            if cached and cached["hash"] == digest:
+                # Touched or copied, but the content is the same
+                return dict(cached, mtime=mtime, size=size), True
+            mission_data = json.loads(raw)
+            summary = {field: mission_data.get(field) for field in SUMMARY_FIELDS}
+            summary["id"] = mission_data["id"]
+            summary["requirements"] = list(summary["requirements"] or [])
+        except Exception as e:
+            print(f"Server: Failed to load mission from '{filename}': {e}")
+            return None, False
+        return {"mtime": mtime, "size": size, "hash": digest, "summary": summary}, False
+
+    def _add(self, filename, path, mtime, summary, verbose=True):
+        mission_id = summary["id"]
+        with self._lock:
+            previous = self._files.get(filename)
+            if previous and previous[1] != mission_id:
+                self._remove(previous[1])
+            self._remove(mission_id)
+            summary = dict(summary, path=path)
+            self._summaries[mission_id] = summary
+            self._files[filename] = (mtime, mission_id)
+            self._index(mission_id, summary["requirements"])
+            if mission_id not in self._bits:
+                self._assign_bit(mission_id)
+        if verbose:
+            print(f"Server: Loaded mission '{summary['title']}' from '{filename}'")
+
+    # --- Catalog Cache ---
+    # Summaries by filename, so a restart doesn't have to parse unchanged
+    # files. Written whenever a file was parsed or removed.
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Server: Ignoring mission cache '{self.cache_path}': {e}")
+            return {}
+        # A cache written for other summary fields is no use
+        if cache.get("fields") != list(SUMMARY_FIELDS):
+            return {}
+        return cache.get("files", {})
+
+    def _write_cache(self):
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"fields": list(SUMMARY_FIELDS), "files": self._cached}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"Server: Failed to write mission cache '{self.cache_path}': {e}")
+
+    def _index(self, mission_id, requirements):
+        if requirements:
+            for requirement in requirements:
+                self._required_by.setdefault(requirement, set()).add(mission_id)
+        else:
+            self._no_requirements.add(mission_id)
+
+    def _remove(self, mission_id):
+        summary = self._summaries.pop(mission_id, None)
+        if summary is None:
+            return
+        self._details.pop(mission_id, None)
+        self._rendered.pop(mission_id, None)
+        self._no_requirements.discard(mission_id)
+        for requirement in summary["requirements"]:
+            dependents = self._required_by.get(requirement)
+            if dependents:
+                dependents.discard(mission_id)
+                if not dependents:
+                    del self._required_by[requirement]
+
+    def start_watching(self):
+        """Checks the directory for changes every `poll_interval` seconds in the background."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print(f"Server: Failed to reload missions: {e}")
+
+    # --- Bit Numbers ---
+    # Every mission gets a bit number the first time it is seen. Numbers are
+    # never reused, so completion bitsets stored in player records stay valid
+    # when missions are added, removed or reordered. Every server process
+    # shares the index file, so numbers are only handed out while holding a
+    # lock on it, after taking in the numbers the others have handed out.
+    def _load_bit_index(self):
+        if not self.bit_index_path or not os.path.exists(self.bit_index_path):
+            return
+        with open(self.bit_index_path, "r") as f:
+            self._ids_by_bit = json.load(f)
+        self._bits = {mission_id: bit for bit, mission_id in enumerate(self._ids_by_bit)}
+
+    def _merge_bit_index(self):
+        if not self.bit_index_path or not os.path.exists(self.bit_index_path):
+            return
+        with open(self.bit_index_path, "r") as f:
+            ids_by_bit = json.load(f)
+        # The file only ever grows, so what we know is a prefix of it
+        with self._lock:
+            for bit in range(len(self._ids_by_bit), len(ids_by_bit)):
+                self._bits.setdefault(ids_by_bit[bit], bit)
+                self._ids_by_bit.append(ids_by_bit[bit])
+
+    @contextmanager
+    def _bit_index_lock(self):
+        if not self.bit_index_path or fcntl is None:
+            yield
+            return
+        with open(f"{self.bit_index_path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _assign_bit(self, mission_id):
+        self._bits[mission_id] = len(self._ids_by_bit)
+        self._ids_by_bit.append(mission_id)
+
+    def _save_bit_index(self):
+        if self.bit_index_path:
+            tmp_path = f"{self.bit_index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self._ids_by_bit, f)
+            os.replace(tmp_path, self.bit_index_path)
+
+    def bit(self, mission_id):
+        return self._bits.get(mission_id)
+
+    def mission_for_bit(self, bit):
+        return self._ids_by_bit[bit] if bit < len(self._ids_by_bit) else None
+
+    def completion_set(self, encoded=None):
+        return CompletionSet(self, encoded)
+
+    # --- Lookups ---
+    def __contains__(self, mission_id):
+        return mission_id in self._summaries
+
+    def __len__(self):
+        return len(self._summaries)
+
+    def ids(self):
+        with self._lock:
+            return list(self._summaries)
+
+    def summary(self, mission_id):
+        return self._summaries.get(mission_id)
+
+    def get(self, mission_id):
+        """Full mission data, loaded from its file on first use. None if there is no such mission."""
+        with self._lock:
+            if mission_id in self._details:
+                self._details.move_to_end(mission_id)
+                return self._details[mission_id]
+            summary = self._summaries.get(mission_id)
+        if summary is None:
+            return None
+
+        try:
+            with open(summary["path"], "r") as f:
+                mission_data = json.load(f)
+        except Exception as e:
+            print(f"Server: Failed to load mission '{mission_id}': {e}")
+            return None
+
+        with self._lock:
+            self._details[mission_id] = mission_data
+            while len(self._details) > self.detail_cache_size:
+                self._details.popitem(last=False)
+        return mission_data
+
+    def missing_requirements(self, mission_id, completed):
+        summary = self._summaries.get(mission_id)
+        if summary is None:
+            return []
+        return [requirement for requirement in summary["requirements"] if requirement not in completed]
+
+    def unlocked_by(self, mission_id, completed):
+        """Missions that `mission_id` just unlocked. `completed` should already include `mission_id`."""
+        unlocked = []
+        for dependent in self._required_by.get(mission_id, ()):
+            if dependent not in completed and not self.missing_requirements(dependent, completed):
+                unlocked.append(dependent)
+        return unlocked
+
+    def available(self, completed):
+        """Missions whose requirements are all in `completed`."""
+        candidates = set(self._no_requirements)
+        for mission_id in completed:
+            candidates.update(self._required_by.get(mission_id, ()))
+        return [mission_id for mission_id in candidates if not self.missing_requirements(mission_id, completed)]
+
+    def public(self, mission_id):
+        """Mission data that is safe to send to clients (no solution)."""
+        mission = self.get(mission_id)
+        if mission is None:
+            return None
+        return {field: value for field, value in mission.items() if field != "solution"}
+
+    # --- Rendering ---
+    def rendered(self, mission_id):
+        """The `missions` entry for a mission, split around the status line, which is per player."""
+        parts = self._rendered.get(mission_id)
+        if parts is None:
+            mission = self.get(mission_id)
+            if mission is None:
+                return None
+            parts = (
+                f"ID: {mission_id}\nTitle: {mission['title']}\n",
+                f"Description: {mission['description']}\n---\n"
+            )
+            with self._lock:
+                if mission_id in self._summaries:
+                    self._rendered[mission_id] = parts
+        return parts
+
+    def listing(self, is_completed):
+        """The full `missions` output. `is_completed(mission_id)` decides each status line."""
+        output = ["--- Missions ---\n"]
+        if not self._summaries:
+            output.append("No missions available.\n")
+        for mission_id in self.ids():
+            parts = self.rendered(mission_id)
+            if parts is None:
+                continue
+            status = "COMPLETED" if is_completed(mission_id) else "IN PROGRESS"
+            output.append(f"{parts[0]}Status: {status}\n{parts[1]}")
+        return "".join(output).strip()
+
+# --- Per-Player Completion ---
+class CompletionSet:
+    """The missions a player has completed, as a bitset over the registry's bit numbers.
+
+    Stored in the player record as a hex string. Membership is one byte lookup,
+    so rendering `missions` for a player stays O(1) per mission.
+    """
+
+    def __init__(self, registry, encoded=None):
+        self.registry = registry
+        self.bits = bytearray.fromhex(encoded) if encoded else bytearray()
+
+    def __contains__(self, mission_id):
+        bit = self.registry.bit(mission_id)
+        if bit is None or bit >> 3 >= len(self.bits):
+            return False
+        return bool(self.bits[bit >> 3] & (1 << (bit & 7)))
+
+    def add(self, mission_id):
+        bit = self.registry.bit(mission_id)
+        if bit is None:
+            return
+        if bit >> 3 >= len(self.bits):
+            self.bits.extend(bytes((bit >> 3) + 1 - len(self.bits)))
+        self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            for offset in range(8):
+                if byte & (1 << offset):
+                    mission_id = self.registry.mission_for_bit(index * 8 + offset)
+                    if mission_id is not None:
+                        yield mission_id
+
+    def encode(self):
+        return self.bits.hex()
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import heapq
+import threading
+
+# --- Thread-Safe Moderation and Presence ---
+# Used by the in-process state backend. Request threads and the expiry thread
+# touch these at the same time, so every structure guards itself.
+
+class UserSet:
+    """A set of usernames (muted, banned, pending kicks) with O(1) add, remove and lookup."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._users = set()
+
+    def add(self, username):
+        """Returns False if the user was already in the set."""
+        with self._lock:
+            if username in self._users:
+                return False
+            self._users.add(username)
+            return True
+
+    def discard(self, username):
+        """Returns False if the user wasn't in the set."""
+        with self._lock:
+            if username not in self._users:
+                return False
+            self._users.discard(username)
+            return True
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def list(self):
+        with self._lock:
+            return list(self._users)
+
+class PresenceTracker:
+    """Tracks when each user was last seen and expires them after `timeout` seconds of silence.
+
+    Expiry is driven by a heap of deadlines with at most one entry per user,
+    so the expiry thread sleeps until the next user is actually due instead
+    of scanning everyone on a fixed interval. When an entry comes due for a
+    user who has been seen since, it is pushed back to their new deadline.
+    """
+
+    def __init__(self, timeout=120, on_expire=None):
+        self.timeout = timeout
+        self.on_expire = on_expire
+        self._cond = threading.Condition()
+        self._last_seen = {}
+        self._deadlines = []  # heap of (deadline, username)
+        self._thread = None
+
+    def touch(self, username):
+        """Returns True if the user wasn't being tracked before."""
+        now = time.time()
+        with self._cond:
+            is_new = username not in self._last_seen
+            self._last_seen[username] = now
+            if is_new:
+                heapq.heappush(self._deadlines, (now + self.timeout, username))
+                # A new earliest deadline means the expiry thread should wake up sooner
+                if self._deadlines[0][1] == username:
+                    self._cond.notify()
+            return is_new
+
+    def remove(self, username):
+        """Returns True if the user was being tracked."""
+        # The heap entry is left behind and skipped when it comes due
+        with self._cond:
+            return self._last_seen.pop(username, None) is not None
+
+    def __contains__(self, username):
+        return username in self._last_seen
+
+    def list(self):
+        with self._cond:
+            return list(self._last_seen)
+
+    def expire(self, now=None):
+        """Removes every user whose deadline has passed and returns their names."""
+        now = time.time() if now is None else now
+        expired = []
+        with self._cond:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, username = heapq.heappop(self._deadlines)
+                last_seen = self._last_seen.get(username)
+                if last_seen is None:
+                    continue  # removed already
+                deadline = last_seen + self.timeout
+                if deadline <= now:
+                    del self._last_seen[username]
+                    expired.append(username)
+                else:
+                    heapq.heappush(self._deadlines, (deadline, username))
+        return expired
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._expire_loop, daemon=True)
+            self._thread.start()
+
+    def _expire_loop(self):
+        while True:
+            with self._cond:
+                if self._deadlines:
+                    self._cond.wait(max(self._deadlines[0][0] - time.time(), 0))
+                else:
+                    self._cond.wait()
+            for username in self.expire():
+                if self.on_expire:
+                    self.on_expire(username)
+
+class ModerationStore:
+    """Restrictions by kind (muted and banned users, banned IPs and aliases), kept on disk.
+
+    Each kind is a dict of key -> expiry time (None for permanent), so a
+    check is one lookup. Every change is appended to `path` as a JSON line.
+    Once the log grows past `compact_after` lines, the current state is
+    written to a snapshot and the log starts over, so loading is one
+    json.load plus a short replay no matter how many bans there are.
+
+    Timed restrictions are lifted by a thread that sleeps until the next one
+    is due (a heap of expiry times, like PresenceTracker). Checks also look
+    at the expiry time, so a restriction never outlives it even before that
+    thread gets to it.
+    """
+
+    KINDS = ("muted", "banned", "banned_ip", "banned_alias")
+
+    def __init__(self, path=None, compact_after=1000, on_expire=None):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot" if path else None
+        self.compact_after = compact_after
+        self.on_expire = on_expire
+        self._cond = threading.Condition()
+        self._entries = {kind: {} for kind in self.KINDS}
+        self._deadlines = []  # heap of (expires, kind, key)
+        self._log = None
+        self._log_lines = 0
+        self._thread = None
+        if path:
+            self._load()
+
+    def add(self, kind, key, expires=None):
+        """Adds or updates a restriction. Returns False if it was already there with the same expiry."""
+        with self._cond:
+            entries = self._entries[kind]
+            if key in entries and entries[key] == expires and self._live(entries[key]):
+                return False
+            entries[key] = expires
+            self._write({"op": "add", "kind": kind, "key": key, "expires": expires})
+            if expires is not None:
+                heapq.heappush(self._deadlines, (expires, kind, key))
+                # A new earliest deadline means the expiry thread should wake up sooner
+                if self._deadlines[0] == (expires, kind, key):
+                    self._cond.notify()
+            return True
+
+    def remove(self, kind, key):
+        """Returns False if there was no such restriction."""
+        with self._cond:
+            entries = self._entries[kind]
+            if key not in entries:
+                return False
+            live = self._live(entries.pop(key))
+            self._write({"op": "remove", "kind": kind, "key": key})
+            return live
+
+    def contains(self, kind, key):
+        expires = self._entries[kind].get(key, False)
+        return expires is not False and self._live(expires)
+
+    def expires(self, kind, key):
+        """When the restriction ends, or None if it is permanent (or doesn't exist)."""
+        return self._entries[kind].get(key)
+
+    def list(self, kind):
+        with self._cond:
+            return [key for key, expires in self._entries[kind].items() if self._live(expires)]
+
+    def _live(self, expires):
+        return expires is None or expires > time.time()
+
+    # --- Expiry ---
+    def expire(self, now=None):
+        """Lifts every restriction whose time is up. Returns them as (kind, key) pairs."""
+        now = time.time() if now is None else now
+        expired = []
+        with self._cond:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                expires, kind, key = heapq.heappop(self._deadlines)
+                # Skip entries that were removed or given a new expiry since
+                if self._entries[kind].get(key, False) == expires:
+                    del self._entries[kind][key]
+                    self._write({"op": "remove", "kind": kind, "key": key})
+                    expired.append((kind, key))
+        return expired
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._expire_loop, daemon=True)
+            self._thread.start()
+
+    def _expire_loop(self):
+        while True:
+            with self._cond:
+                if self._deadlines:
+                    self._cond.wait(max(self._deadlines[0][0] - time.time(), 0))
+                else:
+                    self._cond.wait()
+            for kind, key in self.expire():
+                if self.on_expire:
+                    self.on_expire(kind, key)
+
+    # --- Persistence ---
+    def _load(self):
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            for kind, entries in snapshot.get("entries", {}).items():
+                if kind in self._entries:
+                    self._entries[kind].update(entries)
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # a torn write at the end, everything before it is intact
+                    self._replay(record)
+                    self._log_lines += 1
+        except FileNotFoundError:
+            pass
+
+        now = time.time()
+        for kind, entries in self._entries.items():
+            for key, expires in list(entries.items()):
+                if expires is None:
+                    continue
+                if expires <= now:
+                    del entries[key]
+                else:
+                    self._deadlines.append((expires, kind, key))
+        heapq.heapify(self._deadlines)
+        if self._log_lines:
+            self._compact()
+
+    def _replay(self, record):
+        entries = self._entries.get(record.get("kind"))
+        if entries is None:
+            return
+        if record["op"] == "add":
+            entries[record["key"]] = record.get("expires")
+        elif record["op"] == "remove":
+            entries.pop(record["key"], None)
+
+    def _write(self, record):
+        # Called with the lock held
+        if not self.path:
+            return
+        if self._log is None:
+            self._log = open(self.path, "a")
+        self._log.write(json.dumps(record) + "\n")
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log_lines += 1
+        if self._log_lines >= self.compact_after:
+            self._compact()
+
+    def _compact(self):
+        """Writes the current state to the snapshot and empties the log."""
+        if not self.path:
+            return
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self._entries}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # Replaying the old log over the new snapshot gives the same state,
+        # so a crash before the log is emptied loses nothing
+        if self._log is not None:
+            self._log.close()
+        self._log = open(self.path, "w")
+        self._log_lines = 0
+
+    def close(self):
+        with self._cond:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,258 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+import save_codec
+from metrics import Histogram
+
+# --- Write-Behind Player State Store ---
+class PlayerStore:
+    """Keeps player records in memory and writes them back to disk in the background.
+
+    Records are loaded on first use and served from memory afterwards. Changes are
+    marked dirty and flushed every `flush_interval` seconds, all dirty records in
+    one `storage.write_many` call. Idle or least recently used players are evicted
+    once their changes are stored. Records are encoded with save_codec.
+
+    Flushes are group-committed: one batch is written at a time, and everyone
+    who asks for a flush while it is being written shares the next batch. A
+    burst of saves costs one storage write (and one round of fsyncs) instead
+    of one per request, and an older copy of a record can never be written
+    over a newer one.
+    """
+
+    def __init__(self, storage, capacity=1024, flush_interval=5, idle_timeout=600):
+        self.storage = storage  # a user_storage.UserStorage
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self._lock = threading.RLock()
+        self._records = OrderedDict()  # username -> record, least recently used first
+        self._last_used = {}
+        self._dirty = set()
+        self._writing = set()  # usernames in the batch being written
+        self._failed = set()  # usernames the last batch that had them couldn't write
+        self._committing = False
+        self._committed = threading.Condition(self._lock)
+        self._batches_started = 0
+        self._batches_done = 0
+        # Serializes read-modify-write of one player's record, see lock_for
+        self._user_locks = [threading.Lock() for _ in range(64)]
+        # Serializes loading one player's record from storage, see get. Kept
+        # apart from the locks above, which callers already hold around get.
+        self._load_locks = [threading.Lock() for _ in range(64)]
+        self._stop = threading.Event()
+        self._thread = None
+        # File I/O counters, read by /admin/metrics
+        self.reads = 0
+        self.read_bytes = 0
+        self.writes = 0
+        self.write_bytes = 0
+        self.commits = 0
+        # Durability latency, registered with /admin/metrics by the server
+        self.commit_latency = Histogram(
+            "fusionbytes_save_commit_seconds", "Time to write and sync one batch of player records.")
+        self.durable_latency = Histogram(
+            "fusionbytes_save_durable_seconds", "Time from a flush request until the records were stored.")
+        self.batch_size = Histogram(
+            "fusionbytes_save_batch_records", "Player records written per batch.",
+            buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, username):
+        """Returns a copy of the player's record, or None if the player doesn't exist."""
+        with self._lock:
+            record = self._records.get(username)
+            if record is not None:
+                self._touch(username)
+                record = copy.deepcopy(record)
+        if record is None:
+            record = self._load(username)
+            if record is None:
+                return None
+        self._evict_overflow()
+        return record
+
+    def put(self, username, data):
+        """Replaces the player's record in memory and marks it for the next flush."""
+        with self._lock:
+            self._records[username] = copy.deepcopy(data)
+            self._dirty.add(username)
+            self._touch(username)
+        self._evict_overflow()
+
+    def lock_for(self, username):
+        """A lock to hold while loading, changing and saving a player's record,
+        so two requests for the same player can't overwrite each other's changes.
+        Players share a fixed set of locks, so this never grows."""
+        return self._user_locks[hash(username) % len(self._user_locks)]
+
+    def exists(self, username):
+        with self._lock:
+            if username in self._records:
+                return True
+        return self.storage.exists(username)
+
+    def flush(self, username=None):
+        """Writes dirty records to storage and waits until they are stored.
+
+        With a username, returns whether that player's record was stored,
+        otherwise whether every record was. Other dirty records go out in the
+        same batch either way.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            if username is not None and username not in self._dirty and username not in self._writing:
+                return username not in self._failed
+            if username is None and not self._dirty and not self._writing:
+                return not self._failed
+            # Changes made before now are in the batch after the one being
+            # written, if any. Wait for that one, or write it ourselves.
+            target = self._batches_started + 1
+
+        while True:
+            with self._lock:
+                while self._committing and self._batches_done < target:
+                    self._committed.wait()
+                if self._batches_done >= target:
+                    stored = username not in self._failed if username is not None else not self._failed
+                    break
+                pending = self._start_batch()
+            failed = [name for name, _ in pending]
+            try:
+                failed = self._commit(pending)
+            finally:
+                with self._lock:
+                    self._finish_batch(pending, set(failed))
+
+        self.durable_latency.observe(time.perf_counter() - start)
+        return stored
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+    # --- Internals ---
+    def _touch(self, username):
+        self._records.move_to_end(username)
+        self._last_used[username] = time.time()
+
+    def _drop(self, username):
+        self._records.pop(username, None)
+        self._last_used.pop(username, None)
+
+    def _unsaved(self, username):
+        return username in self._dirty or username in self._writing
+
+    def _evict_overflow(self):
+        # Called without the lock. Dirty records are written out before eviction.
+        with self._lock:
+            overflow = list(self._records)[:max(0, len(self._records) - self.capacity)]
+            if not overflow:
+                return
+            needs_flush = any(self._unsaved(name) for name in overflow)
+        if needs_flush:
+            self.flush()
+        with self._lock:
+            while len(self._records) > self.capacity:
+                username = next(iter(self._records))
+                if self._unsaved(username):
+                    return  # changed again or failed to write, the next flush retries
+                self._drop(username)
+
+    def _evict_idle(self):
+        threshold = time.time() - self.idle_timeout
+        with self._lock:
+            idle = [name for name, last in self._last_used.items() if last < threshold and not self._unsaved(name)]
+            for username in idle:
+                self._drop(username)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self._evict_idle()
+
+    def _load(self, username):
+        # Storage is read without the store-wide lock, so a slow read only
+        # holds up requests for players sharing this load lock
+        with self._load_locks[hash(username) % len(self._load_locks)]:
+            with self._lock:
+                record = self._records.get(username)
+            if record is None:
+                record = self._read(username)
+                if record is None:
+                    return None
+            with self._lock:
+                # A put while we were reading wins over what was on disk
+                record = self._records.setdefault(username, record)
+                self._touch(username)
+                return copy.deepcopy(record)
+
+    def _read(self, username):
+        try:
+            raw = self.storage.read(username)
+            if raw is None:
+                return None
+            self.reads += 1
+            self.read_bytes += len(raw)
+            return save_codec.decode(raw)
+        except Exception as e:
+            print(f"Error loading user data: {e}")
+            return None
+
+    def _start_batch(self):
+        # Called with the lock held
+        self._committing = True
+        self._batches_started += 1
+        pending = [(name, copy.deepcopy(self._records[name])) for name in self._dirty]
+        self._writing.update(self._dirty)
+        self._dirty.clear()
+        return pending
+
+    def _commit(self, pending):
+        if not pending:
+            return []
+        start = time.perf_counter()
+        failed = self._write_many(pending)
+        self.commit_latency.observe(time.perf_counter() - start)
+        self.batch_size.observe(len(pending))
+        self.commits += 1
+        return failed
+
+    def _finish_batch(self, pending, failed):
+        # Called with the lock held
+        for username, _ in pending:
+            self._writing.discard(username)
+            if username in failed:
+                self._failed.add(username)
+                if username in self._records:
+                    self._dirty.add(username)  # keep it dirty so the next flush tries again
+            else:
+                self._failed.discard(username)
+        self._batches_done += 1
+        self._committing = False
+        self._committed.notify_all()
+
+    def _write_many(self, pending):
+        """Writes (username, record) pairs. Returns the usernames that failed."""
+        encoded = []
+        failed = []
+        for username, record in pending:
+            try:
+                encoded.append((username, save_codec.encode(record)))
+            except save_codec.SaveFormatError as e:
+                print(f"Error saving user data: {e}")
+                failed.append(username)
+        if encoded:
+            failed += self.storage.write_many(encoded)
+            written = [raw for username, raw in encoded if username not in failed]
+            self.writes += len(written)
+            self.write_bytes += sum(len(raw) for raw in written)
+        return failed
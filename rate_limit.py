@@ -0,0 +1,73 @@
+import time
+import threading
+from collections import OrderedDict
+
+# --- Rate Limiting and Admission Control ---
+class RateLimiter:
+    """Token buckets, one per key (a username or an IP address).
+
+    Each bucket holds up to `burst` tokens and refills at `rate` tokens per
+    second. Buckets are kept least recently used first, and a bucket nobody
+    has used for burst / rate seconds is full again, so it is dropped: memory
+    stays proportional to the keys that were active recently.
+    """
+
+    def __init__(self, rate, burst):
+        if rate <= 0 or burst < 1:
+            raise ValueError(f"Rate limit needs a positive rate and a burst of at least 1, got [{rate}, {burst}]")
+        self.rate = rate
+        self.burst = burst
+        self.full_after = burst / rate
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, last update)
+
+    def allow(self, key, cost=1):
+        """Takes `cost` tokens from the key's bucket. Returns 0 if that worked,
+        otherwise how many seconds until it would."""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            return wait
+
+    def _expire(self, now):
+        while self._buckets:
+            key, (_, last) = next(iter(self._buckets.items()))
+            if now - last < self.full_after:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+class AdmissionControl:
+    """Caps how many requests are being worked on at once. 0 means no cap.
+
+    Requests over the cap are turned away right away (503) instead of
+    queueing for a worker thread, so a flood can't tie up the whole pool.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self):
+        with self._lock:
+            if self.limit and self.in_flight >= self.limit:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
@@ -0,0 +1,222 @@
+import json
+import zlib
+import struct
+
+# --- Save File Codec ---
+# Player saves (the server's cloud_saves/ and the client's saves/) are stored
+# as a small header followed by the record in a compact tagged binary
+# encoding, zlib-compressed when that pays off:
+#
+#   b"FBSV" | schema version (1 byte) | flags (1 byte) | payload
+#
+# Saves written before this are plain JSON. They are read as schema 1 and
+# migrated on load, so old files keep working and are upgraded on next save.
+
+MAGIC = b"FBSV"
+HEADER = struct.Struct(">4sBB")
+SCHEMA_VERSION = 2
+FLAG_ZLIB = 1
+COMPRESS_MIN_SIZE = 256  # smaller payloads are stored as they are
+
+DEFAULT_LOCATION = ["root", "home", "user"]
+
+class SaveFormatError(ValueError):
+    pass
+
+# --- Tagged Encoding ---
+# One tag byte per value. Ints are zigzag varints, strings and containers are
+# prefixed with a varint length, dict keys are always strings.
+T_NONE, T_FALSE, T_TRUE, T_INT, T_FLOAT, T_STR, T_LIST, T_DICT = range(8)
+FLOAT = struct.Struct(">d")
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _write_str(out, value):
+    data = value.encode("utf-8")
+    _write_varint(out, len(data))
+    out += data
+
+def _encode_value(out, value):
+    if value is None:
+        out.append(T_NONE)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, int):
+        out.append(T_INT)
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += FLOAT.pack(value)
+    elif isinstance(value, str):
+        out.append(T_STR)
+        _write_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(T_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _encode_value(out, item)
+    elif isinstance(value, dict):
+        out.append(T_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise SaveFormatError(f"Save keys must be strings, got {key!r}")
+            _write_str(out, key)
+            _encode_value(out, item)
+    else:
+        raise SaveFormatError(f"Can't store {type(value).__name__} in a save")
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        if self.pos >= len(self.data):
+            raise SaveFormatError("Save data is truncated")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def take(self, count):
+        if self.pos + count > len(self.data):
+            raise SaveFormatError("Save data is truncated")
+        chunk = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return chunk
+
+    def varint(self):
+        value = 0
+        shift = 0
+        while True:
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    def text(self):
+        try:
+            return bytes(self.take(self.varint())).decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise SaveFormatError(f"Invalid text in save: {e}")
+
+    def value(self):
+        tag = self.byte()
+        if tag == T_NONE:
+            return None
+        if tag == T_FALSE:
+            return False
+        if tag == T_TRUE:
+            return True
+        if tag == T_INT:
+            raw = self.varint()
+            return (raw >> 1) if not raw & 1 else -((raw + 1) >> 1)
+        if tag == T_FLOAT:
+            return FLOAT.unpack(self.take(FLOAT.size))[0]
+        if tag == T_STR:
+            return self.text()
+        if tag == T_LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == T_DICT:
+            result = {}
+            for _ in range(self.varint()):
+                key = self.text()
+                result[key] = self.value()
+            return result
+        raise SaveFormatError(f"Unknown tag {tag} in save")
+
+# --- Schema ---
+# Known fields and their types. Other fields are kept as they are so newer
+# clients can add data without breaking older servers.
+FIELD_TYPES = {
+    "username": str,
+    "progress": str,
+    "location": list,
+    "version": int,
+    "completed_missions": str,
+    "reward_progress": int,
+    "journal_seqs": dict,
+    "chat_rooms": list,
+    "chat_blocked": list,
+}
+
+def validate(record):
+    if not isinstance(record, dict):
+        raise SaveFormatError("Save must contain a record")
+    for field, expected in FIELD_TYPES.items():
+        value = record.get(field)
+        if value is None:
+            continue
+        if not isinstance(value, expected) or isinstance(value, bool):
+            raise SaveFormatError(f"Field '{field}' should be {expected.__name__}, got {type(value).__name__}")
+    if not all(isinstance(part, str) for part in record.get("location") or []):
+        raise SaveFormatError("Field 'location' should be a list of directory names")
+    return record
+
+def _migrate_1(record):
+    """Schema 1 was the untyped JSON save, which older clients wrote without some fields."""
+    record.setdefault("progress", "fresh_start")
+    record.setdefault("location", list(DEFAULT_LOCATION))
+    return record
+
+# Upgrades a record from the schema version it's keyed by to the next one
+MIGRATIONS = {
+    1: _migrate_1,
+}
+
+def migrate(record, schema):
+    if not isinstance(record, dict):
+        raise SaveFormatError("Save must contain a record")
+    while schema < SCHEMA_VERSION:
+        step = MIGRATIONS.get(schema)
+        if step is None:
+            raise SaveFormatError(f"Unknown save schema {schema}")
+        record = step(record)
+        schema += 1
+    return record
+
+# --- Public API ---
+def encode(record, compress=True):
+    """Serializes a player record to bytes in the current schema."""
+    payload = bytearray()
+    _encode_value(payload, validate(record))
+    flags = 0
+    if compress and len(payload) >= COMPRESS_MIN_SIZE:
+        compressed = zlib.compress(bytes(payload))
+        if len(compressed) < len(payload):
+            payload = compressed
+            flags |= FLAG_ZLIB
+    return HEADER.pack(MAGIC, SCHEMA_VERSION, flags) + bytes(payload)
+
+def decode(raw):
+    """Reads a save written by `encode` or a legacy JSON save. Returns the record in the current schema."""
+    if not raw.startswith(MAGIC):
+        try:
+            record = json.loads(raw)
+        except ValueError as e:
+            raise SaveFormatError(f"Save is neither binary nor JSON: {e}")
+        return validate(migrate(record, 1))
+
+    if len(raw) < HEADER.size:
+        raise SaveFormatError("Save header is truncated")
+    _, schema, flags = HEADER.unpack_from(raw)
+    if schema > SCHEMA_VERSION:
+        raise SaveFormatError(f"Save uses schema {schema}, this version only reads up to {SCHEMA_VERSION}")
+    payload = raw[HEADER.size:]
+    if flags & FLAG_ZLIB:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error as e:
+            raise SaveFormatError(f"Save data is corrupt: {e}")
+    reader = _Reader(memoryview(payload))
+    record = reader.value()
+    if reader.pos != len(payload):
+        raise SaveFormatError("Unexpected data after the save record")
+    return validate(migrate(record, schema))
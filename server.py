@@ -1,27 +1,236 @@
 import os
+import sys
 import json
-from flask import Flask, jsonify, request, render_template, send_from_directory
-from werkzeug.utils import secure_filename
+import math
+import hashlib
+from datetime import datetime, timezone
+from flask import Flask, jsonify, request, render_template, send_from_directory, g, has_request_context
 import time
 import threading
 import logging
+import atexit
 from flask_cors import CORS
+from player_store import PlayerStore
+from user_storage import create_user_storage
+from event_hub import EventHub
+from chat_hub import ChatHub, GLOBAL_CHANNEL, dm_channel, message_channel
+from chat_archive import ChatArchive
+from state_backend import create_backend
+from vfs import VirtualFS
+from mission_registry import MissionRegistry
+from metrics import MetricsRegistry, SamplingProfiler
+from commands import CommandRegistry
+from rate_limit import RateLimiter, AdmissionControl
+from concurrent.futures import ThreadPoolExecutor
+from save_codec import SaveFormatError, validate as validate_record
 
 app = Flask(__name__)
 CORS(app)
 
+STARTUP_STARTED = time.perf_counter()
+
 with open("server.json", "r") as f:
     config = json.load(f)
 
-# Global in-memory state for chat and moderation
-CHAT_LOG = []
-MUTED_USERS = {}
-BANNED_USERS = {}
-KICKED_USERS = []
-ACTIVE_USERS = {}  # New: In-memory dictionary to track active users
+# --- Startup Timing ---
+# How long each startup phase took, printed as each one finishes and listed
+# on /admin/startup
+STARTUP_PHASES = {}
+
+def startup_phase(name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    STARTUP_PHASES[name] = time.perf_counter() - start
+    print(f"Server: Startup phase '{name}' took {STARTUP_PHASES[name] * 1000:.0f}ms")
+    return result
+
+# Chat, moderation and presence state. In-process by default, or shared
+# between worker processes with "state_backend": "sqlite" in server.json.
+STATE = startup_phase("state", create_backend, config)
+atexit.register(STATE.close)
+SHARED_STATE = STATE.poll_interval is not None
+
+# Wakes up clients waiting on /events when chat or moderation state changes
+EVENTS = EventHub(poll_interval=STATE.poll_interval)
+LONG_POLL_TIMEOUT = config.get("long_poll_timeout", 25)
+
+# --- Instrumentation ---
+METRICS = MetricsRegistry()
+HTTP_REQUESTS = METRICS.counter(
+    "fusionbytes_http_requests_total", "HTTP requests by endpoint, method and status.", ("endpoint", "method", "status"))
+HTTP_LATENCY = METRICS.histogram(
+    "fusionbytes_http_request_seconds", "HTTP request latency by endpoint.", ("endpoint",))
+COMMANDS_RUN = METRICS.counter(
+    "fusionbytes_commands_total", "Server commands run, by command and result.", ("command", "status"))
+COMMAND_LATENCY = METRICS.histogram(
+    "fusionbytes_command_seconds", "Time spent running each server command.", ("command",))
+METRICS.gauge("fusionbytes_active_users", "Users seen recently.", lambda: len(STATE.active_users()))
+METRICS.gauge("fusionbytes_chat_messages", "Chat messages currently retained.", lambda: STATE.chat_size())
+CHAT_SENT = METRICS.counter("fusionbytes_chat_messages_sent_total", "Chat messages sent.")
+METRICS.gauge("fusionbytes_player_cache_records", "Player records held in memory.", lambda: len(PLAYER_STORE))
+METRICS.callback_counter("fusionbytes_state_file_reads_total", "Player save files read.", lambda: PLAYER_STORE.reads)
+METRICS.callback_counter("fusionbytes_state_file_read_bytes_total", "Bytes read from player save files.", lambda: PLAYER_STORE.read_bytes)
+METRICS.callback_counter("fusionbytes_state_file_writes_total", "Player save files written.", lambda: PLAYER_STORE.writes)
+METRICS.callback_counter("fusionbytes_state_file_write_bytes_total", "Bytes written to player save files.", lambda: PLAYER_STORE.write_bytes)
+METRICS.callback_counter("fusionbytes_save_commits_total", "Batches of player records written.", lambda: PLAYER_STORE.commits)
+
+# Optional profiler for handle_server_command, toggled from /admin/profiler
+PROFILER = SamplingProfiler()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.observe(time.perf_counter() - start, endpoint)
+        HTTP_REQUESTS.inc(endpoint, request.method, response.status_code)
+    return response
+
+# --- Rate Limits and Admission Control ---
+# Token bucket budgets as [tokens per second, burst], kept per username and
+# per client IP. Entries in "rate_limits" in server.json replace these by
+# name. An empty entry ({}) turns limiting off for that endpoint, and a
+# budget with a rate of 0 (or null) turns off just that one.
+DEFAULT_RATE_LIMITS = {
+    "/check_command": {"per_user": [10, 30], "per_ip": [50, 150]},
+    "/check_commands": {"per_user": [2, 10], "per_ip": [10, 50]},
+    "/save": {"per_user": [1, 5], "per_ip": [5, 25]},
+    "/sync": {"per_user": [1, 5], "per_ip": [5, 25]},
+    "/register_user": {"per_ip": [0.1, 5]},
+    "/check_username": {"per_ip": [1, 10]},
+    # The chat command, whichever endpoint it comes through
+    "chat": {"per_user": [1, 5], "per_ip": [5, 25]},
+}
+def build_rate_limits(limits):
+    """RateLimiters by name and scope. Raises ValueError for a budget that isn't valid,
+    so a typo in server.json stops the server at startup instead of on a request."""
+    built = {}
+    for name, scopes in limits.items():
+        built[name] = {}
+        for scope, budget in (scopes or {}).items():
+            if scope not in ("per_user", "per_ip"):
+                raise ValueError(f"rate_limits.{name}: unknown scope '{scope}', use per_user or per_ip")
+            if budget is None or (isinstance(budget, list) and budget and not budget[0]):
+                continue  # a rate of 0 or null: not limited
+            if not (isinstance(budget, list) and len(budget) == 2
+                    and all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in budget)):
+                raise ValueError(f"rate_limits.{name}.{scope}: expected [tokens per second, burst], got {budget!r}")
+            try:
+                built[name][scope] = RateLimiter(*budget)
+            except ValueError as e:
+                raise ValueError(f"rate_limits.{name}.{scope}: {e}")
+    return built
+
+RATE_LIMITS = build_rate_limits({**DEFAULT_RATE_LIMITS, **config.get("rate_limits", {})})
+# Addresses that skip the per-IP budgets, e.g. a reverse proxy or a load test
+TRUSTED_IPS = set(config.get("rate_limit_trusted_ips", []))
+
+def waitress_serve_threads():
+    """The thread count `waitress-serve server:app` (or `python -m waitress`)
+    is running with, or None if this module wasn't loaded that way."""
+    runner = os.path.basename(sys.argv[0])
+    if runner != "waitress-serve" and not (runner == "__main__.py" and os.path.basename(os.path.dirname(sys.argv[0])) == "waitress"):
+        return None
+    from waitress.adjustments import Adjustments
+    try:
+        options, _ = Adjustments.parse_args(sys.argv[1:])
+        return int(options.get("threads", Adjustments.threads))
+    except Exception:
+        return None
+
+# Worker threads serving requests: "threads" in server.json when the server
+# runs itself, or whatever waitress-serve --threads says (4 unless given)
+WORKER_THREADS = waitress_serve_threads() or config.get("threads", 16)
+if "threads" in config and config["threads"] != WORKER_THREADS:
+    print(f"Server: Running {WORKER_THREADS} worker threads as waitress-serve was told, not the {config['threads']} in server.json")
+
+# Both caps follow the thread count, since the check runs on a worker
+# thread that is already taken: a cap above the pool size could never trip.
+# Every request, parked long-polls included, counts against ADMISSION, which
+# leaves one thread to turn the rest away with a 503 instead of letting them
+# queue. A parked long-poll holds its worker thread while idle, so at most
+# half of the threads park. Over that, /events answers right away with what
+# there is and the client falls back to short polling for a while.
+ADMISSION = AdmissionControl(min(config.get("max_concurrent_requests", WORKER_THREADS - 1), WORKER_THREADS - 1))
+LONG_POLL_ADMISSION = AdmissionControl(min(config.get("max_long_polls", WORKER_THREADS // 2), WORKER_THREADS // 2))
+LONG_POLL_PATHS = ("/events",)
+
+RATE_LIMITED = METRICS.counter(
+    "fusionbytes_rate_limited_total", "Requests or commands refused by a rate limit.", ("limit",))
+METRICS.callback_counter("fusionbytes_admission_rejected_total", "Requests turned away by the concurrency cap.",
+                         lambda: ADMISSION.rejected + LONG_POLL_ADMISSION.rejected)
+METRICS.gauge("fusionbytes_requests_in_flight", "Requests being worked on, parked long-polls included.", lambda: ADMISSION.in_flight)
+METRICS.gauge("fusionbytes_long_polls_in_flight", "Long-poll requests being held open.", lambda: LONG_POLL_ADMISSION.in_flight)
+METRICS.gauge("fusionbytes_rate_limit_buckets", "Token buckets tracked for recently active users and IPs.",
+              lambda: sum(len(limiter) for limits in RATE_LIMITS.values() for limiter in limits.values()))
+
+def rate_limit_wait(name, username=None, ip=None):
+    """Takes a token for `name` from the user's and the IP's buckets.
+
+    Returns 0 if the call is allowed, otherwise how many seconds to wait.
+    """
+    limits = RATE_LIMITS.get(name)
+    if not limits:
+        return 0
+    wait = 0
+    for scope, key in (("per_user", username), ("per_ip", None if ip in TRUSTED_IPS else ip)):
+        limiter = limits.get(scope)
+        if limiter is not None and key:
+            wait = max(wait, limiter.allow(key))
+    if wait:
+        RATE_LIMITED.inc(name)
+    return wait
+
+def too_many_requests(retry_after, message="Too many requests, slow down."):
+    response = jsonify({"status": "error", "message": message})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+def server_busy():
+    response = jsonify({"status": "error", "message": "Server is busy, try again shortly."})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+def request_username():
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and data.get("username"):
+        return data["username"]
+    return request.args.get("username")
+
+@app.before_request
+def admit_request():
+    g.admission = []
+    if not ADMISSION.try_enter():
+        return server_busy()
+    g.admission.append(ADMISSION)
+    # Over the long-poll cap a poll isn't turned away, it just doesn't park (see get_events)
+    if request.path in LONG_POLL_PATHS and LONG_POLL_ADMISSION.try_enter():
+        g.admission.append(LONG_POLL_ADMISSION)
+    wait = rate_limit_wait(request.path, request_username(), request.remote_addr)
+    if wait:
+        return too_many_requests(wait)
+
+@app.teardown_request
+def release_admission(exc):
+    for gate in g.pop("admission", []):
+        gate.leave()
 
-# A dictionary to hold mission data, loaded from files
-MISSIONS = {}
+# Mission catalog, loaded from the missions directory and reloaded when files change
+MISSIONS = MissionRegistry(
+    "missions",
+    bit_index_path=config.get("mission_bits_file", "mission_bits.json"),
+    poll_interval=config.get("mission_reload_interval", 2),
+    cache_path=config.get("mission_cache_file", "mission_cache.json"),
+    load_workers=config.get("startup_workers", 8),
+)
+# Mission commands sent while the catalog is still loading wait this long for it
+MISSION_LOAD_WAIT = config.get("mission_load_wait", 10)
 
 # The shared, authoritative file system
 file_system = {
@@ -39,176 +248,434 @@ file_system = {
 }
 
 # --- User Data Persistence ---
-def get_user_data_path(username):
-    # Sanitize the username to prevent path traversal
-    safe_username = secure_filename(username)
-    base_dir = os.path.abspath("cloud_saves")
-    path = os.path.join(base_dir, f"{safe_username}.json")
-    norm_path = os.path.normpath(path)
-    # Ensure the normalized path is within the intended directory
-    if not norm_path.startswith(base_dir):
-        raise Exception("Invalid username/path traversal detected")
-    return norm_path
-
-def save_user_data(username, data):
-    if not os.path.exists("cloud_saves"):
-        os.makedirs("cloud_saves")
-    path = get_user_data_path(username)
-    try:
-        with open(path, "w") as f:
-            json.dump(data, f)
-        return True
-    except Exception as e:
-        print(f"Error saving user data: {e}")
-        return False
+# Player records live in cloud_saves/ (one file each) or a SQLite database,
+# see user_storage.py
+USER_STORAGE = startup_phase("user_storage", create_user_storage, config)
+
+# Player records are served from memory and written back in the background
+# With several worker processes each would have its own cache, so records are
+# written through and re-read on every request instead (capacity 0).
+PLAYER_STORE = PlayerStore(
+    USER_STORAGE,
+    capacity=0 if SHARED_STATE else config.get("player_cache_size", 1024),
+    flush_interval=config.get("player_flush_interval", 5),
+    idle_timeout=config.get("player_idle_timeout", 600),
+)
+PLAYER_STORE.start()
+atexit.register(PLAYER_STORE.close)
+METRICS.register(PLAYER_STORE.commit_latency)
+METRICS.register(PLAYER_STORE.durable_latency)
+METRICS.register(PLAYER_STORE.batch_size)
+
+# --- Chat Fan-Out ---
+# Players read chat from their own queue (see chat_hub.py), which only gets
+# the global channel, the rooms they joined and their direct messages.
+def load_chat_settings(username):
+    record = PLAYER_STORE.get(username) or {}
+    return record.get("chat_rooms", []), record.get("chat_blocked", [])
+
+CHAT_HUB = ChatHub(
+    load_chat_settings,
+    queue_size=config.get("chat_queue_size", 200),
+    idle_timeout=config.get("chat_subscriber_timeout", 300),
+    # Other workers can change a player's rooms, so re-read them now and then
+    refresh_interval=5 if SHARED_STATE else None,
+)
+CHAT_HUB.start(STATE.chat_last_id())
+METRICS.gauge("fusionbytes_chat_subscribers", "Players with a chat queue on this server.", lambda: len(CHAT_HUB))
+METRICS.callback_counter("fusionbytes_chat_dropped_total", "Chat messages lost to full player queues.", lambda: CHAT_HUB.dropped)
+
+# Every message is also kept in an on-disk archive for moderation searches
+# (/admin/chat_search). Set "chat_archive_dir" to null to turn it off.
+CHAT_ARCHIVE = None
+if config.get("chat_archive_dir", "chat_archive"):
+    CHAT_ARCHIVE = ChatArchive(
+        config.get("chat_archive_dir", "chat_archive"),
+        segment_hours=config.get("chat_archive_segment_hours", 24),
+        # Messages are archived in batches this often, off the request path
+        pump_interval=config.get("chat_archive_interval", 1),
+    )
+    startup_phase("chat_archive", CHAT_ARCHIVE.resume, STATE.chat_since_timestamp, STATE.chat_last_id())
+    CHAT_ARCHIVE.start(STATE.chat_since)
+    atexit.register(CHAT_ARCHIVE.close)
+    METRICS.callback_counter("fusionbytes_chat_archived_total", "Chat messages written to the archive.", lambda: CHAT_ARCHIVE.archived)
+
+def load_user_data(username):
+    return PLAYER_STORE.get(username)
+
+def save_user_data(username, data, flush=False):
+    """Stores the player's record. With flush=True, waits until it is on disk.
+
+    Callers that load, change and save a record hold PLAYER_STORE.lock_for(username)
+    around all three, so concurrent requests for one player don't lose changes.
+    Raises SaveFormatError if the record doesn't fit the save schema, before
+    it can replace the one in memory.
+    """
+    validate_record(data)
+    # Every change bumps the record's version, which /sync uses to spot conflicts
+    data["version"] = data.get("version", 0) + 1
+    PLAYER_STORE.put(username, data)
+    if flush:
+        return PLAYER_STORE.flush(username)
+    return True
 
 # Function to load mission data from the missions directory
 def load_missions():
-    missions_dir = "missions"
-    if not os.path.exists(missions_dir):
-        print("Server: 'missions' directory not found.")
-        return
-
-    for filename in os.listdir(missions_dir):
-        if filename.endswith(".json"):
-            filepath = os.path.join(missions_dir, filename)
-            try:
-                with open(filepath, "r") as f:
-                    mission_data = json.load(f)
-                    MISSIONS[mission_data["id"]] = mission_data
-                print(f"Server: Loaded mission '{mission_data['title']}' from '{filename}'")
-            except Exception as e:
-                print(f"Server: Failed to load mission from '{filename}': {e}")
+    MISSIONS.reload()
+    MISSIONS.start_watching()
 
 # --- Server-Side Command Handling ---
-SERVER_COMMANDS = {
-    "echo": "Echoes back the arguments provided",
-    "chat": "Sends a message to all connected players",
-    "hack": "Attempts to solve a mission or hack a system",
-    "ls": "Lists files in the current directory",
-    "cd": "Changes the current directory",
-    "cat": "Displays the content of a file",
-    "missions": "Lists all available missions and their status"
-}
+SERVER_COMMANDS = CommandRegistry()
 
-def get_current_directory_object(location):
-    """Navigates the file system tree to the player's current location."""
-    current_dir = file_system
-    for part in location:
-        if isinstance(current_dir, dict) and part in current_dir:
-            current_dir = current_dir[part]
-        else:
-            return None # Should not happen with valid locations
-    return current_dir
+def load_world():
+    """Loads the world from `world_dir` in server.json if set, else the built-in file system."""
+    world_dir = config.get("world_dir")
+    if world_dir and os.path.isdir(world_dir):
+        print(f"Server: Loading world from '{world_dir}'")
+        return VirtualFS.from_directory(world_dir)
+    return VirtualFS.from_dict(file_system)
 
-def handle_server_command(command, args, username):
+WORLD = startup_phase("world", load_world)
+
+# Most commands sent in one /check_commands request
+MAX_BATCH_SIZE = 50
+
+def missions_loading_error():
+    """An error response if the mission catalog is still loading after MISSION_LOAD_WAIT seconds, else None."""
+    if MISSIONS.wait_loaded(MISSION_LOAD_WAIT):
+        return None
+    return {"status": "error", "message": "Missions are still loading, try again in a moment."}
+
+def check_moderation(username):
+    if STATE.is_muted(username):
+        return {"status": "error", "message": "You are muted and cannot use the chat command."}
+    if STATE.is_banned(username) or STATE.is_restricted("banned_alias", alias_key(username)):
+        return {"status": "error", "message": "You are banned."}
+    return None
+
+def load_player_for_commands(username):
+    """Fetches the player's record and runs the moderation checks. Returns (player_data, error)."""
     # Fetch player data to get their current location
-    player_path = get_user_data_path(username)
-    if not os.path.exists(player_path):
+    player_data = load_user_data(username)
+    if player_data is None:
+        return None, {"status": "error", "message": "User data not found. Please relog."}
+    return player_data, check_moderation(username)
+
+def handle_server_command(command, args, username):
+    return handle_server_commands([(command, args)], username)[0]
+
+def handle_server_commands(commands, username):
+    """Runs a list of (command, args) in order, loading and saving the player's state at most once.
+
+    Commands that don't need the player's record (echo, chat) never touch the store.
+    """
+    error = check_moderation(username)
+    if error:
+        return [error for _ in commands]
+
+    with PLAYER_STORE.lock_for(username):
+        player_data = None
+        results = []
+        changed = False
+        for name, args in commands:
+            command = SERVER_COMMANDS.get(name)
+            if command is None:
+                results.append({"status": "error", "message": f"Command '{name}' not found on server."})
+                continue
+            if command.needs_state and player_data is None:
+                player_data, error = load_player_for_commands(username)
+                if error:
+                    return results + [error for _ in commands[len(results):]]
+            response = dispatch_command(command, args, username, player_data)
+            if command.mutates_state and response["status"] == "success":
+                changed = True
+            results.append(response)
+
+        if changed:
+            save_user_data(username, player_data)
+            # The record version offline changes made after this will be based on
+            for response in results:
+                response["version"] = player_data["version"]
+    return results
+
+def dispatch_command(command, args, username, player_data):
+    """Runs one command and records how long it took."""
+    start = time.perf_counter()
+    response = command.handler(args, username, player_data)
+    COMMAND_LATENCY.observe(time.perf_counter() - start, command.name)
+    COMMANDS_RUN.inc(command.name, response["status"])
+    return response
+
+def get_location(player_data):
+    return player_data.get("location", ["root", "home", "user"])
+
+@SERVER_COMMANDS.register("echo", "Echoes back the arguments provided", "<text>", needs_state=False)
+def command_echo(args, username, player_data):
+    return {"status": "success", "message": " ".join(args)}
+
+def post_chat(username, channel, message):
+    """Logs a message, hands it to the queues of everyone who follows `channel` and wakes them."""
+    # chat and msg don't load the sender's record, so check they are a real player here
+    if not username or not PLAYER_STORE.exists(username):
         return {"status": "error", "message": "User data not found. Please relog."}
-    with open(player_path, "r") as f:
-        player_data = json.load(f)
+    wait = rate_limit_wait("chat", username, request.remote_addr if has_request_context() else None)
+    if wait:
+        return {"status": "error", "message": f"You are sending messages too fast. Try again in {math.ceil(wait)}s."}
+    STATE.append_chat(username, message, channel)
+    CHAT_SENT.inc()
+    CHAT_HUB.pump(STATE.chat_since)
+    EVENTS.publish()
+    return {"status": "success", "message": "Message sent."}
+
+# Most rooms one player can be in
+MAX_CHAT_ROOMS = 20
+
+def parse_room(name):
+    """Returns the room name with its leading '#', or None if it isn't a valid one."""
+    name = name if name.startswith("#") else f"#{name}"
+    body = name[1:].replace("-", "").replace("_", "")
+    if not body.isalnum() or len(name) > 25:
+        return None
+    return name.lower()
+
+@SERVER_COMMANDS.register("chat", "Sends a message to all connected players", "<message>", needs_state=False)
+def command_chat(args, username, player_data):
+    return post_chat(username, GLOBAL_CHANNEL, " ".join(args))
+
+@SERVER_COMMANDS.register("join", "Joins a chat room, or creates it", "<#room>", mutates_state=True)
+def command_join(args, username, player_data):
+    room = parse_room(args[0]) if args else None
+    if room is None:
+        return {"status": "error", "message": "Usage: join <#room> (letters, digits, - and _)"}
+    rooms = player_data.setdefault("chat_rooms", [])
+    if room not in rooms:
+        if len(rooms) >= MAX_CHAT_ROOMS:
+            return {"status": "error", "message": f"You can be in at most {MAX_CHAT_ROOMS} rooms."}
+        rooms.append(room)
+        CHAT_HUB.join(username, room)
+    return {"status": "success", "message": f"Joined {room}. Use 'say {room} <message>' to talk there."}
+
+@SERVER_COMMANDS.register("leave", "Leaves a chat room", "<#room>", mutates_state=True)
+def command_leave(args, username, player_data):
+    room = parse_room(args[0]) if args else None
+    rooms = player_data.get("chat_rooms", [])
+    if room is None or room not in rooms:
+        return {"status": "error", "message": "You are not in that room."}
+    rooms.remove(room)
+    CHAT_HUB.leave(username, room)
+    return {"status": "success", "message": f"Left {room}."}
+
+@SERVER_COMMANDS.register("rooms", "Lists the chat rooms you are in")
+def command_rooms(args, username, player_data):
+    rooms = player_data.get("chat_rooms", [])
+    if not rooms:
+        return {"status": "success", "message": "You are not in any rooms. Use 'join <#room>' to join one."}
+    return {"status": "success", "message": "Your rooms: " + " ".join(rooms)}
+
+@SERVER_COMMANDS.register("say", "Sends a message to a chat room you are in", "<#room> <message>")
+def command_say(args, username, player_data):
+    if len(args) < 2:
+        return {"status": "error", "message": "Usage: say <#room> <message>"}
+    room = parse_room(args[0])
+    if room is None or room not in player_data.get("chat_rooms", []):
+        return {"status": "error", "message": "Join the room first with 'join <#room>'."}
+    return post_chat(username, room, " ".join(args[1:]))
+
+@SERVER_COMMANDS.register("msg", "Sends a private message to another player", "<username> <message>", needs_state=False)
+def command_msg(args, username, player_data):
+    if len(args) < 2:
+        return {"status": "error", "message": "Usage: msg <username> <message>"}
+    recipient = args[0]
+    if recipient == username or not PLAYER_STORE.exists(recipient):
+        return {"status": "error", "message": f"No player called '{recipient}'."}
+    return post_chat(username, dm_channel(recipient), " ".join(args[1:]))
+
+@SERVER_COMMANDS.register("block", "Hides chat and private messages from a player", "<username>", mutates_state=True)
+def command_block(args, username, player_data):
+    if not args or args[0] == username:
+        return {"status": "error", "message": "Usage: block <username>"}
+    blocked = player_data.setdefault("chat_blocked", [])
+    if args[0] not in blocked:
+        blocked.append(args[0])
+        CHAT_HUB.set_blocked(username, args[0], True)
+    return {"status": "success", "message": f"You won't see messages from {args[0]} anymore."}
+
+@SERVER_COMMANDS.register("unblock", "Shows messages from a blocked player again", "<username>", mutates_state=True)
+def command_unblock(args, username, player_data):
+    blocked = player_data.get("chat_blocked", [])
+    if not args or args[0] not in blocked:
+        return {"status": "error", "message": "That player isn't blocked."}
+    blocked.remove(args[0])
+    CHAT_HUB.set_blocked(username, args[0], False)
+    return {"status": "success", "message": f"Unblocked {args[0]}."}
+
+@SERVER_COMMANDS.register("hack", "Attempts to solve a mission or hack a system", "<mission_id> <password>", mutates_state=True)
+def command_hack(args, username, player_data):
+    if len(args) < 2:
+        return {"status": "error", "message": "Usage: hack <mission_id> <password>"}
     
-    player_location = player_data.get("location", ["root", "home", "user"])
+    mission_id = args[0]
+    password = args[1]
     
-    if username in MUTED_USERS:
-        return {"status": "error", "message": "You are muted and cannot use the chat command."}
-    if username in BANNED_USERS:
-        return {"status": "error", "message": "You are banned."}
+    error = missions_loading_error()
+    if error:
+        return error
+    mission = MISSIONS.get(mission_id)
+    
+    if not mission:
+        return {"status": "error", "message": "Mission not found."}
+    
+    # Check if the mission has already been completed
+    completed = MISSIONS.completion_set(player_data.get("completed_missions"))
+    if mission_id in completed:
+        return {"status": "success", "message": "Mission already completed."}
 
-    if command == "echo":
-        return {"status": "success", "message": " ".join(args)}
+    missing = MISSIONS.missing_requirements(mission_id, completed)
+    if missing:
+        return {"status": "error", "message": f"Mission locked. Complete {', '.join(missing)} first."}
 
-    if command == "chat":
-        message = " ".join(args)
-        CHAT_LOG.append({"sender": username, "message": message, "timestamp": time.time()})
-        return {"status": "success", "message": "Message sent."}
+    if password == mission["solution"]:
+        completed.add(mission_id)
+        player_data["completed_missions"] = completed.encode()
+        player_data["reward_progress"] = player_data.get("reward_progress", 0) + mission.get("reward_progress", 0)
+        message = f"SUCCESS! Mission '{mission['title']}' completed. {mission['reward']}"
+        unlocked = MISSIONS.unlocked_by(mission_id, completed)
+        if unlocked:
+            message += f" New missions unlocked: {', '.join(unlocked)}"
+        return {"status": "success", "message": message}
+    else:
+        return {"status": "error", "message": "Incorrect password. Access denied."}
+
+@SERVER_COMMANDS.register("ls", "Lists files in the current directory")
+def command_ls(args, username, player_data):
+    current_dir = WORLD.get_directory(get_location(player_data))
+    if current_dir is None:
+        return {"status": "error", "message": "Error accessing directory."}
+    return {"status": "success", "message": current_dir.listing()}
+
+@SERVER_COMMANDS.register("cd", "Changes the current directory", "<directory>", mutates_state=True)
+def command_cd(args, username, player_data):
+    if not args:
+        return {"status": "error", "message": "Usage: cd <directory>"}
     
-    if command == "hack":
-        if len(args) < 2:
-            return {"status": "error", "message": "Usage: hack <mission_id> <password>"}
-        
-        mission_id = args[0]
-        password = args[1]
-        
-        mission = MISSIONS.get(mission_id)
-        
-        if not mission:
-            return {"status": "error", "message": "Mission not found."}
-        
-        # Check if the mission has already been completed
-        if mission.get("completed", False):
-            return {"status": "success", "message": "Mission already completed."}
-
-        if password == mission["solution"]:
-            mission["completed"] = True
-            return {"status": "success", "message": f"SUCCESS! Mission '{mission['title']}' completed. {mission['reward']}"}
-        else:
-            return {"status": "error", "message": "Incorrect password. Access denied."}
-            
-    if command == "ls":
-        current_dir = get_current_directory_object(player_location)
-        if not current_dir or not isinstance(current_dir, dict):
-            return {"status": "error", "message": "Error accessing directory."}
-        
-        output = "Files and folders in this directory:\n"
-        output += "\n".join([f" - {item}" for item in current_dir.keys()])
-        return {"status": "success", "message": output}
-
-    if command == "cd":
-        if not args:
-            return {"status": "error", "message": "Usage: cd <directory>"}
-        
-        target = args[0]
-        new_location = player_location[:]
-        
-        if target == "..":
-            if len(new_location) > 1:
-                new_location.pop()
-            else:
-                return {"status": "error", "message": "You can't go back any further."}
+    player_location = get_location(player_data)
+    target = args[0]
+    new_location = player_location[:]
+    
+    if target == "..":
+        if len(new_location) > 1:
+            new_location.pop()
         else:
-            current_dir = get_current_directory_object(player_location)
-            if current_dir is not None and target in current_dir and isinstance(current_dir[target], dict):
-                new_location.append(target)
-            else:
-                return {"status": "error", "message": f"cd: no such file or directory: {target}"}
-
-        player_data["location"] = new_location
-        save_user_data(username, player_data)
-        
-        location_str = "~" if new_location == ["root", "home", "user"] else "/".join(new_location)
-        return {"status": "success", "message": f"Directory changed. Current location: {location_str}"}
-
-    if command == "cat":
-        if not args:
-            return {"status": "error", "message": "Usage: cat <file>"}
-        
-        file_name = args[0]
-        current_dir = get_current_directory_object(player_location)
-        
-        if current_dir is not None and file_name in current_dir and isinstance(current_dir[file_name], str):
-            content = current_dir[file_name]
-            return {"status": "success", "message": content}
+            return {"status": "error", "message": "You can't go back any further."}
+    else:
+        if WORLD.is_directory(player_location + [target]):
+            new_location.append(target)
         else:
-            return {"status": "error", "message": f"cat: {file_name}: No such file or directory"}
+            return {"status": "error", "message": f"cd: no such file or directory: {target}"}
+
+    player_data["location"] = new_location
     
-    if command == "missions":
-        output = "--- Missions ---\n"
-        if not MISSIONS:
-            output += "No missions available.\n"
-        else:
-            for mission_id, mission_details in MISSIONS.items():
-                status = "COMPLETED" if mission_details.get("completed", False) else "IN PROGRESS"
-                output += f"ID: {mission_id}\n"
-                output += f"Title: {mission_details['title']}\n"
-                output += f"Status: {status}\n"
-                output += f"Description: {mission_details['description']}\n"
-                output += "---\n"
-        return {"status": "success", "message": output.strip()}
+    location_str = "~" if new_location == ["root", "home", "user"] else "/".join(new_location)
+    return {"status": "success", "message": f"Directory changed. Current location: {location_str}", "location": new_location}
 
+@SERVER_COMMANDS.register("cat", "Displays the content of a file", "<file>")
+def command_cat(args, username, player_data):
+    if not args:
+        return {"status": "error", "message": "Usage: cat <file>"}
+    
+    file_name = args[0]
+    content = WORLD.read_file(get_location(player_data), file_name)
+    if content is not None:
+        return {"status": "success", "message": content}
     else:
-        return {"status": "error", "message": f"Command '{command}' not found on server."}
+        return {"status": "error", "message": f"cat: {file_name}: No such file or directory"}
+
+@SERVER_COMMANDS.register("missions", "Lists all available missions and their status")
+def command_missions(args, username, player_data):
+    error = missions_loading_error()
+    if error:
+        return error
+    completed = MISSIONS.completion_set(player_data.get("completed_missions"))
+    return {"status": "success", "message": MISSIONS.listing(completed.__contains__)}
+
+# --- Moderation ---
+# Mutes and bans can be timed ("30m", "2h", "7d"...) and are lifted by the
+# state backend when they run out. Besides usernames, addresses and aliases
+# can be banned: an alias ban covers every capitalization of a name, and
+# also stops it from being registered.
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+def parse_duration(value):
+    """Seconds from a duration like 90, "90s", "30m", "2h" or "7d". None or "" means permanent."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        value = str(value).strip().lower()
+        unit = DURATION_UNITS.get(value[-1:])
+        seconds = float(value[:-1] if unit else value) * (unit or 1)
+    if seconds <= 0:
+        raise ValueError("Duration must be positive")
+    return seconds
+
+def expiry_for(duration):
+    return None if duration is None else time.time() + duration
+
+def alias_key(name):
+    return (name or "").strip().lower()
+
+def set_muted(username, muted, duration=None):
+    """Mutes or unmutes a user and tells them about it. Returns False if nothing changed."""
+    expires = expiry_for(duration) if muted else None
+    if not STATE.set_muted(username, muted, expires):
+        return False
+    STATE.push_notice(username, {"type": "muted" if muted else "unmuted", "until": expires})
+    EVENTS.publish()
+    return True
+
+def set_banned(username, banned, duration=None):
+    """Bans or unbans a user and tells them about it. Returns False if nothing changed."""
+    expires = expiry_for(duration) if banned else None
+    if not STATE.set_banned(username, banned, expires):
+        return False
+    STATE.push_notice(username, {"type": "banned" if banned else "unbanned", "until": expires})
+    EVENTS.publish()
+    return True
+
+def set_ip_banned(ip, banned, duration=None):
+    """Returns False if nothing changed."""
+    return STATE.set_restriction("banned_ip", ip, banned, expiry_for(duration) if banned else None)
+
+def set_alias_banned(alias, banned, duration=None):
+    """Returns False if nothing changed."""
+    if not STATE.set_restriction("banned_alias", alias_key(alias), banned, expiry_for(duration) if banned else None):
+        return False
+    EVENTS.publish()
+    return True
+
+def restriction_expired(kind, key):
+    """Called by the state backend when a timed mute or ban runs out."""
+    if kind in ("muted", "banned"):
+        STATE.push_notice(key, {"type": "unmuted" if kind == "muted" else "unbanned"})
+        EVENTS.publish()
+    print(f"Server: {kind.replace('_', ' ')} {key} has expired.")
+
+def describe_expiry(duration):
+    return "" if duration is None else f" for {int(duration)}s"
+
+@app.before_request
+def reject_banned_ip():
+    # The admin panel stays reachable, so a ban can't lock the admin out
+    if not request.path.startswith("/admin") and STATE.is_restricted("banned_ip", request.remote_addr):
+        return jsonify({"status": "error", "message": "You are banned."}), 403
+
+def kick(username):
+    """Marks a user for disconnection. Returns False if they already were."""
+    if not STATE.kick(username):
+        return False
+    EVENTS.publish()
+    return True
 
 # --- API Endpoints ---
 @app.route("/check_command", methods=["POST"])
@@ -218,17 +685,36 @@ def check_command():
     args = data.get("args", [])
     username = data.get("username")
     if username:
-        ACTIVE_USERS[username] = time.time()  # Update last activity
+        STATE.touch(username)  # Update last activity
     if command in SERVER_COMMANDS:
-        response = handle_server_command(command, args, username)
+        response = PROFILER.call(handle_server_command, command, args, username)
         return jsonify(response)
     return jsonify({"status": "error", "message": f"Command '{command}' not found on server."})
 
+@app.route("/check_commands", methods=["POST"])
+def check_commands():
+    data = request.get_json()
+    username = data.get("username")
+    commands = data.get("commands", [])
+    if not username:
+        return jsonify({"status": "error", "message": "Username not provided."}), 400
+    if not isinstance(commands, list) or len(commands) > MAX_BATCH_SIZE:
+        return jsonify({"status": "error", "message": f"Send a list of at most {MAX_BATCH_SIZE} commands."}), 400
+    batch = []
+    for item in commands:
+        args = item.get("args", []) if isinstance(item, dict) else None
+        if not isinstance(args, list) or not isinstance(item.get("command"), str):
+            return jsonify({"status": "error", "message": "Each command needs a command name and a list of args."}), 400
+        batch.append((item["command"], args))
+
+    STATE.touch(username)  # Update last activity
+    return jsonify({"status": "success", "results": handle_server_commands(batch, username)})
+
 @app.route("/check_username", methods=["POST"])
 def check_username():
     data = request.get_json()
     username = data.get("username")
-    if os.path.exists(get_user_data_path(username)):
+    if PLAYER_STORE.exists(username):
         return jsonify({"is_available": False})
     else:
         return jsonify({"is_available": True})
@@ -240,12 +726,18 @@ def register_user():
     if not username:
         return jsonify({"status": "error", "message": "Username not provided."}), 400
 
-    if os.path.exists(get_user_data_path(username)):
-        print(f"Server: HEY GUYS SOME IDIOT JUST TRIED TO MAKE {username} BUT THEY ALREADY EXIST LMAOOO")
-        return jsonify({"status": "error", "message": "User already exists."}), 409
+    if STATE.is_restricted("banned_alias", alias_key(username)):
+        return jsonify({"status": "error", "message": "That username is not allowed."}), 403
+
+    with PLAYER_STORE.lock_for(username):
+        if PLAYER_STORE.exists(username):
+            print(f"Server: HEY GUYS SOME IDIOT JUST TRIED TO MAKE {username} BUT THEY ALREADY EXIST LMAOOO")
+            return jsonify({"status": "error", "message": "User already exists."}), 409
 
-    initial_data = {"username": username, "progress": "fresh_start", "location": ["root", "home", "user"]}
-    if save_user_data(username, initial_data):
+        initial_data = {"username": username, "progress": "fresh_start", "location": ["root", "home", "user"]}
+        saved = save_user_data(username, initial_data, flush=True)
+    if saved:
+        STATE.record_user_change(username)
         print(f"Server: [NEW USER] created: {username}")
         return jsonify({"status": "success", "message": "User created."})
     else:
@@ -257,10 +749,13 @@ def log_reconnection():
     username = data.get("username")
     if username:
         print(f"Server: User {username} reconnected.")
-        ACTIVE_USERS[username] = time.time()  # New: Update last activity on reconnect
+        STATE.touch(username)  # New: Update last activity on reconnect
         return jsonify({"status": "success", "message": "Reconnection logged."})
     return jsonify({"status": "error", "message": "Username not provided."}), 400
 
+# Fields of the player record that clients can't overwrite through /save
+SERVER_OWNED_FIELDS = ("completed_missions", "reward_progress", "version", "journal_seqs", "chat_rooms", "chat_blocked")
+
 @app.route("/save", methods=["POST"])
 def save_progress():
     data = request.get_json()
@@ -270,7 +765,21 @@ def save_progress():
         return jsonify({"status": "error", "message": "Username not provided."}), 400
 
     print(f"Server: Saving client {username}'s game...")
-    if save_user_data(username, save_data):
+    # Clients only send what they track themselves. Keep server-owned fields
+    # like mission completion instead of overwriting the whole record.
+    save_data = save_data or {}
+    if not isinstance(save_data, dict):
+        return jsonify({"status": "error", "message": "Save data must be an object."}), 400
+    for field in SERVER_OWNED_FIELDS:
+        save_data.pop(field, None)
+    with PLAYER_STORE.lock_for(username):
+        record = load_user_data(username) or {}
+        record.update(save_data)
+        try:
+            saved = save_user_data(username, record, flush=True)
+        except SaveFormatError as e:
+            return jsonify({"status": "error", "message": f"Invalid save: {e}"}), 400
+    if saved:
         print("Server: Done!")
         return jsonify({"status": "success", "message": "Progress saved to server."})
     else:
@@ -284,92 +793,444 @@ def log_disconnect():
         return jsonify({"status": "error", "message": "Username not provided."}), 400
     
     # New: Remove user from active list on explicit disconnect
-    if username in ACTIVE_USERS:
-        del ACTIVE_USERS[username]
+    STATE.remove_active(username)
+    CHAT_HUB.unsubscribe(username)
 
     print(f"Server: Client {username} disconnected. Reason: disconnect command used")
     return jsonify({"status": "success", "message": "Disconnect logged."})
 
+# Upper bound on how many chat messages a single response may carry
+MAX_CHAT_PAGE = 500
+
+def get_limit_arg(default, args=None):
+    args = request.args if args is None else args
+    try:
+        limit = int(args.get("limit", default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, MAX_CHAT_PAGE))
+
+def public_messages(messages):
+    # Rooms and direct messages only go out through the player's own queue
+    return [message for message in messages if message_channel(message) == GLOBAL_CHANNEL]
+
+def is_silenced(sender):
+    return STATE.is_muted(sender) or STATE.is_banned(sender)
+
+def has_chat_queue(username):
+    return bool(username) and (username in CHAT_HUB or PLAYER_STORE.exists(username))
+
+def read_chat_queue(username, since_id, limit):
+    """Returns (messages, last_id, missed) from the player's queue."""
+    if SHARED_STATE:
+        CHAT_HUB.pump(STATE.chat_since)  # pick up messages other workers logged
+    return CHAT_HUB.poll(username, since_id, limit, STATE.chat_since, hidden=is_silenced)
+
 @app.route("/get_chat_messages", methods=["GET"])
 def get_chat_messages():
-    return jsonify({"messages": CHAT_LOG})
+    before_id = request.args.get("before_id", type=int)
+    messages, next_before_id = STATE.chat_page(before_id, get_limit_arg(50))
+    return jsonify({"messages": public_messages(messages), "next_before_id": next_before_id})
 
 @app.route("/get_new_chat_messages", methods=["GET"])
 def get_new_chat_messages():
     username = request.args.get("username")
     if username:
-        ACTIVE_USERS[username] = time.time()  # New: Update last activity
+        STATE.touch(username)  # New: Update last activity
     
-    last_timestamp = float(request.args.get("last_timestamp", 0))
-    new_messages = [msg for msg in CHAT_LOG if msg["timestamp"] > last_timestamp]
-    return jsonify({"messages": new_messages})
+    limit = get_limit_arg(MAX_CHAT_PAGE)
+    since_id = request.args.get("since_id", type=int)
+    if since_id is not None and has_chat_queue(username):
+        new_messages, last_id, missed = read_chat_queue(username, since_id, limit)
+        return jsonify({"messages": new_messages, "last_id": last_id, "missed": missed})
+    if since_id is not None:
+        new_messages = STATE.chat_since(since_id, limit)
+    else:
+        # Older clients only know the timestamp of the last message they saw
+        last_timestamp = float(request.args.get("last_timestamp", 0))
+        new_messages = STATE.chat_since_timestamp(last_timestamp, limit)
+    return jsonify({"messages": public_messages(new_messages), "last_id": STATE.chat_last_id()})
 
 @app.route("/check_kick", methods=["POST"])
 def check_kick():
     data = request.get_json()
     username = data.get("username")
     if username:
-        ACTIVE_USERS[username] = time.time()  # New: Update last activity
-    if username in KICKED_USERS:
-        KICKED_USERS.remove(username)
+        STATE.touch(username)  # New: Update last activity
+    if STATE.take_kick(username):
         return jsonify({"should_kick": True})
     return jsonify({"should_kick": False})
 
+# The /events logic is shared with the asyncio server mode (asgi_server.py)
+def parse_events_args(args):
+    """Returns (username, since_id, timeout, limit) from the query string."""
+    username = args.get("username")
+    since_id = args.get("since_id", 0, type=int)
+    timeout = min(args.get("timeout", LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    return username, since_id, timeout, get_limit_arg(MAX_CHAT_PAGE, args)
+
+def collect_events(username, since_id, limit):
+    """What a long-polling client should get right now, or None if there is nothing new."""
+    should_kick = STATE.is_kicked(username)
+    missed = 0
+    if has_chat_queue(username):
+        messages, last_id, missed = read_chat_queue(username, since_id, limit)
+    else:
+        messages = public_messages(STATE.chat_since(since_id, limit))
+        last_id = None
+    notices = STATE.take_notices(username) if username else []
+    if should_kick or messages or notices:
+        events = {"should_kick": should_kick, "messages": messages, "notices": notices, "missed": missed}
+        if last_id is not None:
+            events["last_id"] = last_id
+        return events
+    return None
+
+def finish_events(username, events, busy=False):
+    """The /events reply. `busy` tells the client the server had no room to
+    park its long-poll, and that it should short-poll for a while."""
+    events = events or {"should_kick": False, "messages": [], "notices": [], "missed": 0}
+    if busy:
+        events["busy"] = True
+    if events["should_kick"]:
+        STATE.take_kick(username)
+    if username:
+        STATE.touch(username)
+    if "last_id" not in events and not (username and username in CHAT_HUB):
+        # Players with a queue keep polling from where they were until it has something for them
+        events["last_id"] = STATE.chat_last_id()
+    return events
+
+@app.route("/events", methods=["GET"])
+def get_events():
+    # Long-poll: hold the request until there is chat, a kick or a moderation
+    # notice for this user, or until the timeout passes with nothing new.
+    username, since_id, timeout, limit = parse_events_args(request.args)
+    if username:
+        STATE.touch(username)
+    if LONG_POLL_ADMISSION not in g.get("admission", []):
+        # Too many parked already, answer now so the worker thread is free again
+        return jsonify(finish_events(username, collect_events(username, since_id, limit), busy=True))
+    events = EVENTS.wait(lambda: collect_events(username, since_id, limit), timeout)
+    return jsonify(finish_events(username, events))
+
 @app.route("/get_commands", methods=["GET"])
 def get_commands():
-    return jsonify({"commands": SERVER_COMMANDS})
+    return jsonify({"commands": SERVER_COMMANDS.descriptions(), "specs": SERVER_COMMANDS.specs()})
     
 @app.route("/get_user_state", methods=["POST"])
 def get_user_state():
     data = request.get_json()
     username = data.get("username")
     if username:
-        ACTIVE_USERS[username] = time.time()  # New: Update last activity
-    player_path = get_user_data_path(username)
-    if not os.path.exists(player_path):
+        STATE.touch(username)  # New: Update last activity
+    player_data = load_user_data(username)
+    if player_data is None:
         return jsonify({"status": "error", "message": "User data not found."})
-    with open(player_path, "r") as f:
-        player_data = json.load(f)
     
     location = player_data.get("location", ["root", "home", "user"])
     location_str = "~" if location == ["root", "home", "user"] else "/".join(location)
-    return jsonify({"status": "success", "location": location_str})
+    return jsonify({
+        "status": "success",
+        "location": location_str,
+        "location_path": location,
+        "version": player_data.get("version", 0)
+    })
+
+# --- Offline Sync ---
+# Most journal entries accepted in one /sync request
+MAX_SYNC_OPS = 500
+
+def apply_sync_op(op, username, player_data, conflict):
+    """Applies one offline journal entry to the player's record. Returns the result to report."""
+    kind = op.get("op")
+    if kind == "location":
+        location = op.get("location")
+        if conflict:
+            # The record changed on the server while the client was offline, the server's location wins
+            return {"status": "conflict", "message": "Your location changed on the server while you were offline, keeping that one."}
+        if not isinstance(location, list) or not WORLD.is_directory(location):
+            return {"status": "error", "message": "Offline location no longer exists, keeping the server's."}
+        player_data["location"] = location
+        return {"status": "success", "message": "Location synced."}
+    if kind == "hack":
+        # Offline solutions are checked again against the real mission
+        command = SERVER_COMMANDS.get("hack")
+        return dispatch_command(command, [op.get("mission", ""), op.get("password", "")], username, player_data)
+    return {"status": "error", "message": f"Unknown journal entry '{kind}'."}
+
+@app.route("/sync", methods=["POST"])
+def sync_journal():
+    data = request.get_json()
+    username = data.get("username")
+    client_id = data.get("client_id")
+    ops = data.get("ops", [])
+    if not username or not client_id or not isinstance(client_id, str):
+        return jsonify({"status": "error", "message": "Username and client id are required."}), 400
+    if not isinstance(ops, list):
+        return jsonify({"status": "error", "message": "Journal entries must be a list."}), 400
+    if len(ops) > MAX_SYNC_OPS:
+        return jsonify({"status": "error", "message": f"Too many journal entries, the limit is {MAX_SYNC_OPS}."}), 400
+    journal = []
+    for op in ops:
+        try:
+            journal.append((int(op.get("seq", 0)), op))
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            return jsonify({"status": "error", "message": "Each journal entry needs a numeric seq."}), 400
+
+    STATE.touch(username)
+    with PLAYER_STORE.lock_for(username):
+        player_data, error = load_player_for_commands(username)
+        if error:
+            return jsonify(error)
+
+        # Sequence numbers are per client, so a retried sync never applies an entry twice
+        journal_seqs = player_data.setdefault("journal_seqs", {})
+        applied_seq = journal_seqs.get(client_id, 0)
+        conflict = data.get("base_version") != player_data.get("version", 0)
+        results = []
+        for seq, op in journal:
+            if seq <= applied_seq:
+                continue
+            result = apply_sync_op(op, username, player_data, conflict)
+            results.append({"seq": seq, **result})
+            applied_seq = seq
+
+        if results:
+            journal_seqs[client_id] = applied_seq
+            try:
+                save_user_data(username, player_data, flush=True)
+            except SaveFormatError as e:
+                return jsonify({"status": "error", "message": f"Invalid save: {e}"}), 400
+            print(f"Server: Synced {len(results)} offline change(s) for {username}.")
+    return jsonify({
+        "status": "success",
+        "applied_seq": applied_seq,
+        "version": player_data.get("version", 0),
+        "location": get_location(player_data),
+        "results": results
+    })
+
+# --- Client Catalog ---
+# A snapshot of the command catalog, the world and public mission data that
+# clients cache locally. It is rebuilt only when the mission catalog changes
+# and served with an ETag, so unchanged snapshots cost a 304. The world is
+# only its tree of names, clients fetch file contents from /world_file when
+# a file is read.
+CATALOG_LOCK = threading.Lock()
+CATALOG = {"missions_version": None, "body": None, "etag": None}
+
+def current_catalog():
+    with CATALOG_LOCK:
+        if CATALOG["missions_version"] != MISSIONS.version:
+            missions = [MISSIONS.public(mission_id) for mission_id in MISSIONS.ids()]
+            snapshot = {
+                "commands": SERVER_COMMANDS.specs(),
+                "world": WORLD.to_dict(contents=False),
+                "missions": [mission for mission in missions if mission is not None]
+            }
+            content = json.dumps(snapshot, sort_keys=True)
+            version = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+            body = json.dumps({"version": version, **snapshot})
+            CATALOG.update(missions_version=MISSIONS.version, body=body, etag=version)
+        return CATALOG["body"], CATALOG["etag"]
+
+@app.route("/catalog", methods=["GET"])
+def get_catalog():
+    body, etag = current_catalog()
+    if etag in request.if_none_match:
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype="application/json")
+    response.set_etag(etag)
+    return response
+
+@app.route("/world_file", methods=["GET"])
+def get_world_file():
+    # "path" is the file's location and name joined by "/", e.g. root/home/user/documents/mission1.txt
+    parts = [part for part in request.args.get("path", "").split("/") if part]
+    content = WORLD.read_file(parts[:-1], parts[-1]) if parts else None
+    if content is None:
+        return jsonify({"status": "error", "message": "No such file."}), 404
+    return jsonify({"status": "success", "content": content})
+
+@app.after_request
+def add_catalog_version(response):
+    # Lets clients notice a stale cached catalog without asking for it
+    if request.path in ("/check_command", "/check_commands", "/reconnect"):
+        response.headers["X-Catalog-Version"] = current_catalog()[1]
+    return response
 
 # New: Admin web routes
 @app.route("/admin")
 def admin_panel():
     return render_template("admin.html")
 
+@app.route("/admin/metrics")
+def get_admin_metrics():
+    return METRICS.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/admin/profiler", methods=["GET", "POST"])
+def admin_profiler():
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"status": "error", "message": "Send a JSON object with \"enabled\" and optionally \"sample_every\"."}), 400
+        sample_every = data.get("sample_every")
+        if sample_every is not None:
+            try:
+                sample_every = int(sample_every)
+            except (TypeError, ValueError):
+                return jsonify({"status": "error", "message": "sample_every must be a whole number of calls."}), 400
+        PROFILER.configure(bool(data.get("enabled")), sample_every)
+    return jsonify({
+        "enabled": PROFILER.enabled,
+        "sample_every": PROFILER.sample_every,
+        "samples": PROFILER.samples,
+        "report": PROFILER.report()
+    })
+
 @app.route("/admin/chat_log")
 def get_admin_chat_log():
-    return jsonify(CHAT_LOG)
+    # since_id gives only the messages the panel hasn't seen yet
+    since_id = request.args.get("since_id", type=int)
+    if since_id is not None:
+        return jsonify(STATE.chat_since(since_id, get_limit_arg(200)))
+    before_id = request.args.get("before_id", type=int)
+    messages, _ = STATE.chat_page(before_id, get_limit_arg(200))
+    return jsonify(messages)
+
+def parse_time_arg(name):
+    """A timestamp query argument, either seconds since the epoch or an ISO date/time (UTC)."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+@app.route("/admin/chat_search")
+def admin_chat_search():
+    # Searches the whole archive, rooms and direct messages included, newest first
+    if CHAT_ARCHIVE is None:
+        return jsonify({"status": "error", "message": "The chat archive is turned off."}), 404
+    messages, next_cursor = CHAT_ARCHIVE.search(
+        sender=request.args.get("sender") or None,
+        query=request.args.get("q", ""),
+        start=parse_time_arg("from"),
+        end=parse_time_arg("to"),
+        cursor=request.args.get("cursor"),
+        limit=get_limit_arg(50),
+    )
+    return jsonify({"messages": messages, "next_cursor": next_cursor})
+
+# --- Incremental Admin User API ---
+# The panel loads users a page at a time (/admin/user_list) and then only asks
+# for the users whose status changed since the version it has (/admin/user_changes).
+USER_LIST_FILTERS = {
+    "active": STATE.active_users,
+    "muted": STATE.muted_users,
+    "banned": STATE.banned_users,
+}
+# More changed users than this in one poll and the panel reloads instead
+MAX_USER_CHANGES = 500
+
+def admin_user_entries(usernames):
+    active = set(STATE.active_users())
+    muted = set(STATE.muted_users())
+    banned = set(STATE.banned_users())
+    return [
+        {"username": name, "active": name in active, "muted": name in muted, "banned": name in banned}
+        for name in usernames
+    ]
+
+@app.route("/admin/user_list")
+def get_admin_user_list():
+    """One page of users in name order. `cursor` is the `next_cursor` of the previous page."""
+    user_filter = request.args.get("filter", "all")
+    prefix = request.args.get("prefix", "")
+    cursor = request.args.get("cursor") or None
+    limit = get_limit_arg(100)
+    # Read the version before the users, so a change made meanwhile is sent again rather than missed
+    version = STATE.user_change_version()
+    if user_filter == "all":
+        names = USER_STORAGE.list_users(prefix, cursor, limit + 1)
+    elif user_filter in USER_LIST_FILTERS:
+        names = sorted(
+            name for name in USER_LIST_FILTERS[user_filter]()
+            if name.startswith(prefix) and (cursor is None or name > cursor)
+        )[:limit + 1]
+    else:
+        return jsonify({"status": "error", "message": f"Unknown filter '{user_filter}'."}), 400
+
+    has_more = len(names) > limit
+    names = names[:limit]
+    return jsonify({
+        "users": admin_user_entries(names),
+        "next_cursor": names[-1] if has_more else None,
+        "version": version,
+        "active_count": len(STATE.active_users())
+    })
+
+@app.route("/admin/user_changes")
+def get_admin_user_changes():
+    since = request.args.get("since", 0, type=int)
+    version, changed = STATE.user_changes_since(since)
+    if changed is None or len(changed) > MAX_USER_CHANGES:
+        # Too far behind to catch up with a diff, the panel reloads its lists
+        return jsonify({"version": version, "reset": True, "users": []})
+    return jsonify({
+        "version": version,
+        "reset": False,
+        "users": admin_user_entries(changed),
+        "active_count": len(STATE.active_users())
+    })
 
 @app.route("/admin/users")
 def get_admin_users():
-    users = [f.replace(".json", "") for f in os.listdir("cloud_saves") if f.endswith(".json")]
-    active_users_list = list(ACTIVE_USERS.keys())  # New: Get a list of active users
+    users = USER_STORAGE.list_users()
+    active_users_list = STATE.active_users()  # New: Get a list of active users
     return jsonify({
         "active_users": active_users_list,
         "all_users": users,
-        "muted": list(MUTED_USERS.keys()),
-        "banned": list(BANNED_USERS.keys())
+        "muted": STATE.muted_users(),
+        "banned": STATE.banned_users(),
+        "banned_ips": STATE.restricted("banned_ip"),
+        "banned_aliases": STATE.restricted("banned_alias")
     })
 
+def duration_arg(data):
+    """The optional "duration" of a mute or ban request, or an error response."""
+    try:
+        return parse_duration(data.get("duration")), None
+    except ValueError:
+        return None, jsonify({"status": "error", "message": "Invalid duration, use e.g. 3600, 30m, 2h or 7d."})
+
 @app.route("/admin/mute_user", methods=["POST"])
 def mute_user():
     data = request.get_json()
     username = data.get("username")
+    duration, error = duration_arg(data)
+    if error:
+        return error
     if username:
-        MUTED_USERS[username] = True
-        return jsonify({"status": "success", "message": f"{username} muted."})
+        set_muted(username, True, duration)
+        return jsonify({"status": "success", "message": f"{username} muted{describe_expiry(duration)}."})
     return jsonify({"status": "error", "message": "Username not provided."})
 
 @app.route("/admin/unmute_user", methods=["POST"])
 def unmute_user():
     data = request.get_json()
     username = data.get("username")
-    if username in MUTED_USERS:
-        del MUTED_USERS[username]
+    if set_muted(username, False):
         return jsonify({"status": "success", "message": f"{username} unmuted."})
     return jsonify({"status": "error", "message": "Username not found."})
 
@@ -378,36 +1239,76 @@ def unmute_user():
 def ban_user():
     data = request.get_json()
     username = data.get("username")
+    duration, error = duration_arg(data)
+    if error:
+        return error
     if username:
-        BANNED_USERS[username] = True
-        return jsonify({"status": "success", "message": f"{username} banned."})
+        set_banned(username, True, duration)
+        return jsonify({"status": "success", "message": f"{username} banned{describe_expiry(duration)}."})
     return jsonify({"status": "error", "message": "Username not provided."})
 
 @app.route("/admin/unban_user", methods=["POST"])
 def unban_user():
     data = request.get_json()
     username = data.get("username")
-    if username in BANNED_USERS:
-        del BANNED_USERS[username]
+    if set_banned(username, False):
         return jsonify({"status": "success", "message": f"{username} unbanned."})
     return jsonify({"status": "error", "message": "Username not found."})
 
+@app.route("/admin/ban_ip", methods=["POST"])
+def ban_ip():
+    data = request.get_json()
+    ip = data.get("ip")
+    duration, error = duration_arg(data)
+    if error:
+        return error
+    if ip:
+        set_ip_banned(ip, True, duration)
+        return jsonify({"status": "success", "message": f"{ip} banned{describe_expiry(duration)}."})
+    return jsonify({"status": "error", "message": "IP address not provided."})
+
+@app.route("/admin/unban_ip", methods=["POST"])
+def unban_ip():
+    ip = request.get_json().get("ip")
+    if set_ip_banned(ip, False):
+        return jsonify({"status": "success", "message": f"{ip} unbanned."})
+    return jsonify({"status": "error", "message": "IP address not banned."})
+
+@app.route("/admin/ban_alias", methods=["POST"])
+def ban_alias():
+    data = request.get_json()
+    alias = data.get("alias")
+    duration, error = duration_arg(data)
+    if error:
+        return error
+    if alias:
+        set_alias_banned(alias, True, duration)
+        return jsonify({"status": "success", "message": f"Alias {alias_key(alias)} banned{describe_expiry(duration)}."})
+    return jsonify({"status": "error", "message": "Alias not provided."})
+
+@app.route("/admin/unban_alias", methods=["POST"])
+def unban_alias():
+    alias = request.get_json().get("alias")
+    if set_alias_banned(alias, False):
+        return jsonify({"status": "success", "message": f"Alias {alias_key(alias)} unbanned."})
+    return jsonify({"status": "error", "message": "Alias not banned."})
+
 @app.route("/admin/kick_user", methods=["POST"])
 def kick_user():
     data = request.get_json()
     username = data.get("username")
     if username:
-        KICKED_USERS.append(username)
+        kick(username)
         return jsonify({"status": "success", "message": f"{username} marked for kick."})
     return jsonify({"status": "error", "message": "Username not provided."})
 def get_admin_users():
-    users = [f.replace(".json", "") for f in os.listdir("cloud_saves") if f.endswith(".json")]
-    active_users_list = list(ACTIVE_USERS.keys())
+    users = USER_STORAGE.list_users()
+    active_users_list = STATE.active_users()
     return jsonify({
         "active_users": active_users_list,
         "all_users": users,
-        "muted": list(MUTED_USERS.keys()),
-        "banned": list(BANNED_USERS.keys())
+        "muted": STATE.muted_users(),
+        "banned": STATE.banned_users()
     })
 
 # --- Server-Side Admin Commands ---
@@ -420,76 +1321,143 @@ def handle_server_input():
         cmd = command[0].lower()
         args = command[1:]
 
-        if cmd == "mute" and len(args) == 1:
-            username = args[0]
-            MUTED_USERS[username] = True
-            print(f"SERVER: User {username} has been muted.")
+        if cmd in ("mute", "ban", "ban_ip", "ban_alias") and len(args) in (1, 2):
+            try:
+                duration = parse_duration(args[1]) if len(args) == 2 else None
+            except ValueError:
+                print("SERVER: Invalid duration, use e.g. 3600, 30m, 2h or 7d.")
+                continue
+            target = args[0]
+            if cmd == "mute":
+                set_muted(target, True, duration)
+                print(f"SERVER: User {target} has been muted{describe_expiry(duration)}.")
+            elif cmd == "ban":
+                set_banned(target, True, duration)
+                print(f"SERVER: User {target} has been banned{describe_expiry(duration)}.")
+            elif cmd == "ban_ip":
+                set_ip_banned(target, True, duration)
+                print(f"SERVER: {target} has been banned{describe_expiry(duration)}.")
+            else:
+                set_alias_banned(target, True, duration)
+                print(f"SERVER: Alias {alias_key(target)} has been banned{describe_expiry(duration)}.")
         elif cmd == "unmute" and len(args) == 1:
             username = args[0]
-            if username in MUTED_USERS:
-                del MUTED_USERS[username]
+            if set_muted(username, False):
                 print(f"SERVER: User {username} has been unmuted.")
             else:
                 print(f"SERVER: User {username} is not muted.")
-        elif cmd == "ban" and len(args) == 1:
-            username = args[0]
-            BANNED_USERS[username] = True
-            print(f"SERVER: User {username} has been banned.")
         elif cmd == "unban" and len(args) == 1:
             username = args[0]
-            if username in BANNED_USERS:
-                del BANNED_USERS[username]
+            if set_banned(username, False):
                 print(f"SERVER: User {username} has been unbanned.")
             else:
                 print(f"SERVER: User {username} is not unbanned.")
+        elif cmd == "unban_ip" and len(args) == 1:
+            if set_ip_banned(args[0], False):
+                print(f"SERVER: {args[0]} has been unbanned.")
+            else:
+                print(f"SERVER: {args[0]} is not banned.")
+        elif cmd == "unban_alias" and len(args) == 1:
+            if set_alias_banned(args[0], False):
+                print(f"SERVER: Alias {alias_key(args[0])} has been unbanned.")
+            else:
+                print(f"SERVER: Alias {alias_key(args[0])} is not banned.")
         elif cmd == "kick" and len(args) == 1:
             username = args[0]
-            if username not in KICKED_USERS:
-                KICKED_USERS.append(username)
+            if kick(username):
                 print(f"SERVER: User {username} will be disconnected on their next poll.")
             else:
                 print(f"SERVER: User {username} is already marked for disconnection.")
         elif cmd == "list_muted":
-            print("SERVER: Muted users:", ", ".join(MUTED_USERS.keys()))
+            print("SERVER: Muted users:", ", ".join(STATE.muted_users()))
         elif cmd == "list_banned":
-            print("SERVER: Banned users:", ", ".join(BANNED_USERS.keys()))
+            print("SERVER: Banned users:", ", ".join(STATE.banned_users()))
+        elif cmd == "list_banned_ips":
+            print("SERVER: Banned IPs:", ", ".join(STATE.restricted("banned_ip")))
+        elif cmd == "list_banned_aliases":
+            print("SERVER: Banned aliases:", ", ".join(STATE.restricted("banned_alias")))
         elif cmd == "help":
             print("SERVER: Available commands:")
-            print("  mute <username>  - Mutes a user from chatting.")
+            print("  mute <username> [duration] - Mutes a user from chatting, e.g. 'mute bob 30m'.")
             print("  unmute <username> - Unmutes a user.")
-            print("  ban <username> - Bans a user.")
+            print("  ban <username> [duration] - Bans a user, for good unless a duration (e.g. 7d) is given.")
             print("  unban <username> - Unbans a user.")
+            print("  ban_ip <address> [duration] - Bans an IP address.")
+            print("  unban_ip <address> - Unbans an IP address.")
+            print("  ban_alias <name> [duration] - Bans a name in any capitalization, also from registering.")
+            print("  unban_alias <name> - Unbans a name.")
             print("  kick <username> - Force-disconnects a user.")
             print("  list_muted - Lists all muted users.")
             print("  list_banned - Lists all banned users.")
+            print("  list_banned_ips - Lists all banned IP addresses.")
+            print("  list_banned_aliases - Lists all banned names.")
         else:
             print("SERVER: Unknown command. Type 'help' for a list of commands.")
 
 # New: Function to clean up inactive users
-def cleanup_inactive_users():
-    while True:
-        # Check every 60 seconds
-        time.sleep(60) 
-        
-        # Remove users who haven't pinged in the last 120 seconds
-        inactive_threshold = time.time() - 120
-        
-        users_to_remove = []
-        for username, last_ping in ACTIVE_USERS.items():
-            if last_ping < inactive_threshold:
-                users_to_remove.append(username)
-        
-        for username in users_to_remove:
-            del ACTIVE_USERS[username]
-            print(f"Server: {username} has been marked as inactive.")
+def start_presence_expiry():
+    # Users who haven't pinged in presence_timeout seconds (default 120) are
+    # removed as soon as they are due, no periodic scan needed.
+    STATE.start_expiry(lambda username: print(f"Server: {username} has been marked as inactive."))
+
+# --- Startup ---
+# Only what every request needs (config, state, player storage, the world's
+# directory tree) is loaded on import. The mission catalog and the world's
+# file contents load in the background while the server already takes
+# requests, and mission commands wait for the catalog.
+BACKGROUND_LOADING_LOCK = threading.Lock()
+BACKGROUND_LOADING = threading.Event()  # set once loading has been started
+STARTUP_READY = threading.Event()  # set once everything is loaded
+
+def start_background_loading():
+    """Starts loading the non-critical data on a thread pool, once. Returns right away."""
+    with BACKGROUND_LOADING_LOCK:
+        if BACKGROUND_LOADING.is_set():
+            return
+        BACKGROUND_LOADING.set()
+        # Mission commands that come in before the loader thread gets going wait too
+        MISSIONS.expect_load()
+    threading.Thread(target=load_in_background, name="startup", daemon=True).start()
+
+def load_in_background():
+    phases = [("missions", load_missions), ("world_content", WORLD.preload)]
+    with ThreadPoolExecutor(max_workers=len(phases), thread_name_prefix="startup") as pool:
+        futures = [pool.submit(startup_phase, name, func) for name, func in phases]
+        for (name, _), future in zip(phases, futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Server: Startup phase '{name}' failed: {e}")
+    STARTUP_PHASES["total"] = time.perf_counter() - STARTUP_STARTED
+    STARTUP_READY.set()
+    print(f"Server: Fully loaded {STARTUP_PHASES['total']:.2f}s after start")
+
+@app.before_request
+def ensure_background_loading():
+    # `waitress-serve server:app` only imports this module, so the first
+    # request gets the loading going
+    if not BACKGROUND_LOADING.is_set():
+        start_background_loading()
+
+@app.route("/admin/startup")
+def get_startup():
+    return jsonify({
+        "ready": STARTUP_READY.is_set(),
+        "phases": {name: round(seconds, 4) for name, seconds in STARTUP_PHASES.items()}
+    })
+
+def start_moderation_expiry():
+    # Timed mutes and bans are lifted when they run out. Checks already
+    # ignore an expired entry, this removes it and tells the player.
+    STATE.start_moderation_expiry(restriction_expired)
 
 if __name__ == "__main__":
     print("Server: Starting up...")
     if not os.path.exists("cloud_saves"):
         os.makedirs("cloud_saves")
     
-    # Load missions at startup
-    load_missions()
+    # Missions and world content load in the background, requests are served meanwhile
+    start_background_loading()
 
     # Disable Flask logging
     log = logging.getLogger('werkzeug')
@@ -500,8 +1468,13 @@ if __name__ == "__main__":
     admin_thread.start()
 
     # New: Start the user cleanup thread
-    cleanup_thread = threading.Thread(target=cleanup_inactive_users, daemon=True)
-    cleanup_thread.start()
+    start_presence_expiry()
+    start_moderation_expiry()
+
+    from waitress import serve
+    host, port = config.get("host", "127.0.0.1"), config.get("port", 5000)
+    print(f"Server: Accepting requests on {host}:{port} ({(time.perf_counter() - STARTUP_STARTED) * 1000:.0f}ms after start)")
+    serve(app, host=host, port=port, threads=WORKER_THREADS)
 
-# Note: The code for running with waitress is outside the 'if __name__ == "__main__":' block.
-# This ensures it can be imported by the waitress-serve command.
\ No newline at end of file
+# Note: The server can also be run with `waitress-serve server:app`, which only
+# imports this module. The first request then starts the background loading.
\ No newline at end of file
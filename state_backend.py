@@ -0,0 +1,577 @@
+import json
+import time
+import sqlite3
+import threading
+import itertools
+from collections import deque
+
+from chat_store import ChatStore
+from moderation import UserSet, PresenceTracker, ModerationStore
+
+# --- Shared Server State ---
+# Chat, moderation and presence live behind one of these backends so the
+# server can run either as a single process (InProcessBackend) or as several
+# waitress/gunicorn workers sharing one SQLite database (SQLiteBackend).
+
+# How many user changes are kept for /admin/user_changes. An admin panel that
+# falls further behind than this reloads its lists instead.
+USER_CHANGE_LOG_SIZE = 10000
+
+# Restrictions on usernames, these show up in the user change feed
+USER_RESTRICTIONS = ("muted", "banned")
+
+class StateBackend:
+    """Interface for chat, moderation and presence state."""
+
+    # How often long-poll requests should re-check for changes made by other
+    # processes. None means every change is published in-process.
+    poll_interval = None
+
+    # --- Chat ---
+    def append_chat(self, sender, message, channel="global"):
+        """Logs a message to "global", a "#room" or "@username" (a direct message), see chat_hub."""
+        raise NotImplementedError
+
+    def chat_since(self, last_id, limit=None):
+        raise NotImplementedError
+
+    def chat_since_timestamp(self, last_timestamp, limit=None):
+        raise NotImplementedError
+
+    def chat_page(self, before_id=None, limit=50):
+        raise NotImplementedError
+
+    def chat_last_id(self):
+        raise NotImplementedError
+
+    def chat_size(self):
+        """How many messages are currently retained."""
+        raise NotImplementedError
+
+    # --- Moderation ---
+    # Restrictions by kind: "muted" and "banned" usernames, "banned_ip"
+    # addresses and "banned_alias" names (lowercased, see server.alias_key).
+    # Each can expire at a given time, None means until lifted.
+    def set_restriction(self, kind, key, on, expires=None):
+        """Adds (or changes the expiry of) or lifts a restriction. Returns False if nothing changed."""
+        raise NotImplementedError
+
+    def is_restricted(self, kind, key):
+        raise NotImplementedError
+
+    def restricted(self, kind):
+        """Keys currently under the restriction."""
+        raise NotImplementedError
+
+    def restriction_expires(self, kind, key):
+        """When the restriction ends, None if it is permanent or there is none."""
+        raise NotImplementedError
+
+    def start_moderation_expiry(self, on_expire):
+        """Starts lifting timed restrictions when they are due, calling `on_expire(kind, key)` for each."""
+        raise NotImplementedError
+
+    def set_muted(self, username, muted, expires=None):
+        """Returns False if nothing changed (e.g. unmuting a user who isn't muted)."""
+        return self.set_restriction("muted", username, muted, expires)
+
+    def is_muted(self, username):
+        return self.is_restricted("muted", username)
+
+    def muted_users(self):
+        return self.restricted("muted")
+
+    def set_banned(self, username, banned, expires=None):
+        """Returns False if nothing changed."""
+        return self.set_restriction("banned", username, banned, expires)
+
+    def is_banned(self, username):
+        return self.is_restricted("banned", username)
+
+    def banned_users(self):
+        return self.restricted("banned")
+
+    def kick(self, username):
+        """Marks a user for disconnection. Returns False if they already were."""
+        raise NotImplementedError
+
+    def is_kicked(self, username):
+        raise NotImplementedError
+
+    def take_kick(self, username):
+        """Clears a pending kick. Returns True if there was one."""
+        raise NotImplementedError
+
+    # --- Notices shown to a single user (mute, ban...) ---
+    def push_notice(self, username, notice):
+        raise NotImplementedError
+
+    def take_notices(self, username):
+        raise NotImplementedError
+
+    # --- Presence ---
+    def touch(self, username):
+        raise NotImplementedError
+
+    def remove_active(self, username):
+        raise NotImplementedError
+
+    def active_users(self):
+        raise NotImplementedError
+
+    def start_expiry(self, on_expire):
+        """Starts removing users who haven't been seen for `presence_timeout` seconds.
+
+        `on_expire(username)` is called for each user removed.
+        """
+        raise NotImplementedError
+
+    # --- User change feed for the admin panel ---
+    # Mute/ban changes, users coming online or going offline, and anything the
+    # server reports through record_user_change (registrations) get the next
+    # version number, so the panel can ask only for what changed.
+    def record_user_change(self, username):
+        raise NotImplementedError
+
+    def user_change_version(self):
+        raise NotImplementedError
+
+    def user_changes_since(self, version):
+        """Returns (current version, usernames changed after `version`).
+
+        The usernames are None if `version` is older than the kept history or
+        newer than the current version (the backend was restarted).
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# --- Single Process ---
+class InProcessBackend(StateBackend):
+    def __init__(self, chat_log_size=1000, chat_history_file=None, presence_timeout=120, moderation_file=None):
+        self.chat = ChatStore(capacity=chat_log_size, spill_path=chat_history_file)
+        self._lock = threading.Lock()
+        # Mutes and bans survive restarts when moderation_file is set, kicks are one-off
+        self._moderation = ModerationStore(moderation_file)
+        self._kicked = UserSet()
+        self._notices = {}
+        self._active = PresenceTracker(timeout=presence_timeout)
+        self._on_expire = None
+        self._changes = deque(maxlen=USER_CHANGE_LOG_SIZE)  # (version, username)
+        self._change_version = 0
+
+    def append_chat(self, sender, message, channel="global"):
+        return self.chat.append(sender, message, channel)
+
+    def chat_since(self, last_id, limit=None):
+        return self.chat.since(last_id, limit)
+
+    def chat_since_timestamp(self, last_timestamp, limit=None):
+        return self.chat.since_timestamp(last_timestamp, limit)
+
+    def chat_page(self, before_id=None, limit=50):
+        return self.chat.page(before_id, limit)
+
+    def chat_last_id(self):
+        return self.chat.last_id()
+
+    def chat_size(self):
+        return len(self.chat)
+
+    def set_restriction(self, kind, key, on, expires=None):
+        changed = self._moderation.add(kind, key, expires) if on else self._moderation.remove(kind, key)
+        if changed and kind in USER_RESTRICTIONS:
+            self.record_user_change(key)
+        return changed
+
+    def is_restricted(self, kind, key):
+        return self._moderation.contains(kind, key)
+
+    def restricted(self, kind):
+        return self._moderation.list(kind)
+
+    def restriction_expires(self, kind, key):
+        return self._moderation.expires(kind, key)
+
+    def start_moderation_expiry(self, on_expire):
+        def expired(kind, key):
+            if kind in USER_RESTRICTIONS:
+                self.record_user_change(key)
+            on_expire(kind, key)
+        self._moderation.on_expire = expired
+        self._moderation.start()
+
+    def kick(self, username):
+        return self._kicked.add(username)
+
+    def is_kicked(self, username):
+        return username in self._kicked
+
+    def take_kick(self, username):
+        return self._kicked.discard(username)
+
+    def push_notice(self, username, notice):
+        with self._lock:
+            self._notices.setdefault(username, []).append(notice)
+
+    def take_notices(self, username):
+        with self._lock:
+            return self._notices.pop(username, [])
+
+    def touch(self, username):
+        if self._active.touch(username):
+            self.record_user_change(username)
+
+    def remove_active(self, username):
+        if self._active.remove(username):
+            self.record_user_change(username)
+
+    def active_users(self):
+        return self._active.list()
+
+    def start_expiry(self, on_expire):
+        self._on_expire = on_expire
+        self._active.on_expire = self._expired
+        self._active.start()
+
+    def _expired(self, username):
+        self.record_user_change(username)
+        self._on_expire(username)
+
+    def record_user_change(self, username):
+        with self._lock:
+            self._change_version += 1
+            self._changes.append((self._change_version, username))
+
+    def user_change_version(self):
+        return self._change_version
+
+    def user_changes_since(self, version):
+        with self._lock:
+            first = self._changes[0][0] if self._changes else self._change_version + 1
+            if version < first - 1 or version > self._change_version:
+                return self._change_version, None
+            # Versions in the deque are consecutive, so the start index is known
+            changes = itertools.islice(self._changes, version - first + 1, None)
+            return self._change_version, list(dict.fromkeys(username for _, username in changes))
+
+    def close(self):
+        self.chat.close()
+        self._moderation.close()
+
+# --- Shared Between Worker Processes ---
+class SQLiteBackend(StateBackend):
+    """State in one SQLite database in WAL mode, so any number of worker processes can share it."""
+
+    poll_interval = 0.5
+
+    def __init__(self, path, chat_log_size=1000, presence_timeout=120):
+        self.path = path
+        self.chat_log_size = chat_log_size
+        self.presence_timeout = presence_timeout
+        self._local = threading.local()
+        self._moderation_changed = threading.Event()  # wakes the expiry loop for a new timed restriction
+        with self._connect() as db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS chat (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sender TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    timestamp REAL NOT NULL,
+                    channel TEXT NOT NULL DEFAULT 'global'
+                );
+                CREATE INDEX IF NOT EXISTS chat_timestamp ON chat (timestamp);
+                CREATE TABLE IF NOT EXISTS moderation (
+                    username TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    expires REAL,
+                    PRIMARY KEY (kind, username)
+                );
+                CREATE TABLE IF NOT EXISTS notices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    notice TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS notices_username ON notices (username);
+                CREATE TABLE IF NOT EXISTS presence (
+                    username TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS presence_last_seen ON presence (last_seen);
+                CREATE TABLE IF NOT EXISTS user_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL
+                );
+            """)
+            # Databases from before chat channels, every message in them was global
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(chat)")]
+            if "channel" not in columns:
+                db.execute("ALTER TABLE chat ADD COLUMN channel TEXT NOT NULL DEFAULT 'global'")
+            # ...and from before timed mutes and bans, which were all permanent
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(moderation)")]
+            if "expires" not in columns:
+                db.execute("ALTER TABLE moderation ADD COLUMN expires REAL")
+
+    def _connect(self):
+        # One connection per thread, sqlite3 connections can't be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _chat_rows(self, rows):
+        return [dict(row) for row in rows]
+
+    # --- Chat ---
+    def append_chat(self, sender, message, channel="global"):
+        with self._connect() as db:
+            last = db.execute("SELECT MAX(timestamp) FROM chat").fetchone()[0] or 0
+            timestamp = max(time.time(), last)
+            cursor = db.execute(
+                "INSERT INTO chat (sender, message, timestamp, channel) VALUES (?, ?, ?, ?)",
+                (sender, message, timestamp, channel)
+            )
+            message_id = cursor.lastrowid
+            # Keep roughly chat_log_size messages, trimming in batches
+            if message_id % 100 == 0:
+                db.execute("DELETE FROM chat WHERE id <= ?", (message_id - self.chat_log_size,))
+        return {"id": message_id, "sender": sender, "message": message, "timestamp": timestamp, "channel": channel}
+
+    def chat_since(self, last_id, limit=None):
+        rows = self._connect().execute(
+            "SELECT id, sender, message, timestamp, channel FROM chat WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, -1 if limit is None else limit)
+        )
+        return self._chat_rows(rows)
+
+    def chat_since_timestamp(self, last_timestamp, limit=None):
+        rows = self._connect().execute(
+            "SELECT id, sender, message, timestamp, channel FROM chat WHERE timestamp > ? ORDER BY id LIMIT ?",
+            (last_timestamp, -1 if limit is None else limit)
+        )
+        return self._chat_rows(rows)
+
+    def chat_page(self, before_id=None, limit=50):
+        db = self._connect()
+        if before_id is None:
+            rows = db.execute("SELECT id, sender, message, timestamp, channel FROM chat ORDER BY id DESC LIMIT ?", (limit,))
+        else:
+            rows = db.execute(
+                "SELECT id, sender, message, timestamp, channel FROM chat WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before_id, limit)
+            )
+        messages = self._chat_rows(rows)[::-1]
+        next_cursor = None
+        if messages:
+            older = db.execute("SELECT 1 FROM chat WHERE id < ? LIMIT 1", (messages[0]["id"],)).fetchone()
+            if older:
+                next_cursor = messages[0]["id"]
+        return messages, next_cursor
+
+    def chat_last_id(self):
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM chat").fetchone()[0]
+
+    def chat_size(self):
+        return self._connect().execute("SELECT COUNT(*) FROM chat").fetchone()[0]
+
+    # --- Moderation ---
+    def _set_flag(self, kind, username, value):
+        # Kicks, which don't expire and aren't in the user change feed
+        with self._connect() as db:
+            if value:
+                cursor = db.execute("INSERT OR IGNORE INTO moderation (username, kind) VALUES (?, ?)", (username, kind))
+            else:
+                cursor = db.execute("DELETE FROM moderation WHERE username = ? AND kind = ?", (username, kind))
+            return cursor.rowcount > 0
+
+    def _has_flag(self, kind, username):
+        row = self._connect().execute(
+            "SELECT 1 FROM moderation WHERE kind = ? AND username = ? AND (expires IS NULL OR expires > ?)",
+            (kind, username, time.time())
+        ).fetchone()
+        return row is not None
+
+    def _flagged(self, kind):
+        rows = self._connect().execute(
+            "SELECT username FROM moderation WHERE kind = ? AND (expires IS NULL OR expires > ?)", (kind, time.time())
+        )
+        return [row["username"] for row in rows]
+
+    def set_restriction(self, kind, key, on, expires=None):
+        changed = self._write_restriction(kind, key, on, expires)
+        if changed and on and expires is not None:
+            # Committed by now, so the expiry loop sees it when it looks again
+            self._moderation_changed.set()
+        return changed
+
+    def _write_restriction(self, kind, key, on, expires):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute("SELECT expires FROM moderation WHERE kind = ? AND username = ?", (kind, key)).fetchone()
+            live = row is not None and (row["expires"] is None or row["expires"] > now)
+            if on:
+                if live and row["expires"] == expires:
+                    return False
+                db.execute(
+                    "INSERT OR REPLACE INTO moderation (username, kind, expires) VALUES (?, ?, ?)", (key, kind, expires)
+                )
+            else:
+                if row is None:
+                    return False
+                db.execute("DELETE FROM moderation WHERE kind = ? AND username = ?", (kind, key))
+                if not live:
+                    return False
+            if kind in USER_RESTRICTIONS:
+                self._record_change(db, key)
+            return True
+
+    def is_restricted(self, kind, key):
+        return self._has_flag(kind, key)
+
+    def restricted(self, kind):
+        return self._flagged(kind)
+
+    def restriction_expires(self, kind, key):
+        row = self._connect().execute(
+            "SELECT expires FROM moderation WHERE kind = ? AND username = ?", (kind, key)
+        ).fetchone()
+        return row["expires"] if row else None
+
+    def expire_restrictions(self, now):
+        """Deletes restrictions that are due. Returns them as (kind, key) pairs."""
+        expired = []
+        with self._connect() as db:
+            rows = db.execute("SELECT kind, username, expires FROM moderation WHERE expires <= ?", (now,)).fetchall()
+            for row in rows:
+                # Another worker may have lifted or extended it in the meantime
+                cursor = db.execute(
+                    "DELETE FROM moderation WHERE kind = ? AND username = ? AND expires = ?",
+                    (row["kind"], row["username"], row["expires"])
+                )
+                if cursor.rowcount:
+                    if row["kind"] in USER_RESTRICTIONS:
+                        self._record_change(db, row["username"])
+                    expired.append((row["kind"], row["username"]))
+        return expired
+
+    def start_moderation_expiry(self, on_expire):
+        threading.Thread(target=self._moderation_expire_loop, args=(on_expire,), daemon=True).start()
+
+    def _moderation_expire_loop(self, on_expire):
+        # Sleep until the next restriction is due, or until this process sets
+        # a new timed one. Other workers can add an earlier one meanwhile, so
+        # look again at least once a minute. Checks compare the expiry time
+        # anyway, this only cleans up and notifies.
+        while True:
+            self._moderation_changed.clear()
+            due = self._connect().execute("SELECT MIN(expires) FROM moderation").fetchone()[0]
+            delay = 60 if due is None else due - time.time()
+            self._moderation_changed.wait(min(max(delay, 0.1), 60))
+            for kind, key in self.expire_restrictions(time.time()):
+                on_expire(kind, key)
+
+    def kick(self, username):
+        return self._set_flag("kicked", username, True)
+
+    def is_kicked(self, username):
+        return self._has_flag("kicked", username)
+
+    def take_kick(self, username):
+        return self._set_flag("kicked", username, False)
+
+    def push_notice(self, username, notice):
+        with self._connect() as db:
+            db.execute("INSERT INTO notices (username, notice) VALUES (?, ?)", (username, json.dumps(notice)))
+
+    def take_notices(self, username):
+        with self._connect() as db:
+            rows = db.execute("SELECT id, notice FROM notices WHERE username = ? ORDER BY id", (username,)).fetchall()
+            if not rows:
+                return []
+            db.execute("DELETE FROM notices WHERE username = ? AND id <= ?", (username, rows[-1]["id"]))
+        return [json.loads(row["notice"]) for row in rows]
+
+    # --- Presence ---
+    def touch(self, username):
+        now = time.time()
+        with self._connect() as db:
+            cursor = db.execute("INSERT OR IGNORE INTO presence (username, last_seen) VALUES (?, ?)", (username, now))
+            if cursor.rowcount:
+                self._record_change(db, username)
+            else:
+                db.execute("UPDATE presence SET last_seen = ? WHERE username = ?", (now, username))
+
+    def remove_active(self, username):
+        with self._connect() as db:
+            cursor = db.execute("DELETE FROM presence WHERE username = ?", (username,))
+            if cursor.rowcount:
+                self._record_change(db, username)
+
+    def active_users(self):
+        rows = self._connect().execute("SELECT username FROM presence ORDER BY username")
+        return [row["username"] for row in rows]
+
+    def expire_inactive(self, threshold):
+        with self._connect() as db:
+            rows = db.execute("SELECT username FROM presence WHERE last_seen < ?", (threshold,)).fetchall()
+            db.execute("DELETE FROM presence WHERE last_seen < ?", (threshold,))
+            for row in rows:
+                self._record_change(db, row["username"])
+        return [row["username"] for row in rows]
+
+    def start_expiry(self, on_expire):
+        threading.Thread(target=self._expire_loop, args=(on_expire,), daemon=True).start()
+
+    def _expire_loop(self, on_expire):
+        # Sleep until the least recently seen user is due. Other workers may
+        # touch users in the meantime, which only pushes that deadline back.
+        while True:
+            oldest = self._connect().execute("SELECT MIN(last_seen) FROM presence").fetchone()[0]
+            delay = self.presence_timeout if oldest is None else oldest + self.presence_timeout - time.time()
+            time.sleep(max(delay, 0.1))
+            for username in self.expire_inactive(time.time() - self.presence_timeout):
+                on_expire(username)
+
+    # --- User change feed ---
+    def _record_change(self, db, username):
+        cursor = db.execute("INSERT INTO user_changes (username) VALUES (?)", (username,))
+        db.execute("DELETE FROM user_changes WHERE id <= ?", (cursor.lastrowid - USER_CHANGE_LOG_SIZE,))
+
+    def record_user_change(self, username):
+        with self._connect() as db:
+            self._record_change(db, username)
+
+    def user_change_version(self):
+        return self._connect().execute("SELECT COALESCE(MAX(id), 0) FROM user_changes").fetchone()[0]
+
+    def user_changes_since(self, version):
+        db = self._connect()
+        # AUTOINCREMENT ids are never reused, so versions keep growing across restarts
+        first, current = db.execute("SELECT MIN(id), COALESCE(MAX(id), 0) FROM user_changes").fetchone()
+        if version > current or (first is not None and version < first - 1):
+            return current, None
+        rows = db.execute("SELECT username FROM user_changes WHERE id > ? AND id <= ? ORDER BY id", (version, current))
+        return current, list(dict.fromkeys(row["username"] for row in rows))
+
+def create_backend(config):
+    """Picks the backend from server.json: "state_backend" is "memory" (default) or "sqlite"."""
+    kind = config.get("state_backend", "memory")
+    if kind == "sqlite":
+        return SQLiteBackend(
+            config.get("state_db", "state.db"),
+            chat_log_size=config.get("chat_log_size", 1000),
+            presence_timeout=config.get("presence_timeout", 120),
+        )
+    if kind == "memory":
+        return InProcessBackend(
+            chat_log_size=config.get("chat_log_size", 1000),
+            chat_history_file=config.get("chat_history_file"),
+            presence_timeout=config.get("presence_timeout", 120),
+            moderation_file=config.get("moderation_file", "moderation.log"),
+        )
+    raise ValueError(f"Unknown state backend '{kind}'")
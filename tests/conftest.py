@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import shutil
+import atexit
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# server.py reads server.json and writes its saves and logs relative to the
+# working directory when it is imported, so the tests run it in a scratch one
+WORKDIR = tempfile.mkdtemp(prefix="fusionbytes-tests-")
+atexit.register(shutil.rmtree, WORKDIR, True)
+shutil.copytree(os.path.join(REPO_DIR, "missions"), os.path.join(WORKDIR, "missions"))
+with open(os.path.join(WORKDIR, "server.json"), "w") as f:
+    json.dump({
+        "host": "127.0.0.1",
+        "port": 5000,
+        "threads": 4,
+        "chat_archive_dir": None,
+    }, f)
+os.chdir(WORKDIR)
+
+@pytest.fixture(scope="session")
+def server():
+    import server as server_module
+    # Tests fire requests faster than any player would
+    for limits in server_module.RATE_LIMITS.values():
+        for limiter in limits.values():
+            limiter.rate = limiter.burst = 1e6
+    return server_module
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+_users = 0
+
+@pytest.fixture
+def new_user(client):
+    """Registers a fresh player and returns the username."""
+    def register(prefix="player"):
+        global _users
+        _users += 1
+        username = f"{prefix}{_users}"
+        response = client.post("/register_user", json={"username": username})
+        assert response.status_code == 200, response.get_json()
+        return username
+    return register
+
+@pytest.fixture
+def run_command(client):
+    """Sends one command through /check_command and returns the response."""
+    def run(username, command, *args):
+        return client.post("/check_command", json={"username": username, "command": command, "args": list(args)})
+    return run
@@ -0,0 +1,31 @@
+def test_user_list_pages_by_prefix(client, new_user):
+    names = sorted(new_user("pager") for _ in range(3))
+    page = client.get("/admin/user_list?prefix=pager&limit=2").get_json()
+    assert [user["username"] for user in page["users"]] == names[:2]
+    assert page["next_cursor"] == names[1]
+
+    page = client.get(f"/admin/user_list?prefix=pager&limit=2&cursor={page['next_cursor']}").get_json()
+    assert [user["username"] for user in page["users"]] == names[2:]
+    assert page["next_cursor"] is None
+
+def test_user_list_filters(client, new_user):
+    username = new_user("filtered")
+    client.post("/admin/mute_user", json={"username": username})
+    page = client.get("/admin/user_list?filter=muted&prefix=filtered").get_json()
+    assert page["users"] == [{"username": username, "active": False, "muted": True, "banned": False}]
+    assert client.get("/admin/user_list?filter=nope").status_code == 400
+
+def test_change_feed_sends_only_what_changed(client, new_user):
+    username = new_user("changed")
+    version = client.get("/admin/user_list?limit=1").get_json()["version"]
+    assert client.get(f"/admin/user_changes?since={version}").get_json()["users"] == []
+
+    client.post("/admin/ban_user", json={"username": username})
+    changes = client.get(f"/admin/user_changes?since={version}").get_json()
+    assert changes["reset"] is False
+    assert [user["username"] for user in changes["users"]] == [username]
+    assert changes["users"][0]["banned"] is True
+    assert changes["version"] > version
+
+    # A version from before a restart can't be diffed against
+    assert client.get(f"/admin/user_changes?since={changes['version'] + 100}").get_json()["reset"] is True
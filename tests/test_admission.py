@@ -0,0 +1,59 @@
+import time
+import threading
+
+def park_long_polls(client, username, count, timeout=2):
+    """Starts `count` long-polls in the background. Returns their threads."""
+    threads = []
+    for _ in range(count):
+        thread = threading.Thread(target=client.get, args=(f"/events?username={username}&timeout={timeout}",))
+        thread.start()
+        threads.append(thread)
+    return threads
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_caps_follow_thread_count(server):
+    # "threads": 4 in the test server.json
+    assert server.ADMISSION.limit == 3
+    assert server.LONG_POLL_ADMISSION.limit == 2
+
+def test_long_poll_over_cap_answers_at_once(server, client, new_user, run_command):
+    username = new_user()
+    polls = park_long_polls(client, username, server.LONG_POLL_ADMISSION.limit)
+    try:
+        assert wait_for(lambda: server.LONG_POLL_ADMISSION.in_flight == server.LONG_POLL_ADMISSION.limit)
+        response = client.get(f"/events?username={username}&timeout=10")
+        assert response.status_code == 200
+        assert response.get_json()["busy"] is True
+        assert run_command(username, "echo", "hi").get_json()["message"] == "hi"
+    finally:
+        for poll in polls:
+            poll.join()
+
+def test_over_cap_request_gets_503(server, client, new_user, run_command):
+    username = new_user()
+    polls = park_long_polls(client, username, server.LONG_POLL_ADMISSION.limit)
+    try:
+        assert wait_for(lambda: server.LONG_POLL_ADMISSION.in_flight == server.LONG_POLL_ADMISSION.limit)
+        # The parked polls leave room for one more request
+        assert run_command(username, "echo", "hi").get_json()["message"] == "hi"
+
+        # A slow request in flight takes the last slot
+        assert server.ADMISSION.try_enter()
+        try:
+            response = run_command(username, "echo", "hi")
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "1"
+        finally:
+            server.ADMISSION.leave()
+        assert run_command(username, "echo", "hi").get_json()["message"] == "hi"
+    finally:
+        for poll in polls:
+            poll.join()
+    assert server.ADMISSION.in_flight == 0
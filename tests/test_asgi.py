@@ -0,0 +1,104 @@
+import time
+import json
+import asyncio
+
+import pytest
+
+from rate_limit import RateLimiter
+
+@pytest.fixture
+def asgi(server):
+    import asgi_server
+    return asgi_server
+
+def poll_events(asgi, ip, username="asgi-player"):
+    """Runs one /events request through the ASGI app's long-poll handler. Returns (status, body)."""
+    scope = {"query_string": f"username={username}&timeout=0".encode(), "client": (ip, 1234)}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        previous = asgi.ASYNC_EVENTS
+        asgi.ASYNC_EVENTS = asgi.AsyncEvents(asyncio.get_running_loop())
+        try:
+            await asgi.handle_events(scope, send)
+        finally:
+            asgi.ASYNC_EVENTS = previous
+
+    asyncio.run(run())
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+def test_banned_ip_cannot_long_poll(server, asgi):
+    server.set_ip_banned("10.9.8.7", True)
+    try:
+        status, _ = poll_events(asgi, "10.9.8.7")
+        assert status == 403
+    finally:
+        server.set_ip_banned("10.9.8.7", False)
+
+def test_long_poll_is_rate_limited(server, asgi, monkeypatch):
+    monkeypatch.setitem(server.RATE_LIMITS, "/events", {"per_ip": RateLimiter(0.01, 1)})
+    assert poll_events(asgi, "10.9.8.6")[0] == 200
+    assert poll_events(asgi, "10.9.8.6")[0] == 429
+
+def test_long_poll_over_cap_answers_at_once(server, asgi):
+    gate = server.LONG_POLL_ADMISSION
+    entered = 0
+    while gate.try_enter():
+        entered += 1
+    try:
+        status, body = poll_events(asgi, "10.9.8.5")
+        assert status == 200
+        assert body["busy"] is True
+    finally:
+        for _ in range(entered):
+            gate.leave()
+
+def call_app(asgi, method, path, body=None):
+    """Runs one request through the whole ASGI app. Returns (status, parsed JSON body)."""
+    raw = json.dumps(body).encode() if body is not None else b""
+    scope = {"type": "http", "method": method, "path": path, "query_string": b"",
+             "headers": [(b"content-type", b"application/json")], "client": ("127.0.0.1", 1234)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": raw}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+def test_flask_routes_run_through_the_bridge(server, asgi):
+    status, body = call_app(asgi, "POST", "/register_user", {"username": "asgi-bridged"})
+    assert (status, body["status"]) == (200, "success")
+    assert call_app(asgi, "POST", "/check_username", {"username": "asgi-bridged"}) == (200, {"is_available": False})
+    assert call_app(asgi, "POST", "/register_user", {})[0] == 400
+
+def test_parked_poll_wakes_on_chat(server, asgi, new_user, run_command, monkeypatch):
+    listener, sender = new_user(), new_user()
+    since_id = server.STATE.chat_last_id()
+    # Keep this test's loop off the hub once it is closed
+    monkeypatch.setattr(server.EVENTS, "_listeners", list(server.EVENTS._listeners))
+    scope = {"query_string": f"username={listener}&since_id={since_id}&timeout=10".encode(), "client": ("10.9.8.4", 1)}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        monkeypatch.setattr(asgi, "ASYNC_EVENTS", asgi.AsyncEvents(asyncio.get_running_loop()))
+        server.EVENTS.add_listener(asgi.ASYNC_EVENTS.notify)
+        poll = asyncio.create_task(asgi.handle_events(scope, send))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        await asyncio.to_thread(run_command, sender, "chat", "over", "asyncio")
+        await asyncio.wait_for(poll, 3)
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) < 2
+    body = json.loads(sent[1]["body"])
+    assert [m["message"] for m in body["messages"]] == ["over asyncio"]
@@ -0,0 +1,21 @@
+import pytest
+
+@pytest.mark.parametrize("commands", [
+    ["ls"],
+    [None],
+    [{"args": []}],
+    [{"command": "echo", "args": "hi"}],
+    [{"command": "echo", "args": ["hi"]}, "ls"],
+])
+def test_malformed_batch_is_rejected(client, new_user, commands):
+    username = new_user()
+    response = client.post("/check_commands", json={"username": username, "commands": commands})
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+def test_batch_runs_in_order(client, new_user):
+    username = new_user()
+    commands = [{"command": "echo", "args": ["one"]}, {"command": "echo", "args": ["two"]}]
+    response = client.post("/check_commands", json={"username": username, "commands": commands})
+    assert response.status_code == 200
+    assert [result["message"] for result in response.get_json()["results"]] == ["one", "two"]
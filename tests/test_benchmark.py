@@ -0,0 +1,45 @@
+import os
+import sys
+import json
+import socket
+import subprocess
+
+import benchmark
+
+def test_percentile():
+    values = sorted(range(1, 101))
+    assert benchmark.percentile(values, 0.5) == 51
+    assert benchmark.percentile(values, 0.99) == 99
+    assert benchmark.percentile([], 0.5) is None
+
+def test_summarize():
+    recorder = benchmark.Recorder()
+    recorder.latencies = {"/save": [0.01, 0.03, 0.02]}
+    recorder.errors = {"/save": 1}
+    endpoints, throughput = benchmark.summarize(recorder, 2)
+    assert endpoints["/save"]["count"] == 3
+    assert endpoints["/save"]["errors"] == 1
+    assert round(endpoints["/save"]["p50_ms"]) == 20
+    assert throughput == 1.5
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def test_short_run_writes_comparable_results(tmp_path):
+    out = tmp_path / "results"
+    command = [sys.executable, "benchmark.py", "--clients", "2", "--duration", "2", "--think-time", "0.05",
+               "--port", str(free_port()), "--threads", "4", "--out", str(out)]
+    subprocess.run(command, cwd=benchmark.REPO_DIR, check=True, capture_output=True, timeout=120)
+    [result_file] = os.listdir(out)
+    with open(out / result_file) as f:
+        result = json.load(f)
+    registered = result["endpoints"]["/register_user"]
+    assert (registered["count"], registered["errors"]) == (2, 0)
+    assert sum(stats["count"] for name, stats in result["endpoints"].items() if name.startswith("/check_command")) > 0
+    assert result["config"]["clients"] == 2
+
+    compared = subprocess.run([sys.executable, "benchmark.py", "--compare", str(out / result_file), str(out / result_file)],
+                              cwd=benchmark.REPO_DIR, check=True, capture_output=True, text=True, timeout=30)
+    assert "(+0%)" in compared.stdout
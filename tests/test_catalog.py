@@ -0,0 +1,58 @@
+import main
+
+class FakeServer:
+    """Stands in for main.Server, sending requests to the Flask test client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.is_connected = True
+        self.requests = []
+
+    def get(self, path, params=None, headers=None):
+        self.requests.append(path)
+        return FakeResponse(self.client.get(path, query_string=params, headers=headers))
+
+class FakeResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self._response = response
+
+    def json(self):
+        return self._response.get_json()
+
+def test_catalog_world_has_no_file_contents(client):
+    world = client.get("/catalog").get_json()["world"]
+    assert world["root"]["home"]["user"]["documents"]["mission1.txt"] is None
+
+def test_world_file(server, client):
+    response = client.get("/world_file", query_string={"path": "root/home/user/documents/mission1.txt"})
+    assert response.get_json()["content"] == server.WORLD.read_file(["root", "home", "user", "documents"], "mission1.txt")
+    assert client.get("/world_file", query_string={"path": "root/nothing.txt"}).status_code == 404
+    assert client.get("/world_file").status_code == 404
+
+def test_client_fetches_contents_on_demand(server, client, tmp_path):
+    catalog = main.Catalog(str(tmp_path / "catalog.json"))
+    test_server = FakeServer(client)
+    catalog.refresh(test_server)
+    assert test_server.requests == ["/catalog"]
+
+    location = ["root", "home", "user", "documents"]
+    expected = server.WORLD.read_file(location, "mission1.txt")
+    assert catalog.world.read_file(location, "mission1.txt") == expected
+    assert catalog.world.read_file(location, "mission1.txt") == expected
+    assert test_server.requests.count("/world_file") == 1
+
+def test_client_uses_catalog_missions(server, client, tmp_path, monkeypatch):
+    catalog = main.Catalog(str(tmp_path / "catalog.json"))
+    catalog.refresh(FakeServer(client))
+    monkeypatch.setattr(main, "CATALOG", catalog)
+    assert [mission["id"] for mission in main.current_missions()] == server.MISSIONS.ids()
+    assert all("solution" not in mission for mission in main.current_missions())
+
+    player = main.Player("offline-player")
+    player.journal = main.Journal(str(tmp_path / "player.journal"))
+    mission_id = server.MISSIONS.ids()[0]
+    assert "recorded" in main.offline_hack([mission_id, "guess"], player)
+    assert player.journal.entries[-1]["mission"] == mission_id
+    assert "SUBMITTED" in main.offline_missions([], player)
@@ -0,0 +1,41 @@
+def test_chat_needs_a_registered_sender(server, client, run_command):
+    last_id = server.STATE.chat_last_id()
+    for username in (None, "", "nobody-registered-this"):
+        response = client.post("/check_command", json={"username": username, "command": "chat", "args": ["hi"]})
+        assert response.get_json()["status"] == "error"
+    response = run_command("nobody-registered-this", "msg", "someone", "hi")
+    assert response.get_json()["status"] == "error"
+    assert server.STATE.chat_last_id() == last_id
+
+def test_chat_from_a_player_is_posted(server, new_user, run_command):
+    username = new_user()
+    assert run_command(username, "chat", "hello", "there").get_json()["status"] == "success"
+    message = server.STATE.chat_since(server.STATE.chat_last_id() - 1, 1)[0]
+    assert message["sender"] == username
+    assert message["message"] == "hello there"
+
+def new_messages(client, username, since_id):
+    return client.get(f"/get_new_chat_messages?username={username}&since_id={since_id}").get_json()
+
+def test_rooms_direct_messages_and_block(server, client, new_user, run_command):
+    ann, bob, carl = new_user(), new_user(), new_user()
+    cursor = server.STATE.chat_last_id()
+    new_messages(client, ann, cursor)  # subscribe
+
+    assert run_command(ann, "join", "#ops").get_json()["status"] == "success"
+    assert run_command(bob, "say", "#ops", "not joined").get_json()["status"] == "error"
+    assert run_command(bob, "join", "ops").get_json()["status"] == "success"
+    run_command(bob, "say", "#ops", "ops talk")
+    run_command(bob, "msg", ann, "just for you")
+    run_command(carl, "msg", bob, "not for ann")
+    assert run_command(ann, "rooms").get_json()["message"] == "Your rooms: #ops"
+
+    reply = new_messages(client, ann, cursor)
+    assert [(m["channel"], m["message"]) for m in reply["messages"]] == [("#ops", "ops talk"), (f"@{ann}", "just for you")]
+
+    assert run_command(ann, "block", bob).get_json()["status"] == "success"
+    assert server.PLAYER_STORE.get(ann)["chat_blocked"] == [bob]
+    run_command(bob, "chat", "blocked")
+    run_command(carl, "chat", "still here")
+    reply = new_messages(client, ann, reply["last_id"])
+    assert [m["message"] for m in reply["messages"]] == ["still here"]
@@ -0,0 +1,51 @@
+import os
+import time
+
+import chat_archive
+from chat_archive import ChatArchive
+from chat_store import ChatStore
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_search_by_sender_and_words(tmp_path):
+    log = ChatStore()
+    archive = ChatArchive(str(tmp_path))
+    archive.resume(log.since_timestamp, log.last_id())
+    log.append("alice", "the password is hunter2")
+    log.append("bob", "nice password")
+    log.append("alice", "see you later")
+    archive.pump(log.since)
+
+    messages, cursor = archive.search(query="password")
+    assert [m["sender"] for m in messages] == ["bob", "alice"]
+    messages, cursor = archive.search(sender="alice", limit=1)
+    assert [m["message"] for m in messages] == ["see you later"]
+    messages, cursor = archive.search(sender="alice", cursor=cursor, limit=1)
+    assert [m["message"] for m in messages] == ["the password is hunter2"]
+    assert cursor is None
+    archive.close()
+
+def test_background_pump_archives_without_listing(tmp_path, monkeypatch):
+    log = ChatStore()
+    archive = ChatArchive(str(tmp_path), pump_interval=0.01)
+    archive.resume(log.since_timestamp, log.last_id())
+    archive.start(log.since)
+
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(chat_archive.os, "listdir", lambda path: listings.append(path) or listdir(path))
+    for i in range(5):
+        log.append("alice", f"message {i}")
+        assert wait_for(lambda: archive.archived == i + 1)
+    # The segment list is kept up to date without reading the directory again
+    assert listings == []
+
+    log.append("alice", "last words")
+    archive.close()
+    assert archive.archived == 6
@@ -0,0 +1,69 @@
+from chat_hub import ChatHub
+
+class ChatLog:
+    def __init__(self):
+        self.messages = []
+
+    def add(self, sender, message, channel="global"):
+        self.messages.append({"id": len(self.messages) + 1, "sender": sender, "message": message, "channel": channel})
+
+    def fetch(self, since_id, limit):
+        newer = [m for m in self.messages if m["id"] > since_id]
+        return newer[:limit] if limit is not None else newer
+
+def texts(messages):
+    return [m["message"] for m in messages]
+
+def test_queue_gets_only_what_the_player_follows():
+    log = ChatLog()
+    settings = {"ann": (["#ops"], ["troll"])}
+    hub = ChatHub(lambda username: settings.get(username, ([], [])))
+    hub.start(0)
+    hub.poll("ann", 0, 10, log.fetch)
+
+    log.add("bob", "hello all")
+    log.add("bob", "ops only", "#ops")
+    log.add("bob", "elsewhere", "#dev")
+    log.add("bob", "psst", "@ann")
+    log.add("bob", "not for ann", "@carl")
+    log.add("troll", "spam")
+    log.add("ann", "my own")
+    hub.pump(log.fetch)
+
+    messages, last_id, dropped = hub.poll("ann", 0, 10, log.fetch)
+    assert texts(messages) == ["hello all", "ops only", "psst"]
+    assert (last_id, dropped) == (7, 0)
+
+def test_backfill_and_acknowledge():
+    log = ChatLog()
+    hub = ChatHub(lambda username: ([], []))
+    log.add("bob", "before")
+    log.add("bob", "missed")
+    hub.start(2)
+    # First poll fills the queue from the log after since_id
+    messages, last_id, _ = hub.poll("ann", 1, 10, log.fetch)
+    assert texts(messages) == ["missed"] and last_id == 2
+    assert hub.poll("ann", last_id, 10, log.fetch)[0] == []
+
+def test_full_queue_reports_missed_messages():
+    log = ChatLog()
+    hub = ChatHub(lambda username: ([], []), queue_size=2)
+    hub.start(0)
+    hub.poll("ann", 0, 10, log.fetch)
+    for i in range(5):
+        log.add("bob", f"m{i}")
+    hub.pump(log.fetch)
+    messages, _, dropped = hub.poll("ann", 0, 10, log.fetch)
+    assert texts(messages) == ["m3", "m4"]
+    assert dropped == 3 and hub.dropped == 3
+
+def test_hidden_senders_are_dropped_on_read():
+    log = ChatLog()
+    hub = ChatHub(lambda username: ([], []))
+    hub.start(0)
+    hub.poll("ann", 0, 10, log.fetch)
+    log.add("bob", "fine")
+    log.add("mallory", "muted later")
+    hub.pump(log.fetch)
+    messages, _, _ = hub.poll("ann", 0, 10, log.fetch, hidden=lambda sender: sender == "mallory")
+    assert texts(messages) == ["fine"]
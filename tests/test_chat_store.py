@@ -0,0 +1,56 @@
+from chat_hub import ChatHub
+from chat_store import ChatStore
+
+def test_ids_increase_and_since_is_a_cursor():
+    store = ChatStore(capacity=3)
+    first = store.append("a", "one")
+    for text in ("two", "three", "four"):
+        store.append("a", text)
+    assert store.last_id() == first["id"] + 3
+    assert [m["message"] for m in store.since(first["id"])] == ["two", "three", "four"]
+    # "one" was pushed out of the ring
+    assert [m["message"] for m in store.since(0)] == ["two", "three", "four"]
+    assert len(store) == 3
+
+def test_page_walks_back_to_the_oldest_message():
+    store = ChatStore(capacity=10)
+    for i in range(5):
+        store.append("a", str(i))
+    messages, cursor = store.page(limit=3)
+    assert [m["message"] for m in messages] == ["2", "3", "4"]
+    messages, cursor = store.page(cursor, limit=3)
+    assert [m["message"] for m in messages] == ["0", "1"]
+    assert cursor is None
+
+def test_cursor_survives_restart_without_history_file():
+    before = ChatStore()
+    for text in ("one", "two", "three"):
+        before.append("a", text)
+    cursor = before.last_id()
+
+    # A restart: a new, empty log
+    after = ChatStore()
+    message = after.append("b", "after restart")
+    assert message["id"] > cursor
+    assert after.since(cursor) == [message]
+
+    hub = ChatHub(lambda username: ([], []))
+    hub.start(after.last_id())
+    after.append("b", "queued")
+    hub.pump(after.since)
+    messages, last_id, _ = hub.poll("c", cursor, 50, after.since)
+    assert [m["message"] for m in messages] == ["after restart", "queued"]
+    assert last_id == after.last_id()
+
+def test_spilled_history_continues_ids(tmp_path):
+    path = str(tmp_path / "chat.log")
+    before = ChatStore(capacity=2, spill_path=path)
+    for text in ("one", "two", "three"):
+        before.append("a", text)
+    before.close()
+
+    after = ChatStore(capacity=2, spill_path=path)
+    message = after.append("a", "four")
+    assert message["id"] == before.last_id() + 1
+    messages, _ = after.page(limit=4)
+    assert [m["message"] for m in messages] == ["one", "two", "three", "four"]
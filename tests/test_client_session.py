@@ -0,0 +1,73 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.reply(status)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.paths.append(self.path)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.reply(status)
+
+    def reply(self, status):
+        body = json.dumps({"status": "success"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def http_server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.connections = 0
+    httpd.paths = []
+    httpd.statuses = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_requests_share_one_connection(http_server):
+    server = main.Server("127.0.0.1", http_server.server_address[1])
+    server.connect("ann")
+    assert server.is_connected
+    for _ in range(5):
+        assert server.get("/events").status_code == 200
+        assert server.post("/check_command", json={"command": "ls"}).status_code == 200
+    assert http_server.connections == 1
+
+def test_only_gets_are_retried(http_server):
+    server = main.Server("127.0.0.1", http_server.server_address[1])
+    http_server.statuses = [503, 200]
+    assert server.get("/events").status_code == 200
+    assert http_server.paths == ["/events", "/events"]
+
+    http_server.statuses = [503, 200]
+    assert server.post("/save", json={}).status_code == 503
+    assert http_server.paths[2:] == ["/save"]
+
+def test_unreachable_server_plays_offline():
+    server = main.Server("127.0.0.1", 9)
+    server.timeout = 0.5
+    server.connect("ann")
+    assert not server.is_connected
@@ -0,0 +1,34 @@
+from commands import CommandRegistry
+
+def test_registry_dispatches_by_name():
+    registry = CommandRegistry()
+
+    @registry.register("greet", "Says hello", "<name>", needs_state=False)
+    def greet(args, username, player_data):
+        return {"status": "success", "message": f"hello {args[0]}"}
+
+    command = registry.get("greet")
+    assert command.handler(["ann"], None, None)["message"] == "hello ann"
+    assert command.usage() == "greet <name>"
+    assert "greet" in registry and len(registry) == 1
+    assert registry.get("missing") is None
+    assert registry.specs() == {"greet": {"description": "Says hello", "args": "<name>",
+                                          "needs_state": False, "mutates_state": False}}
+
+def test_server_lists_its_commands(client):
+    data = client.get("/get_commands").get_json()
+    assert data["commands"]["cd"] == "Changes the current directory"
+    assert data["specs"]["cd"]["mutates_state"] is True
+
+def test_unknown_command(client, new_user, run_command):
+    username = new_user()
+    response = run_command(username, "rm", "-rf", "/")
+    assert response.get_json() == {"status": "error", "message": "Command 'rm' not found on server."}
+
+def test_state_changes_are_saved(server, new_user, run_command):
+    username = new_user()
+    assert run_command(username, "cd", "documents").get_json()["status"] == "success"
+    assert server.PLAYER_STORE.get(username)["location"] == ["root", "home", "user", "documents"]
+    assert "mission1.txt" in run_command(username, "ls").get_json()["message"]
+    assert run_command(username, "cd", "nowhere").get_json()["status"] == "error"
+    assert server.PLAYER_STORE.get(username)["location"] == ["root", "home", "user", "documents"]
@@ -0,0 +1,43 @@
+import time
+import threading
+
+def current_cursor(server, client, username):
+    # Subscribes the player to chat, from the newest message on
+    cursor = server.STATE.chat_last_id()
+    client.get(f"/events?username={username}&since_id={cursor}&timeout=0")
+    return cursor
+
+def test_nothing_new_answers_after_timeout(server, client, new_user):
+    username = new_user()
+    cursor = current_cursor(server, client, username)
+    started = time.monotonic()
+    events = client.get(f"/events?username={username}&since_id={cursor}&timeout=0.2").get_json()
+    assert time.monotonic() - started >= 0.2
+    assert events["messages"] == [] and events["should_kick"] is False
+
+def test_chat_wakes_a_parked_poll(server, client, new_user, run_command):
+    listener, sender = new_user(), new_user()
+    cursor = current_cursor(server, client, listener)
+    replies = []
+    poll = threading.Thread(target=lambda: replies.append(
+        client.get(f"/events?username={listener}&since_id={cursor}&timeout=10").get_json()))
+    poll.start()
+    deadline = time.monotonic() + 2
+    while server.LONG_POLL_ADMISSION.in_flight == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    assert run_command(sender, "chat", "wake", "up").get_json()["status"] == "success"
+    poll.join(5)
+    assert time.monotonic() - started < 2
+    assert [m["message"] for m in replies[0]["messages"]] == ["wake up"]
+    assert replies[0]["last_id"] > cursor
+
+def test_kick_is_delivered_once(server, client, new_user):
+    username = new_user()
+    cursor = current_cursor(server, client, username)
+    assert client.post("/admin/kick_user", json={"username": username}).get_json()["status"] == "success"
+    events = client.get(f"/events?username={username}&since_id={cursor}&timeout=5").get_json()
+    assert events["should_kick"] is True
+    events = client.get(f"/events?username={username}&since_id={cursor}&timeout=0").get_json()
+    assert events["should_kick"] is False
@@ -0,0 +1,43 @@
+import pytest
+
+from metrics import MetricsRegistry, SamplingProfiler
+
+def test_render_counters_and_histograms():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("endpoint",))
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    requests.inc("/save")
+    requests.inc("/save")
+    latency.observe(0.05)
+    latency.observe(0.5)
+    text = registry.render()
+    assert 'requests_total{endpoint="/save"} 2' in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert "latency_seconds_count 2" in text
+
+def test_profiler_samples_every_nth_call():
+    profiler = SamplingProfiler()
+    profiler.configure(True, 2)
+    for _ in range(4):
+        assert profiler.call(sum, [1, 2]) == 3
+    assert profiler.samples == 2
+
+def test_metrics_endpoint(client):
+    response = client.get("/admin/metrics")
+    assert response.status_code == 200
+    assert "fusionbytes_http_requests_total" in response.get_data(as_text=True)
+
+@pytest.mark.parametrize("body", [{"enabled": True, "sample_every": "abc"}, {"enabled": True, "sample_every": [5]}, None, []])
+def test_profiler_rejects_bad_settings(server, client, body):
+    before = server.PROFILER.sample_every
+    response = client.post("/admin/profiler", json=body)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+    assert server.PROFILER.sample_every == before
+
+def test_profiler_settings(server, client):
+    response = client.post("/admin/profiler", json={"enabled": True, "sample_every": "5"})
+    assert response.status_code == 200
+    assert response.get_json()["sample_every"] == 5
+    response = client.post("/admin/profiler", json={"enabled": False, "sample_every": None})
+    assert response.get_json()["enabled"] is False
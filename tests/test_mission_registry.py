@@ -0,0 +1,116 @@
+import os
+import json
+
+from mission_registry import MissionRegistry
+
+def write_mission(directory, mission_id, requirements=(), title=None, mtime=None):
+    mission = {"id": mission_id, "title": title or mission_id, "description": f"About {mission_id}",
+               "solution": "x", "requirements": list(requirements)}
+    path = directory / f"{mission_id}.json"
+    path.write_text(json.dumps(mission))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+def test_reload_picks_up_changes(tmp_path):
+    write_mission(tmp_path, "first", mtime=1000)
+    registry = MissionRegistry(str(tmp_path))
+    assert registry.reload()
+    assert registry.ids() == ["first"]
+    assert not registry.reload()
+
+    write_mission(tmp_path, "first", title="Renamed", mtime=2000)
+    write_mission(tmp_path, "second")
+    version = registry.version
+    assert registry.reload()
+    assert registry.version == version + 1
+    assert registry.get("first")["title"] == "Renamed"
+    assert "second" in registry
+
+    os.remove(tmp_path / "first.json")
+    registry.reload()
+    assert "first" not in registry and registry.get("first") is None
+
+def test_requirement_index(tmp_path):
+    write_mission(tmp_path, "a")
+    write_mission(tmp_path, "b", ["a"])
+    write_mission(tmp_path, "c", ["a", "b"])
+    registry = MissionRegistry(str(tmp_path))
+    registry.reload()
+    assert registry.available(set()) == ["a"]
+    assert registry.unlocked_by("a", {"a"}) == ["b"]
+    assert registry.unlocked_by("b", {"a", "b"}) == ["c"]
+    assert registry.missing_requirements("c", {"a"}) == ["b"]
+
+def test_public_data_and_listing(tmp_path):
+    write_mission(tmp_path, "a")
+    registry = MissionRegistry(str(tmp_path))
+    registry.reload()
+    assert "solution" not in registry.public("a")
+    listing = registry.listing(lambda mission_id: True)
+    assert "ID: a\nTitle: a\nStatus: COMPLETED\nDescription: About a" in listing
+
+def test_workers_share_bit_numbers(tmp_path):
+    missions = tmp_path / "missions"
+    missions.mkdir()
+    bits_path = str(tmp_path / "mission_bits.json")
+    # Two server processes started before either has numbered anything
+    first = MissionRegistry(str(missions), bit_index_path=bits_path)
+    second = MissionRegistry(str(missions), bit_index_path=bits_path)
+
+    write_mission(missions, "mission_b")
+    first.reload()
+    # Sorted by filename, the second would number mission_a first on its own
+    write_mission(missions, "mission_a")
+    second.reload()
+    first.reload()
+
+    for mission_id in ("mission_a", "mission_b"):
+        assert first.bit(mission_id) == second.bit(mission_id)
+    with open(bits_path) as f:
+        assert json.load(f) == ["mission_b", "mission_a"]
+
+def test_restart_reuses_the_cache(tmp_path):
+    missions = tmp_path / "missions"
+    missions.mkdir()
+    cache = str(tmp_path / "mission_cache.json")
+    for i in range(3):
+        write_mission(missions, f"m{i}", mtime=1000)
+    first = MissionRegistry(str(missions), cache_path=cache)
+    first.reload()
+    assert first.cache_hits == 0
+
+    # Touched but unchanged, matched by hash; changed, parsed again
+    write_mission(missions, "m1", mtime=2000)
+    write_mission(missions, "m2", title="New title", mtime=2000)
+    restarted = MissionRegistry(str(missions), cache_path=cache)
+    restarted.reload()
+    assert restarted.cache_hits == 2
+    assert restarted.ids() == first.ids()
+    assert restarted.get("m2")["title"] == "New title"
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    missions = tmp_path / "missions"
+    missions.mkdir()
+    write_mission(missions, "only")
+    cache = tmp_path / "mission_cache.json"
+    cache.write_text("{not json")
+    registry = MissionRegistry(str(missions), cache_path=str(cache))
+    registry.reload()
+    assert registry.ids() == ["only"] and registry.cache_hits == 0
+    assert json.loads(cache.read_text())["files"]["only.json"]["size"] > 0
+
+def test_completion_set_round_trips(tmp_path):
+    for i in range(10):
+        write_mission(tmp_path, f"m{i}")
+    registry = MissionRegistry(str(tmp_path))
+    registry.reload()
+    completed = registry.completion_set()
+    completed.add("m0")
+    completed.add("m9")  # past the first byte
+    completed.add("unknown")
+    assert "m0" in completed and "m9" in completed
+    assert "m1" not in completed and "unknown" not in completed
+
+    restored = registry.completion_set(completed.encode())
+    assert sorted(restored) == ["m0", "m9"]
+    assert "m9" not in registry.completion_set()
@@ -0,0 +1,69 @@
+import time
+import threading
+
+from moderation import UserSet, PresenceTracker, ModerationStore
+from state_backend import SQLiteBackend
+
+def test_user_set_counts_each_add_once():
+    users = UserSet()
+    added = []
+    threads = [threading.Thread(target=lambda: added.append(users.add("ann"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert added.count(True) == 1
+    assert "ann" in users and users.list() == ["ann"]
+    assert users.discard("ann") and not users.discard("ann")
+
+def test_presence_expires_only_silent_users():
+    presence = PresenceTracker(timeout=10)
+    assert presence.touch("ann")
+    assert presence.touch("bob")
+    assert not presence.touch("ann")
+    start = time.time()
+    presence._last_seen["ann"] = start + 5  # seen again later
+    assert presence.expire(start + 11) == ["bob"]
+    assert presence.list() == ["ann"]
+    assert presence.expire(start + 16) == ["ann"]
+
+def test_presence_thread_wakes_for_earlier_deadline():
+    expired = threading.Event()
+    presence = PresenceTracker(timeout=60, on_expire=lambda username: expired.set())
+    presence.start()
+    presence.touch("slow")
+    presence.timeout = 0.2
+    presence.touch("fast")
+    assert expired.wait(3)
+    assert presence.list() == ["slow"]
+
+def test_sqlite_expiry_wakes_for_new_mute(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "state.db"))
+    expired = threading.Event()
+    backend.start_moderation_expiry(lambda kind, key: expired.set())
+    # Let the loop go to sleep with nothing due, so it would wait a minute
+    time.sleep(0.2)
+
+    backend.set_restriction("muted", "someone", True, time.time() + 1)
+    assert expired.wait(3)
+    assert not backend.is_restricted("muted", "someone")
+
+def test_moderation_survives_restart(tmp_path):
+    path = str(tmp_path / "moderation.log")
+    store = ModerationStore(path, compact_after=3)
+    store.add("banned", "ann")
+    store.add("muted", "bob", time.time() + 60)
+    store.add("muted", "gone", time.time() + 60)
+    store.remove("muted", "gone")  # past compact_after, so this one is in a fresh log
+    store.add("banned_ip", "10.0.0.1", time.time() - 1)
+    store.close()
+    # A write cut off by a crash
+    with open(path, "a") as f:
+        f.write('{"op": "add", "kind": "ban')
+
+    restored = ModerationStore(path)
+    assert restored.list("banned") == ["ann"]
+    assert restored.list("muted") == ["bob"]
+    assert not restored.contains("banned_ip", "10.0.0.1")
+    assert restored.expires("muted", "bob") > time.time()
+    restored.close()
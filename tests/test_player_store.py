@@ -0,0 +1,102 @@
+import threading
+
+import save_codec
+from player_store import PlayerStore
+from user_storage import UserStorage
+
+class SlowStorage(UserStorage):
+    """Storage whose reads of "slow" block until `release` is set."""
+
+    def __init__(self):
+        self.reading = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, username):
+        if username == "slow":
+            self.reading.set()
+            self.release.wait(5)
+        return save_codec.encode({"username": username, "location": ["root"]})
+
+def test_slow_read_does_not_block_other_players():
+    storage = SlowStorage()
+    store = PlayerStore(storage)
+    store.put("fast", {"username": "fast", "location": ["root", "home"]})
+
+    loaded = []
+    reader = threading.Thread(target=lambda: loaded.append(store.get("slow")))
+    reader.start()
+    try:
+        assert storage.reading.wait(2)
+        # Served from memory while the other read is still going
+        fast = []
+        other = threading.Thread(target=lambda: fast.append(store.get("fast")))
+        other.start()
+        other.join(1)
+        assert fast and fast[0]["location"] == ["root", "home"]
+    finally:
+        storage.release.set()
+        reader.join()
+    assert loaded[0]["username"] == "slow"
+
+def test_put_during_read_wins():
+    storage = SlowStorage()
+    store = PlayerStore(storage)
+    reader = threading.Thread(target=store.get, args=("slow",))
+    reader.start()
+    assert storage.reading.wait(2)
+    store.put("slow", {"username": "slow", "location": ["root", "new"]})
+    storage.release.set()
+    reader.join()
+    assert store.get("slow")["location"] == ["root", "new"]
+
+class RecordingStorage(UserStorage):
+    """Storage that records each batch. The first batch blocks until `release` is set."""
+
+    def __init__(self, fail=()):
+        self.batches = []
+        self.fail = set(fail)
+        self.writing = threading.Event()
+        self.release = threading.Event()
+
+    def read(self, username):
+        return None
+
+    def write_many(self, records):
+        self.batches.append([username for username, _ in records])
+        if len(self.batches) == 1:
+            self.writing.set()
+            self.release.wait(5)
+        return [username for username, _ in records if username in self.fail]
+
+def test_flushes_during_a_write_share_the_next_batch():
+    storage = RecordingStorage()
+    store = PlayerStore(storage)
+    store.put("first", {"username": "first"})
+    writer = threading.Thread(target=store.flush, args=("first",))
+    writer.start()
+    assert storage.writing.wait(2)
+
+    results = []
+    waiters = []
+    for i in range(4):
+        store.put(f"p{i}", {"username": f"p{i}"})
+        waiters.append(threading.Thread(target=lambda name=f"p{i}": results.append(store.flush(name))))
+        waiters[-1].start()
+    storage.release.set()
+    for thread in [writer] + waiters:
+        thread.join(5)
+    assert results == [True] * 4
+    assert len(storage.batches) == 2
+    assert sorted(storage.batches[1]) == ["p0", "p1", "p2", "p3"]
+
+def test_failed_write_is_retried():
+    storage = RecordingStorage(fail={"ann"})
+    storage.release.set()
+    store = PlayerStore(storage)
+    store.put("ann", {"username": "ann"})
+    assert not store.flush("ann")
+    storage.fail.clear()
+    assert store.flush("ann")
+    assert storage.batches == [["ann"], ["ann"]]
+    assert store.flush("ann")  # nothing left to write
+    assert len(storage.batches) == 2
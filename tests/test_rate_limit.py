@@ -0,0 +1,54 @@
+import pytest
+
+from rate_limit import RateLimiter, AdmissionControl
+
+def test_bucket_refills_at_rate():
+    limiter = RateLimiter(10, 2)
+    assert limiter.allow("ann") == 0
+    assert limiter.allow("ann") == 0
+    assert 0 < limiter.allow("ann") <= 0.1
+    # Other keys have their own bucket
+    assert limiter.allow("bob") == 0
+
+@pytest.mark.parametrize("budget", [(0, 5), (-1, 5), (1, 0)])
+def test_limiter_rejects_budgets_that_never_refill(budget):
+    with pytest.raises(ValueError):
+        RateLimiter(*budget)
+
+def test_zero_rate_turns_a_budget_off(server):
+    limits = server.build_rate_limits({
+        "/save": {"per_user": [0, 5], "per_ip": [5, 25]},
+        "/sync": {"per_user": None},
+        "chat": {},
+    })
+    assert list(limits["/save"]) == ["per_ip"]
+    assert limits["/sync"] == {}
+    assert limits["chat"] == {}
+
+@pytest.mark.parametrize("limits", [
+    {"/save": {"per_user": [1]}},
+    {"/save": {"per_user": "fast"}},
+    {"/save": {"per_user": [1, 0]}},
+    {"/save": {"per_host": [1, 5]}},
+])
+def test_bad_budget_fails_at_startup(server, limits):
+    with pytest.raises(ValueError):
+        server.build_rate_limits(limits)
+
+@pytest.mark.parametrize("argv, threads", [
+    (["/usr/bin/waitress-serve", "server:app"], 4),
+    (["/usr/bin/waitress-serve", "--threads=12", "server:app"], 12),
+    (["/lib/python3/site-packages/waitress/__main__.py", "--threads", "8", "server:app"], 8),
+    (["server.py"], None),
+])
+def test_thread_count_follows_waitress_serve(server, monkeypatch, argv, threads):
+    monkeypatch.setattr(server.sys, "argv", argv)
+    assert server.waitress_serve_threads() == threads
+
+def test_admission_cap():
+    admission = AdmissionControl(1)
+    assert admission.try_enter()
+    assert not admission.try_enter()
+    admission.leave()
+    assert admission.try_enter()
+    assert admission.rejected == 1
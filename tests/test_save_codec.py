@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+import save_codec
+from save_codec import SaveFormatError
+
+def test_round_trip():
+    record = {"username": "ann", "location": ["root", "home"], "version": 3, "extra": {"a": [1, 2.5, None, True]}}
+    raw = save_codec.encode(record)
+    assert raw.startswith(save_codec.MAGIC)
+    assert save_codec.decode(raw) == record
+
+def test_large_records_are_compressed():
+    record = {"username": "ann", "notes": "x" * 10000}
+    assert len(save_codec.encode(record)) < 1000
+    assert save_codec.decode(save_codec.encode(record)) == record
+
+def test_legacy_json_save_is_migrated():
+    record = save_codec.decode(json.dumps({"username": "ann"}).encode())
+    assert record["progress"] == "fresh_start"
+    assert record["location"] == list(save_codec.DEFAULT_LOCATION)
+
+@pytest.mark.parametrize("schema", [0, 255])
+def test_unknown_schema_is_a_format_error(schema):
+    raw = save_codec.encode({"username": "ann"})
+    corrupted = save_codec.HEADER.pack(save_codec.MAGIC, schema, 0) + raw[save_codec.HEADER.size:]
+    with pytest.raises(SaveFormatError):
+        save_codec.decode(corrupted)
+
+def test_bad_field_type_is_rejected():
+    with pytest.raises(SaveFormatError):
+        save_codec.encode({"username": "ann", "location": "root"})
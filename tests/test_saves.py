@@ -0,0 +1,23 @@
+def test_bad_save_is_rejected_and_not_kept(server, client, new_user, run_command):
+    username = new_user()
+    response = client.post("/save", json={"username": username, "data": {"location": "x"}})
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+    # The record in memory is still the good one, so commands keep working
+    assert server.PLAYER_STORE.get(username)["location"] != "x"
+    response = run_command(username, "cd", "..")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "success"
+    assert server.PLAYER_STORE.flush(username)
+
+def test_save_data_must_be_an_object(client, new_user):
+    username = new_user()
+    response = client.post("/save", json={"username": username, "data": ["root"]})
+    assert response.status_code == 400
+
+def test_good_save_is_kept(server, client, new_user):
+    username = new_user()
+    response = client.post("/save", json={"username": username, "data": {"location": ["root", "home"]}})
+    assert response.status_code == 200
+    assert server.PLAYER_STORE.get(username)["location"] == ["root", "home"]
@@ -0,0 +1,12 @@
+def test_startup_phases_are_reported(server, client):
+    client.get("/get_commands")  # the first request starts the background loading
+    assert server.STARTUP_READY.wait(10)
+    startup = client.get("/admin/startup").get_json()
+    assert startup["ready"] is True
+    assert {"state", "missions", "world_content", "total"} <= set(startup["phases"])
+    assert startup["phases"]["total"] >= startup["phases"]["missions"]
+
+def test_mission_commands_work_once_loaded(server, new_user, run_command):
+    assert server.STARTUP_READY.wait(10)
+    username = new_user()
+    assert run_command(username, "missions").get_json()["status"] == "success"
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from state_backend import InProcessBackend, SQLiteBackend
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        state = InProcessBackend(moderation_file=str(tmp_path / "moderation.log"))
+    else:
+        state = SQLiteBackend(str(tmp_path / "state.db"))
+    yield state
+    state.close()
+
+def test_chat_cursor(backend):
+    first = backend.append_chat("ann", "hi")
+    second = backend.append_chat("bob", "hey", "#ops")
+    assert second["id"] > first["id"]
+    assert backend.chat_last_id() == second["id"]
+    assert [m["message"] for m in backend.chat_since(first["id"])] == ["hey"]
+    assert backend.chat_since(first["id"])[0]["channel"] == "#ops"
+    assert backend.chat_size() == 2
+
+def test_timed_restriction_expires(backend):
+    assert backend.set_muted("ann", True, time.time() + 60)
+    assert not backend.set_muted("ann", True, backend.restriction_expires("muted", "ann"))
+    assert backend.is_muted("ann") and backend.muted_users() == ["ann"]
+    assert backend.set_banned("bob", True, time.time() - 1)
+    assert not backend.is_banned("bob")
+    assert backend.set_muted("ann", False)
+    assert not backend.set_muted("ann", False)
+
+def test_kicks_and_notices_are_taken_once(backend):
+    assert backend.kick("ann")
+    assert backend.is_kicked("ann")
+    assert backend.take_kick("ann")
+    assert not backend.is_kicked("ann")
+    backend.push_notice("ann", {"type": "muted"})
+    assert backend.take_notices("ann") == [{"type": "muted"}]
+    assert backend.take_notices("ann") == []
+
+def test_presence_and_change_feed(backend):
+    version = backend.user_change_version()
+    backend.touch("ann")
+    backend.touch("ann")
+    assert backend.active_users() == ["ann"]
+    backend.remove_active("ann")
+    assert backend.active_users() == []
+    current, changed = backend.user_changes_since(version)
+    assert current > version and changed == ["ann"]
+    assert backend.user_changes_since(current + 10)[1] is None
+
+def test_sqlite_workers_share_state(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+    message = first.append_chat("ann", "from worker one")
+    assert second.chat_since(message["id"] - 1) == [message]
+    first.set_banned("bob", True)
+    assert second.is_banned("bob")
+    second.kick("carl")
+    assert first.take_kick("carl")
+    assert not second.is_kicked("carl")
+    first.close()
+    second.close()
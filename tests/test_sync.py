@@ -0,0 +1,42 @@
+import pytest
+
+def sync(client, username, ops, client_id="client-1", base_version=None):
+    return client.post("/sync", json={
+        "username": username, "client_id": client_id, "base_version": base_version, "ops": ops
+    })
+
+@pytest.mark.parametrize("ops", [
+    {"seq": 1, "op": "location"},
+    ["location"],
+    [None],
+    [{"seq": "one", "op": "location", "location": ["root"]}],
+    [{"seq": None, "op": "location", "location": ["root"]}],
+    [{"seq": [1], "op": "location", "location": ["root"]}],
+])
+def test_malformed_journal_is_rejected(server, client, new_user, ops):
+    username = new_user()
+    version = server.PLAYER_STORE.get(username)["version"]
+    response = sync(client, username, ops)
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+    # Nothing was applied
+    assert server.PLAYER_STORE.get(username)["version"] == version
+
+def test_client_id_must_be_a_string(client, new_user):
+    username = new_user()
+    response = sync(client, username, [], client_id=["a"])
+    assert response.status_code == 400
+
+def test_journal_is_applied_once(server, client, new_user):
+    username = new_user()
+    version = server.PLAYER_STORE.get(username)["version"]
+    ops = [{"seq": "1", "op": "location", "location": ["root", "home"]}]
+    response = sync(client, username, ops, base_version=version)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["applied_seq"] == 1
+    assert data["location"] == ["root", "home"]
+
+    # A retry of the same entry is skipped
+    data = sync(client, username, ops, base_version=data["version"]).get_json()
+    assert data["results"] == []
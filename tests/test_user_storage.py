@@ -0,0 +1,54 @@
+import save_codec
+from user_storage import FileUserStorage, SQLiteUserStorage, migrate
+
+def test_migrate_keeps_real_usernames(tmp_path):
+    source = FileUserStorage(str(tmp_path / "cloud_saves"))
+    source.write_many([
+        ("john doe", save_codec.encode({"username": "john doe", "location": ["root"]})),
+        ("jane", save_codec.encode({"username": "jane", "location": ["root"]})),
+    ])
+    assert source.list_users() == ["jane", "john_doe"]
+
+    target = SQLiteUserStorage(str(tmp_path / "users.db"))
+    migrated, failed = migrate(source, target)
+    assert (migrated, failed) == (2, [])
+    assert target.list_users() == ["jane", "john doe"]
+    assert save_codec.decode(target.read("john doe"))["username"] == "john doe"
+    assert not target.exists("john_doe")
+    target.close()
+
+def test_migrate_skips_unreadable_saves(tmp_path):
+    source = FileUserStorage(str(tmp_path / "cloud_saves"))
+    good = save_codec.encode({"username": "ann"})
+    # A header claiming a schema there is no migration from
+    corrupted = save_codec.HEADER.pack(save_codec.MAGIC, 0, 0) + good[save_codec.HEADER.size:]
+    source.write_many([("ann", good), ("bob", corrupted)])
+
+    target = SQLiteUserStorage(str(tmp_path / "users.db"))
+    assert migrate(source, target) == (1, ["bob"])
+    assert target.list_users() == ["ann"]
+    target.close()
+
+def test_file_write_replaces_whole_save(tmp_path, monkeypatch):
+    storage = FileUserStorage(str(tmp_path / "cloud_saves"))
+    old = save_codec.encode({"username": "ann", "location": ["root"]})
+    assert storage.write_many([("ann", old)]) == []
+
+    # A crash before the rename leaves the old save and no temp file behind
+    def crash(src, dst):
+        raise OSError("disk gone")
+    monkeypatch.setattr("user_storage.os.replace", crash)
+    new = save_codec.encode({"username": "ann", "location": ["root", "home"]})
+    assert storage.write_many([("ann", new)]) == ["ann"]
+    assert storage.read("ann") == old
+    assert sorted(p.name for p in (tmp_path / "cloud_saves").iterdir()) == ["ann.sav"]
+
+def test_file_write_replaces_legacy_json(tmp_path):
+    base = tmp_path / "cloud_saves"
+    base.mkdir()
+    (base / "ann.json").write_text('{"username": "ann", "location": ["root"]}')
+    storage = FileUserStorage(str(base))
+    assert storage.list_users() == ["ann"]
+    storage.write_many([("ann", save_codec.encode({"username": "ann", "location": ["root", "home"]}))])
+    assert sorted(p.name for p in base.iterdir()) == ["ann.sav"]
+    assert save_codec.decode(storage.read("ann"))["location"] == ["root", "home"]
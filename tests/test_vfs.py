@@ -0,0 +1,46 @@
+from vfs import VirtualFS, DirNode
+
+TREE = {
+    "root": {
+        "home": {
+            "notes.txt": "remember the password",
+            "empty": {},
+        },
+        "readme.txt": "hello",
+    }
+}
+
+def test_paths_resolve_with_one_lookup():
+    fs = VirtualFS.from_dict(TREE)
+    assert isinstance(fs.resolve(["root", "home"]), DirNode)
+    assert fs.is_directory(["root", "home", "empty"])
+    assert not fs.is_directory(["root", "readme.txt"])
+    assert fs.resolve(["root", "nowhere"]) is None
+    assert fs.read_file(["root", "home"], "notes.txt") == "remember the password"
+    assert fs.read_file(["root", "home"], "empty") is None
+    assert fs.read_file(["root", "missing"], "notes.txt") is None
+
+def test_listing_is_built_once():
+    fs = VirtualFS.from_dict(TREE)
+    home = fs.get_directory(["root", "home"])
+    assert home.listing() == "Files and folders in this directory:\n - notes.txt\n - empty"
+    assert home.listing() is home.listing()
+
+def test_directory_contents_load_lazily_and_stay_bounded(tmp_path):
+    (tmp_path / "root").mkdir()
+    for i in range(3):
+        (tmp_path / "root" / f"{i}.txt").write_text(f"file {i}")
+    fs = VirtualFS.from_directory(str(tmp_path), content_cache_size=2)
+    assert fs.read_file(["root"], "0.txt") == "file 0"
+
+    # Changes on disk are only seen once the cached copy is pushed out
+    (tmp_path / "root" / "0.txt").write_text("changed")
+    assert fs.read_file(["root"], "0.txt") == "file 0"
+    fs.read_file(["root"], "1.txt")
+    fs.read_file(["root"], "2.txt")
+    assert fs.read_file(["root"], "0.txt") == "changed"
+
+def test_to_dict_round_trip():
+    fs = VirtualFS.from_dict(TREE)
+    assert fs.to_dict() == TREE
+    assert fs.to_dict(contents=False)["root"]["readme.txt"] is None
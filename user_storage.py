@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+
+from werkzeug.utils import secure_filename
+
+import save_codec
+
+# --- Player Record Storage ---
+# Where PlayerStore keeps encoded player records (see save_codec): one file
+# per player in cloud_saves/ (FileUserStorage), or one SQLite database with
+# an indexed username column (SQLiteUserStorage) for large player bases.
+# Picked with "user_storage" in server.json.
+
+class UserStorage:
+    """Interface for storing encoded player records by username."""
+
+    def read(self, username):
+        """The stored bytes, or None if there is no such player."""
+        raise NotImplementedError
+
+    def write_many(self, records):
+        """Stores a list of (username, raw) pairs. Returns the usernames that couldn't be written."""
+        raise NotImplementedError
+
+    def exists(self, username):
+        raise NotImplementedError
+
+    def list_users(self, prefix="", after=None, limit=None):
+        """Usernames in sorted order, optionally only those starting with `prefix`
+        and those after the `after` cursor."""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class FileUserStorage(UserStorage):
+    """One save file per player. Older JSON saves are read and replaced on the next write.
+
+    Each file is written to a temp file, synced and renamed over the old one,
+    so a crash leaves either the old save or the new one, never half of one.
+    The directory is synced once per batch to make the renames stick.
+    """
+
+    extension = ".sav"
+    legacy_extension = ".json"
+
+    def __init__(self, base_dir="cloud_saves"):
+        self.base_dir = os.path.abspath(base_dir)
+
+    def path_for(self, username, extension=None):
+        # Sanitize the username to prevent path traversal
+        safe_username = secure_filename(username)
+        path = os.path.join(self.base_dir, f"{safe_username}{extension or self.extension}")
+        norm_path = os.path.normpath(path)
+        # Ensure the normalized path is within the intended directory
+        if not norm_path.startswith(self.base_dir):
+            raise Exception("Invalid username/path traversal detected")
+        return norm_path
+
+    def _existing_path(self, username):
+        for extension in (self.extension, self.legacy_extension):
+            path = self.path_for(username, extension)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def read(self, username):
+        path = self._existing_path(username)
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def write_many(self, records):
+        failed = []
+        for username, raw in records:
+            try:
+                self._write(username, raw)
+            except Exception as e:
+                print(f"Error saving user data: {e}")
+                failed.append(username)
+        if len(failed) < len(records):
+            self._sync_directory()
+        return failed
+
+    def _write(self, username, raw):
+        path = self.path_for(username)
+        os.makedirs(self.base_dir, exist_ok=True)
+        # The pid keeps worker processes sharing cloud_saves/ off each other's temp files
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        legacy_path = self.path_for(username, self.legacy_extension)
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def _sync_directory(self):
+        try:
+            fd = os.open(self.base_dir, os.O_RDONLY)
+        except OSError:
+            return  # Windows can't open directories, renames there are durable once done
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def exists(self, username):
+        return self._existing_path(username) is not None
+
+    def list_users(self, prefix="", after=None, limit=None):
+        # Has to read the whole directory, use SQLiteUserStorage for big player bases
+        try:
+            filenames = os.listdir(self.base_dir)
+        except OSError:
+            return []
+        names = set()
+        for filename in filenames:
+            name, extension = os.path.splitext(filename)
+            if extension in (self.extension, self.legacy_extension) and name.startswith(prefix):
+                if after is None or name > after:
+                    names.add(name)
+        names = sorted(names)
+        return names[:limit] if limit is not None else names
+
+    def count(self):
+        return len(self.list_users())
+
+class SQLiteUserStorage(UserStorage):
+    """All players in one SQLite table keyed by username, in WAL mode so worker processes can share it.
+
+    Every write_many is one transaction, synced before it returns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    updated REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    def _connect(self):
+        # One connection per thread, sqlite3 connections can't be shared between threads
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            # NORMAL can lose the last commits on power loss, FULL syncs every commit.
+            # PlayerStore batches saves, so that's one sync per batch.
+            db.execute("PRAGMA synchronous=FULL")
+            self._local.db = db
+        return db
+
+    def read(self, username):
+        row = self._connect().execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def write_many(self, records):
+        # One transaction for the whole batch, either every record is written or none is
+        now = time.time()
+        try:
+            with self._connect() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO users (username, data, updated) VALUES (?, ?, ?)",
+                    [(username, raw, now) for username, raw in records]
+                )
+        except sqlite3.Error as e:
+            print(f"Error saving user data: {e}")
+            return [username for username, _ in records]
+        return []
+
+    def exists(self, username):
+        return self._connect().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def list_users(self, prefix="", after=None, limit=None):
+        # A range on the primary key instead of LIKE, so prefix search uses the index
+        query = "SELECT username FROM users WHERE username >= ?"
+        params = [prefix]
+        if prefix:
+            query += " AND username < ?"
+            params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        if after is not None:
+            query += " AND username > ?"
+            params.append(after)
+        query += " ORDER BY username"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [row[0] for row in self._connect().execute(query, params)]
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+def create_user_storage(config):
+    """Picks the storage from server.json: "user_storage" is "files" (default) or "sqlite"."""
+    kind = config.get("user_storage", "files")
+    if kind == "sqlite":
+        return SQLiteUserStorage(config.get("user_db", "users.db"))
+    if kind == "files":
+        return FileUserStorage(config.get("user_dir", "cloud_saves"))
+    raise ValueError(f"Unknown user storage '{kind}'")
+
+# --- Migration ---
+# Copies every player from cloud_saves/ into a SQLite database in one go:
+#
+#   python user_storage.py --from cloud_saves --to users.db
+#
+# Records are validated and upgraded to the current save schema on the way.
+# The source files are left alone, remove them once the server runs with
+# "user_storage": "sqlite".
+MIGRATION_BATCH_SIZE = 500
+
+def migrate(source, target):
+    """Returns how many players were copied and the usernames that failed."""
+    migrated = 0
+    failed = []
+    batch = []
+    for username in source.list_users():
+        try:
+            record = save_codec.decode(source.read(username))
+        except save_codec.SaveFormatError as e:
+            print(f"Skipping {username}: {e}")
+            failed.append(username)
+            continue
+        # File names are sanitized ("john doe" is john_doe.sav), the record has the real name
+        batch.append((record.get("username") or username, save_codec.encode(record)))
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            not_written = target.write_many(batch)
+            migrated += len(batch) - len(not_written)
+            failed += not_written
+            batch = []
+    if batch:
+        not_written = target.write_many(batch)
+        migrated += len(batch) - len(not_written)
+        failed += not_written
+    return migrated, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Move player saves from cloud_saves/ into a SQLite user database.")
+    parser.add_argument("--from", dest="source", default="cloud_saves", help="directory with the save files")
+    parser.add_argument("--to", dest="target", default="users.db", help="SQLite database to write")
+    args = parser.parse_args()
+
+    start = time.time()
+    migrated, failed = migrate(FileUserStorage(args.source), SQLiteUserStorage(args.target))
+    print(f"Migrated {migrated} players to {args.target} in {time.time() - start:.1f}s")
+    if failed:
+        print(f"{len(failed)} players could not be migrated: {', '.join(failed)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Virtual File System ---
+# Shared by the server (server.py) and the offline client (main.py).
+# Every directory and file is a node with an interned path tuple, and all
+# nodes sit in one flat path -> node index, so resolving a player's location
+# is a single dict lookup instead of a walk from the root.
+
+class FileNode:
+    __slots__ = ("name", "path", "_content", "source")
+
+    def __init__(self, name, path, content=None, source=None):
+        self.name = name
+        self.path = path
+        self._content = content
+        self.source = source  # file on disk to load the content from, if any
+
+class DirNode:
+    __slots__ = ("name", "path", "children", "_listing")
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.children = {}
+        self._listing = None
+
+    def listing(self):
+        # Directory contents never change at runtime, so the `ls` output is built once
+        if self._listing is None:
+            output = "Files and folders in this directory:\n"
+            output += "\n".join([f" - {item}" for item in self.children])
+            self._listing = output
+        return self._listing
+
+class VirtualFS:
+    def __init__(self, content_cache_size=256, loader=None):
+        self.root = DirNode("", ())
+        self.index = {(): self.root}
+        self.content_cache_size = content_cache_size
+        # loader(path) fetches the content of files given without one, or returns None
+        self.loader = loader
+        self._content_cache = OrderedDict()  # path -> content of files loaded from disk or by the loader
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def from_dict(cls, tree, **kwargs):
+        """Builds the file system from nested dicts: dicts are directories, strings are files.
+
+        None is a file whose content is only fetched with `loader` when it is read.
+        """
+        fs = cls(**kwargs)
+        fs._add_dict(fs.root, tree)
+        return fs
+
+    @classmethod
+    def from_directory(cls, base_dir, **kwargs):
+        """Builds the file system from a directory on disk. File contents are only read when needed."""
+        fs = cls(**kwargs)
+        fs._add_directory(fs.root, base_dir)
+        return fs
+
+    def resolve(self, location):
+        return self.index.get(tuple(location))
+
+    def get_directory(self, location):
+        node = self.resolve(location)
+        return node if isinstance(node, DirNode) else None
+
+    def is_directory(self, location):
+        return isinstance(self.resolve(location), DirNode)
+
+    def read_file(self, location, name):
+        """Returns the content of file `name` in `location`, or None if there is no such file."""
+        directory = self.get_directory(location)
+        if directory is None:
+            return None
+        node = directory.children.get(name)
+        if not isinstance(node, FileNode):
+            return None
+        return self.content(node)
+
+    def content(self, node):
+        if node.source is None and (node._content is not None or self.loader is None):
+            return node._content
+        with self._cache_lock:
+            if node.path in self._content_cache:
+                self._content_cache.move_to_end(node.path)
+                return self._content_cache[node.path]
+        if node.source is not None:
+            with open(node.source, "r", encoding="utf-8") as f:
+                content = f.read()
+        else:
+            content = self.loader(node.path)
+            if content is None:
+                return None  # not available right now, try again next time
+        with self._cache_lock:
+            self._content_cache[node.path] = content
+            while len(self._content_cache) > self.content_cache_size:
+                self._content_cache.popitem(last=False)
+        return content
+
+    def preload(self, workers=8):
+        """Reads file contents from disk into the cache (as many as fit) on `workers` threads. Returns how many."""
+        nodes = [node for node in self.index.values() if isinstance(node, FileNode) and node.source is not None]
+        nodes = nodes[:self.content_cache_size]
+        if not nodes:
+            return 0
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="world") as pool:
+            return sum(pool.map(self._preload_node, nodes))
+
+    def _preload_node(self, node):
+        try:
+            self.content(node)
+            return 1
+        except (OSError, UnicodeDecodeError):
+            return 0  # reported when someone actually reads it
+
+    def to_dict(self, node=None, contents=True):
+        """The nested dict form of the tree, loading file contents as needed.
+
+        With contents=False files are None, for a copy that fetches them on demand.
+        """
+        node = node or self.root
+        tree = {}
+        for name, child in node.children.items():
+            if isinstance(child, DirNode):
+                tree[name] = self.to_dict(child, contents)
+            else:
+                tree[name] = self.content(child) if contents else None
+        return tree
+
+    # --- Building the tree ---
+    def _add_node(self, parent, node):
+        parent.children[node.name] = node
+        self.index[node.path] = node
+
+    def _add_dict(self, parent, tree):
+        for name, value in tree.items():
+            name = sys.intern(name)
+            path = parent.path + (name,)
+            if isinstance(value, dict):
+                node = DirNode(name, path)
+                self._add_node(parent, node)
+                self._add_dict(node, value)
+            else:
+                self._add_node(parent, FileNode(name, path, content=value))
+
+    def _add_directory(self, parent, directory):
+        for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+            name = sys.intern(entry.name)
+            path = parent.path + (name,)
+            if entry.is_dir():
+                node = DirNode(name, path)
+                self._add_node(parent, node)
+                self._add_directory(node, entry.path)
+            elif entry.is_file():
+                self._add_node(parent, FileNode(name, path, source=entry.path))